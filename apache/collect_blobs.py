@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+"""
+Remove the deduplicated documents in the ``.blobs`` directory of the schema
+directory that no job or service links to any more.
+
+The server may keep running while this is done. A document that is removed
+just as a job is submitted with it is stored again by the server.
+"""
+from topchef import configuration
+from topchef.models import SchemaDirectoryOrganizer
+
+file_manager = SchemaDirectoryOrganizer(configuration.SCHEMA_DIRECTORY)
+blobs_removed = file_manager.blobs.collect_garbage()
+print('Removed %d unused documents' % blobs_removed)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+Bring an existing TopChef database up to date with the current tables.
+
+Run with ``--copy-job-storage`` to also copy the parameters and results of
+existing jobs from the schema directory into the database, before setting
+``JOB_STORAGE=database``.
+"""
+import argparse
+from topchef import configuration
+from topchef.migrations import upgrade
+from topchef.models import FILE_MANAGER
+from topchef.storage import migrate_to_database
+from sqlalchemy.orm import sessionmaker
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    '--copy-job-storage', action='store_true',
+    help='Copy job parameters and results from the schema directory into '
+         'the jobs table'
+)
+arguments = parser.parse_args()
+
+upgrade(configuration.database_engine)
+
+if arguments.copy_job_storage:
+    session = sessionmaker(bind=configuration.database_engine)()
+    jobs_copied = migrate_to_database(session, FILE_MANAGER)
+    print('Copied %d jobs into the database' % jobs_copied)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+Move the job directories of the schema directory from the flat layout to
+the sharded layout.
+
+The server may keep running while this is done. Set
+``SCHEMA_DIRECTORY_LAYOUT=migrating`` on the server first, run this script,
+and then set ``SCHEMA_DIRECTORY_LAYOUT=sharded``.
+"""
+import argparse
+from topchef import configuration
+from topchef.models import SchemaDirectoryOrganizer, shard_schema_directory
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    '--batch-size', type=int, default=1000,
+    help='The number of job directories moved between pauses'
+)
+parser.add_argument(
+    '--pause', type=float, default=0.1,
+    help='The number of seconds to sleep between batches'
+)
+arguments = parser.parse_args()
+
+file_manager = SchemaDirectoryOrganizer(
+    configuration.SCHEMA_DIRECTORY, 'migrating'
+)
+jobs_moved = shard_schema_directory(
+    file_manager, batch_size=arguments.batch_size, pause=arguments.pause
+)
+print('Moved %d job directories' % jobs_moved)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Time the queries behind the queue, "next job" and job list endpoints on a
+large ``jobs`` table, with and without the indexes declared in
+:mod:`topchef.database`.
+
+Run this against a throwaway database. For example,
+
+::
+
+    python benchmarks/job_queries.py --rows 1000000
+    python benchmarks/job_queries.py --rows 1000000 \\
+        --database-uri postgresql://localhost/topchef_benchmark
+
+At 1,000,000 rows on SQLite 3, the fastest of 5 runs of each query was
+
+=============  ===============  ============
+Query          Without indexes  With indexes
+=============  ===============  ============
+queue head     118.9 ms         0.28 ms
+next job       129.3 ms         0.28 ms
+job page       155.0 ms         0.34 ms
+service page   129.4 ms         0.38 ms
+=============  ===============  ============
+
+PostgreSQL has not been measured yet.
+"""
+import argparse
+import os
+import random
+import tempfile
+import timeit
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, select, and_
+from topchef.database import METADATA, jobs, services
+
+STATUSES = ('REGISTERED', 'WORKING', 'COMPLETED')
+
+
+def populate(engine, rows, service_count, chunk_size=10000):
+    service_ids = [uuid.uuid1() for _ in range(service_count)]
+    engine.execute(services.insert(), [
+        {
+            'service_id': service_id, 'name': 'Service %d' % number,
+            'description': 'Benchmark service',
+            'last_checked_in': datetime.utcnow(),
+            'heartbeat_timeout_seconds': 30, 'is_service_available': True
+        } for number, service_id in enumerate(service_ids)
+    ])
+
+    start = datetime(2016, 1, 1)
+    for offset in range(0, rows, chunk_size):
+        engine.execute(jobs.insert(), [
+            {
+                'job_id': uuid.uuid1(),
+                'service_id': random.choice(service_ids),
+                'date_submitted': start + timedelta(seconds=number),
+                # Most jobs of a long-running service are finished
+                'status': random.choice(STATUSES[1:])
+                if random.random() < 0.99 else 'REGISTERED'
+            } for number in range(offset, min(offset + chunk_size, rows))
+        ])
+
+    return service_ids
+
+
+def queries(service_id, date_submitted):
+    return {
+        'queue head': select([jobs.c.job_id]).where(and_(
+            jobs.c.service_id == service_id,
+            jobs.c.status == 'REGISTERED'
+        )).order_by(
+            jobs.c.priority.desc(), jobs.c.date_submitted
+        ).limit(1),
+        'next job': select([jobs.c.job_id]).where(and_(
+            jobs.c.service_id == service_id,
+            jobs.c.date_submitted > date_submitted
+        )).order_by(jobs.c.date_submitted).limit(1),
+        'job page': select([jobs.c.job_id]).where(
+            jobs.c.date_submitted > date_submitted
+        ).order_by(jobs.c.date_submitted, jobs.c.job_id).limit(100),
+        'service page': select([jobs.c.job_id]).where(and_(
+            jobs.c.service_id == service_id,
+            jobs.c.date_submitted > date_submitted
+        )).order_by(jobs.c.date_submitted, jobs.c.job_id).limit(100)
+    }
+
+
+def time_queries(engine, service_id, date_submitted, repeats):
+    with engine.connect() as connection:
+        for name, query in sorted(queries(service_id, date_submitted).items()):
+            seconds = min(timeit.repeat(
+                lambda: connection.execute(query).fetchall(),
+                number=1, repeat=repeats
+            ))
+            print('    %-12s %10.3f ms' % (name, seconds * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--services', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--database-uri', default=None)
+    arguments = parser.parse_args()
+
+    database_uri = arguments.database_uri
+    if database_uri is None:
+        database_file = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        database_uri = 'sqlite:///%s' % database_file
+
+    engine = create_engine(database_uri)
+    METADATA.drop_all(bind=engine)
+    METADATA.create_all(bind=engine)
+
+    for index in jobs.indexes:
+        index.drop(bind=engine)
+
+    print('Inserting %d jobs into %s' % (arguments.rows, database_uri))
+    service_ids = populate(engine, arguments.rows, arguments.services)
+    middle = datetime(2016, 1, 1) + timedelta(seconds=arguments.rows // 2)
+
+    print('Without indexes')
+    time_queries(engine, service_ids[0], middle, arguments.repeats)
+
+    for index in jobs.indexes:
+        index.create(bind=engine)
+
+    print('With indexes')
+    time_queries(engine, service_ids[0], middle, arguments.repeats)
+
+    METADATA.drop_all(bind=engine)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Time the registration of job directories, and the reading of job parameter
+files, in the flat and sharded layouts of the schema directory.
+
+Run this on the file system that holds the schema directory. For example,
+
+::
+
+    python benchmarks/schema_directory.py --jobs 1000000 \\
+        --directory /var/www/topchef/benchmark
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from topchef.models import SchemaDirectoryOrganizer
+
+
+class BenchmarkService(object):
+    def __init__(self):
+        self.id = uuid.uuid1()
+
+
+class BenchmarkJob(object):
+    """
+    Stands in for a job, with the attributes that the organizer reads
+    """
+    def __init__(self, service):
+        self.id = uuid.uuid1()
+        self.parent_service = service
+        self.service_id = service.id
+
+
+def time_layout(layout, root_path, job_count, reads, report_every):
+    file_manager = SchemaDirectoryOrganizer(root_path, layout)
+    service = BenchmarkService()
+    os.mkdir(os.path.join(root_path, str(service.id)))
+
+    jobs = []
+    start = time.time()
+    batch_start = start
+
+    for number in range(1, job_count + 1):
+        job = BenchmarkJob(service)
+        file_manager._register_job(job)
+        with open(os.path.join(
+                file_manager._job_path(service.id, job.id),
+                file_manager.JOB_PARAMETER_FILE_NAME
+        ), 'w') as parameter_file:
+            parameter_file.write('{"value": 1}')
+        jobs.append(job.id)
+
+        if number % report_every == 0:
+            now = time.time()
+            print('    %-8s %9d jobs: %8.3f ms per registration' % (
+                layout, number, (now - batch_start) * 1000 / report_every
+            ))
+            batch_start = now
+
+    print('    %-8s registered %d jobs in %.1f s' % (
+        layout, job_count, time.time() - start
+    ))
+
+    sample = random.sample(jobs, min(reads, len(jobs)))
+    start = time.time()
+
+    for job_id in sample:
+        path = os.path.join(
+            file_manager._job_path(service.id, job_id),
+            file_manager.JOB_PARAMETER_FILE_NAME
+        )
+        with open(path) as parameter_file:
+            parameter_file.read()
+
+    print('    %-8s %8.3f ms per random read' % (
+        layout, (time.time() - start) * 1000 / len(sample)
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=1000000)
+    parser.add_argument('--reads', type=int, default=10000)
+    parser.add_argument('--report-every', type=int, default=100000)
+    parser.add_argument('--directory', default=None)
+    arguments = parser.parse_args()
+
+    for layout in ('flat', 'sharded'):
+        root_path = tempfile.mkdtemp(dir=arguments.directory)
+        try:
+            print('Registering %d jobs in the %s layout under %s' % (
+                arguments.jobs, layout, root_path
+            ))
+            time_layout(
+                layout, root_path, arguments.jobs, arguments.reads,
+                arguments.report_every
+            )
+        finally:
+            shutil.rmtree(root_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""
+Contains the pytest configuration for the unit tests
+"""
+import sys
+
+collect_ignore = []
+
+if sys.version_info < (3, 5):
+    # The ASGI entry point uses async syntax
+    collect_ignore.append('test_asgi.py')
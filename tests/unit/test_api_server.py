@@ -2,18 +2,30 @@
 Contains unit tests for :mod:`topchef.api_server`
 """
 import mock
+import io
 import json
 import os
+import zlib
 import pytest
+from datetime import datetime
 from flask import jsonify
-from uuid import UUID
+from uuid import UUID, uuid1
 from topchef.api_server import app
+from topchef.models import Service, Job
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import IntegrityError
 from topchef.config import config
 from topchef.database import METADATA
 import topchef.api_server as server
-from sqlalchemy.orm import sessionmaker
+from topchef import storage
+from topchef.schema_documents import get_schema_document
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
 
 try:
     DATABASE_URI = os.environ['DATABASE_URI']
@@ -54,7 +66,7 @@ def database(schema_directory):
     config._engine = engine
 
     METADATA.create_all(bind=engine)
-    server.SESSION_FACTORY = sessionmaker(bind=engine)
+    server.SESSION_FACTORY = scoped_session(sessionmaker(bind=engine))
 
 @contextmanager
 def app_client(endpoint):
@@ -331,6 +343,185 @@ class TestGetJobQueue(object):
         assert response.status_code == 200
         assert json.loads(response.data.decode('utf-8')) == {'data': []}
 
+
+class TestJobPriority(object):
+    @pytest.fixture
+    def prioritized_jobs(self, posted_service):
+        endpoint = '/services/%s/jobs' % str(posted_service)
+        job_ids = []
+
+        with app_client(endpoint) as client:
+            for priority in (0, 5, 1):
+                response = client.post(
+                    endpoint, headers={'Content-Type': 'application/json'},
+                    data=json.dumps(
+                        dict(VALID_JOB_SCHEMA, priority=priority)
+                    )
+                )
+                assert response.status_code == 201
+                job_ids.append(json.loads(
+                    response.data.decode('utf-8')
+                )['data']['job_details']['id'])
+
+        return job_ids
+
+    def test_queue_order(self, posted_service, prioritized_jobs):
+        endpoint = '/services/%s/queue' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        queue = json.loads(response.data.decode('utf-8'))['data']
+
+        assert [job['id'] for job in queue] == [
+            prioritized_jobs[1], prioritized_jobs[2], prioritized_jobs[0]
+        ]
+        assert [job['priority'] for job in queue] == [5, 1, 0]
+
+    def test_claim_highest_priority(self, posted_service, prioritized_jobs):
+        endpoint = '/services/%s/queue/claim' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            response = client.post(endpoint)
+
+        assert json.loads(
+            response.data.decode('utf-8')
+        )['data']['job_details']['id'] == prioritized_jobs[1]
+
+    def test_change_priority(self, posted_service, prioritized_jobs):
+        job_endpoint = '/jobs/%s' % prioritized_jobs[0]
+        claim_endpoint = '/services/%s/queue/claim' % str(posted_service)
+
+        with app_client(job_endpoint) as client:
+            job_details = json.loads(
+                client.get(job_endpoint).data.decode('utf-8')
+            )['data']
+            job_details['priority'] = 10
+            client.put(
+                job_endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(job_details)
+            )
+
+            response = client.post(claim_endpoint)
+
+        assert json.loads(
+            response.data.decode('utf-8')
+        )['data']['job_details']['id'] == prioritized_jobs[0]
+
+    @pytest.mark.parametrize('priority', ['urgent', 2.7])
+    def test_invalid_priority(self, posted_service, priority):
+        endpoint = '/services/%s/jobs' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            response = client.post(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(dict(VALID_JOB_SCHEMA, priority=priority))
+            )
+
+        assert response.status_code == 400
+
+    def test_change_priority_not_integer(self, posted_job):
+        endpoint = '/jobs/%s' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            response = client.put(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(dict(VALID_JOB_SCHEMA, priority=2.5))
+            )
+
+        assert response.status_code == 400
+
+class TestJobExport(object):
+    def test_export_ndjson(self, posted_service, posted_job, next_job):
+        endpoint = '/services/%s/jobs/export?format=ndjson' % str(
+            posted_service
+        )
+
+        with mock.patch.object(config, 'JOB_EXPORT_BATCH_SIZE', 1):
+            with app_client(endpoint) as client:
+                response = client.get(endpoint)
+
+                assert response.status_code == 200
+                assert response.is_streamed
+                assert response.mimetype == 'application/x-ndjson'
+
+                lines = response.data.decode('utf-8').splitlines()
+
+        rows = [json.loads(line) for line in lines]
+
+        assert [row['id'] for row in rows] == [
+            str(posted_job), str(next_job)
+        ]
+        for row in rows:
+            assert row['parameters'] == VALID_JOB_SCHEMA['parameters']
+            assert 'result' in row
+
+    def test_export_no_jobs(self, posted_service):
+        endpoint = '/services/%s/jobs/export' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+            assert response.status_code == 200
+            assert response.data == b''
+
+    def test_export_npz(self, posted_service, posted_job, next_job):
+        numpy = pytest.importorskip('numpy')
+        job_endpoint = '/jobs/%s' % str(posted_job)
+        endpoint = '/services/%s/jobs/export?format=npz' % str(
+            posted_service
+        )
+
+        with app_client(endpoint) as client:
+            job_details = json.loads(
+                client.get(job_endpoint).data.decode('utf-8')
+            )['data']
+            job_details['status'] = 'COMPLETED'
+            client.put(
+                job_endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(job_details)
+            )
+
+            response = client.get(endpoint)
+
+            assert response.status_code == 200
+            archive = numpy.load(io.BytesIO(response.data))
+
+            assert list(archive['id']) == [posted_job.hex.encode('ascii')]
+            assert list(archive['parameters.value']) == [
+                VALID_JOB_SCHEMA['parameters']['value']
+            ]
+
+    def test_export_npz_without_numpy(self, posted_service):
+        endpoint = '/services/%s/jobs/export?format=npz' % str(
+            posted_service
+        )
+
+        with mock.patch('topchef.export.numpy', None):
+            with app_client(endpoint) as client:
+                response = client.get(endpoint)
+
+        assert response.status_code == 501
+
+    def test_export_unknown_format(self, posted_service):
+        endpoint = '/services/%s/jobs/export?format=xml' % str(
+            posted_service
+        )
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 400
+
+    def test_export_no_service(self, database):
+        endpoint = '/services/%s/jobs/export' % str(uuid1())
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 404
+
+
 class TestPutJob(object):
     @staticmethod
     def get_job_details(endpoint):
@@ -381,6 +572,191 @@ class TestPutJob(object):
         assert response.status_code == 404
 
 
+class TestJobResult(object):
+    RESULT = {'spectrum': [float(index) for index in range(100)]}
+
+    @pytest.fixture
+    def job_with_result(self, posted_job):
+        endpoint = '/jobs/%s' % posted_job
+
+        with mock.patch.object(config, 'RESULT_COMPRESSION_THRESHOLD', 10):
+            with app_client(endpoint) as client:
+                response = client.put(
+                    endpoint, headers={'Content-Type': 'application/json'},
+                    data=json.dumps({
+                        'parameters': {'value': 1}, 'result': self.RESULT
+                    })
+                )
+
+        assert response.status_code == 200
+        return posted_job
+
+    def test_gzip_accepted(self, job_with_result):
+        endpoint = '/jobs/%s/result' % job_with_result
+
+        with app_client(endpoint) as client:
+            response = client.get(
+                endpoint, headers={'Accept-Encoding': 'gzip'}
+            )
+
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+
+        data = zlib.decompress(response.data, 16 + zlib.MAX_WBITS)
+        assert json.loads(data.decode('utf-8')) == self.RESULT
+
+    def test_gzip_not_accepted(self, job_with_result):
+        endpoint = '/jobs/%s/result' % job_with_result
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 200
+        assert 'Content-Encoding' not in response.headers
+        assert json.loads(response.data.decode('utf-8')) == self.RESULT
+
+    def test_gzip_refused(self, job_with_result):
+        endpoint = '/jobs/%s/result' % job_with_result
+
+        with app_client(endpoint) as client:
+            response = client.get(
+                endpoint, headers={'Accept-Encoding': 'gzip;q=0'}
+            )
+
+        assert response.status_code == 200
+        assert 'Content-Encoding' not in response.headers
+        assert json.loads(response.data.decode('utf-8')) == self.RESULT
+
+    def test_identity_etag_sent_by_gzip_client(self, job_with_result):
+        endpoint = '/jobs/%s/result' % job_with_result
+
+        with app_client(endpoint) as client:
+            identity_etag = client.get(endpoint).headers['ETag']
+            response = client.get(endpoint, headers={
+                'Accept-Encoding': 'gzip', 'If-None-Match': identity_etag
+            })
+
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['ETag'] != identity_etag
+
+        data = zlib.decompress(response.data, 16 + zlib.MAX_WBITS)
+        assert json.loads(data.decode('utf-8')) == self.RESULT
+
+    def test_job_details(self, job_with_result):
+        endpoint = '/jobs/%s' % job_with_result
+
+        job_details = TestPutJob.get_job_details(endpoint)
+
+        assert job_details['result'] == self.RESULT
+
+    def test_job_details_link_result(self, job_with_result):
+        endpoint = '/jobs/%s' % job_with_result
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        result_link = json.loads(response.data.decode('utf-8'))['meta'][
+            'result'
+        ]
+        assert result_link.endswith('/jobs/%s/result' % job_with_result)
+
+    def test_no_job(self, database):
+        endpoint = '/jobs/%s/result' % uuid1()
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 404
+
+
+class TestJobAttachments(object):
+    DATA = bytes(bytearray(range(256))) * 1000
+
+    def test_round_trip(self, posted_job):
+        endpoint = '/jobs/%s/attachments/spectrum.npy' % posted_job
+
+        with mock.patch.object(config, 'ATTACHMENT_CHUNK_SIZE', 4096):
+            with app_client(endpoint) as client:
+                response = client.put(endpoint, data=self.DATA)
+
+        assert response.status_code == 201
+        assert response.headers['Location'].endswith(endpoint)
+
+        details = json.loads(response.data.decode('utf-8'))['data']
+        assert details['size'] == len(self.DATA)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/octet-stream'
+        assert response.data == self.DATA
+
+        with app_client(endpoint) as client:
+            response = client.get(
+                endpoint, headers={'If-None-Match': response.headers['ETag']}
+            )
+
+        assert response.status_code == 304
+
+    def test_lease_held(self, posted_service, posted_job):
+        endpoint = '/jobs/%s/attachments/spectrum.npy' % posted_job
+
+        with app_client(endpoint) as client:
+            TestJobLease.claim(client, posted_service)
+            response = client.put(endpoint + '?attempt=1', data=self.DATA)
+
+        assert response.status_code == 201
+
+    @pytest.mark.parametrize('query', ['', '?attempt=2', '?attempt=one'])
+    def test_lease_not_held(self, posted_service, posted_job, query):
+        endpoint = '/jobs/%s/attachments/spectrum.npy' % posted_job
+
+        with app_client(endpoint) as client:
+            TestJobLease.claim(client, posted_service)
+            response = client.put(endpoint + query, data=self.DATA)
+
+        assert response.status_code == 409
+
+        with app_client(endpoint) as client:
+            assert client.get(endpoint).status_code == 404
+
+    def test_invalid_name(self, posted_job):
+        endpoint = '/jobs/%s/attachments/.hidden' % posted_job
+
+        with app_client(endpoint) as client:
+            response = client.put(endpoint, data=self.DATA)
+
+        assert response.status_code == 400
+
+    def test_too_large(self, posted_job):
+        endpoint = '/jobs/%s/attachments/spectrum.npy' % posted_job
+
+        with mock.patch.object(config, 'ATTACHMENT_MAX_SIZE', 10):
+            with app_client(endpoint) as client:
+                response = client.put(endpoint, data=self.DATA)
+
+        assert response.status_code == 413
+
+    def test_no_attachment(self, posted_job):
+        endpoint = '/jobs/%s/attachments/spectrum.npy' % posted_job
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 404
+
+    def test_no_job(self, database):
+        endpoint = '/jobs/%s/attachments/spectrum.npy' % uuid1()
+
+        with app_client(endpoint) as client:
+            response = client.put(endpoint, data=self.DATA)
+
+        assert response.status_code == 404
+
+
 @pytest.fixture
 def next_job(database, posted_job, posted_service):
     endpoint = '/services/%s/jobs' % str(posted_service)
@@ -424,3 +800,776 @@ class TestNextJob(object):
 
         assert response.status_code == 302
 
+    def test_next_job_other_service(self, posted_job):
+        with app_client('/services') as client:
+            response = client.post(
+                '/services', headers={'Content-Type': 'application/json'},
+                data=json.dumps(JOB_REGISTRATION_SCHEMA)
+            )
+            other_service = json.loads(
+                response.data.decode('utf-8')
+            )['data']['service_details']['id']
+
+            endpoint = '/services/%s/jobs' % other_service
+            response = client.post(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(VALID_JOB_SCHEMA)
+            )
+            assert response.status_code == 201
+
+            response = client.get('/jobs/%s/next' % str(posted_job))
+
+        assert response.status_code == 204
+
+
+class TestClaimJob(object):
+    def test_claim_job(self, posted_service, posted_job):
+        endpoint = '/services/%s/queue/claim' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            response = client.post(endpoint)
+
+        assert response.status_code == 200
+
+        job_details = json.loads(
+            response.data.decode('utf-8')
+        )['data']['job_details']
+
+        assert job_details['id'] == str(posted_job)
+        assert job_details['status'] == 'WORKING'
+
+    def test_claim_leases_job(self, posted_service, posted_job):
+        endpoint = '/services/%s/queue/claim' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            client.post(endpoint)
+
+        job = server.SESSION_FACTORY().query(Job).filter_by(
+            id=posted_job
+        ).one()
+
+        assert job.lease_expires_at > datetime.utcnow()
+
+    def test_claim_empty_queue(self, posted_service, posted_job):
+        endpoint = '/services/%s/queue/claim' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            first_response = client.post(endpoint)
+            second_response = client.post(endpoint)
+
+        assert first_response.status_code == 200
+        assert second_response.status_code == 204
+
+    def test_claim_oldest_job_first(self, posted_service, posted_job,
+                                    next_job):
+        endpoint = '/services/%s/queue/claim' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            response = client.post(endpoint)
+
+        assert json.loads(
+            response.data.decode('utf-8')
+        )['data']['job_details']['id'] == str(posted_job)
+
+    def test_claim_no_service(self, database):
+        service_id = 'd753ddf0-7053-11e6-b1ce-843a4b768af4'
+        endpoint = '/services/%s/queue/claim' % service_id
+
+        with app_client(endpoint) as client:
+            response = client.post(endpoint)
+
+        assert response.status_code == 404
+
+
+class TestJobLease(object):
+    @staticmethod
+    def claim(client, service_id):
+        endpoint = '/services/%s/queue/claim' % str(service_id)
+        return client.post(endpoint)
+
+    @staticmethod
+    def expire_lease(job_id):
+        session = server.SESSION_FACTORY()
+        job = session.query(Job).filter_by(id=job_id).one()
+        job.lease_expires_at = datetime(2016, 1, 1)
+        session.commit()
+        server.SESSION_FACTORY.remove()
+
+    def test_renew_lease(self, posted_service, posted_job):
+        endpoint = '/jobs/%s/lease' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            self.claim(client, posted_service)
+            response = client.patch(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps({'attempt': 1, 'seconds': 3000})
+            )
+
+        assert response.status_code == 200
+
+        lease_expires_at = json.loads(
+            response.data.decode('utf-8')
+        )['data']['lease_expires_at']
+
+        job = server.SESSION_FACTORY().query(Job).filter_by(
+            id=posted_job
+        ).one()
+
+        assert job.lease_expires_at.isoformat() == lease_expires_at
+
+    @staticmethod
+    def renew(client, job_id, attempt):
+        return client.patch(
+            '/jobs/%s/lease' % str(job_id),
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps({'attempt': attempt})
+        )
+
+    def test_renew_lease_not_working(self, posted_job):
+        with app_client('/') as client:
+            response = self.renew(client, posted_job, 0)
+
+        assert response.status_code == 409
+
+    def test_renew_lease_no_job(self, database):
+        with app_client('/') as client:
+            response = self.renew(client, uuid1(), 1)
+
+        assert response.status_code == 404
+
+    def test_renew_lease_without_attempt(self, posted_service, posted_job):
+        endpoint = '/jobs/%s/lease' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            self.claim(client, posted_service)
+            response = client.patch(endpoint)
+
+        assert response.status_code == 400
+
+    def test_renew_lease_other_attempt(self, posted_service, posted_job):
+        with app_client('/') as client:
+            self.claim(client, posted_service)
+            self.expire_lease(posted_job)
+            self.claim(client, posted_service)
+
+            assert self.renew(client, posted_job, 1).status_code == 409
+            assert self.renew(client, posted_job, 2).status_code == 200
+
+    def test_renew_expired_lease(self, posted_service, posted_job):
+        with app_client('/') as client:
+            self.claim(client, posted_service)
+            self.expire_lease(posted_job)
+
+            response = self.renew(client, posted_job, 1)
+
+        assert response.status_code == 409
+
+    def test_update_without_claim(self, posted_job):
+        endpoint = '/jobs/%s' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            responses = [
+                client.put(
+                    endpoint, headers={'Content-Type': 'application/json'},
+                    data=json.dumps(dict(VALID_JOB_SCHEMA, status=status))
+                ) for status in ('WORKING', 'COMPLETED')
+            ]
+
+        assert [response.status_code for response in responses] == [
+            200, 200
+        ]
+
+    def test_working_without_claim_not_leased(self, posted_job):
+        endpoint = '/jobs/%s' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            client.put(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(dict(VALID_JOB_SCHEMA, status='WORKING'))
+            )
+
+        job = server.SESSION_FACTORY().query(Job).filter_by(
+            id=posted_job
+        ).one()
+
+        assert job.status == 'WORKING'
+        assert job.lease_expires_at is None
+
+    def test_update_requires_lease(self, posted_service, posted_job):
+        endpoint = '/jobs/%s' % str(posted_job)
+        update = {
+            'parameters': VALID_JOB_SCHEMA['parameters'],
+            'status': 'COMPLETED', 'result': {'value': 3}
+        }
+
+        with app_client(endpoint) as client:
+            self.claim(client, posted_service)
+            self.expire_lease(posted_job)
+            self.claim(client, posted_service)
+
+            stale_response = client.put(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(dict(update, attempt=1))
+            )
+            response = client.put(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(dict(update, attempt=2))
+            )
+
+        assert stale_response.status_code == 409
+        assert response.status_code == 200
+
+    def test_batch_update_requires_lease(self, posted_service, posted_job):
+        with app_client('/') as client:
+            self.claim(client, posted_service)
+            response = client.put(
+                '/jobs:batch', headers={'Content-Type': 'application/json'},
+                data=json.dumps([{'id': str(posted_job), 'status': 'FAILED'}])
+            )
+
+        assert response.status_code == 400
+        assert 'attempt 1' in json.loads(
+            response.data.decode('utf-8')
+        )['data'][0]['errors']
+
+    @pytest.mark.parametrize('seconds', [0, 'forever', 10 ** 9])
+    def test_renew_lease_invalid_seconds(self, posted_job, seconds):
+        endpoint = '/jobs/%s/lease' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            response = client.patch(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps({'seconds': seconds})
+            )
+
+        assert response.status_code == 400
+
+    def test_expired_lease_claimable(self, posted_service, posted_job):
+        with app_client('/') as client:
+            self.claim(client, posted_service)
+            assert self.claim(client, posted_service).status_code == 204
+
+            self.expire_lease(posted_job)
+
+            response = self.claim(client, posted_service)
+
+        assert response.status_code == 200
+
+        job_details = json.loads(
+            response.data.decode('utf-8')
+        )['data']['job_details']
+
+        assert job_details['id'] == str(posted_job)
+        assert job_details['attempts'] == 2
+
+    def test_max_attempts(self, posted_service, posted_job):
+        with mock.patch.object(config, 'JOB_MAX_ATTEMPTS', 1):
+            with app_client('/') as client:
+                self.claim(client, posted_service)
+                self.expire_lease(posted_job)
+
+                response = self.claim(client, posted_service)
+
+        assert response.status_code == 204
+
+
+class TestLongPoll(object):
+    def test_queue_wait_times_out(self, posted_service):
+        endpoint = '/services/%s/queue?wait=0.01' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 200
+        assert json.loads(response.data.decode('utf-8')) == {'data': []}
+
+    def test_queue_wait_returns_waiting_jobs(self, posted_service,
+                                             posted_job):
+        endpoint = '/services/%s/queue?wait=5' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        data = json.loads(response.data.decode('utf-8'))['data']
+
+        assert response.status_code == 200
+        assert [job['id'] for job in data] == [str(posted_job)]
+
+    @pytest.mark.parametrize('wait', ['-1', 'forever', 'nan', 'inf'])
+    def test_bad_wait_time(self, posted_service, wait):
+        endpoint = '/services/%s/queue?wait=%s' % (str(posted_service), wait)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize('wait', ['nan', 'inf'])
+    def test_job_wait_time_not_finite(self, posted_job, wait):
+        endpoint = '/jobs/%s?wait=%s' % (str(posted_job), wait)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 400
+
+    def test_job_wait_times_out(self, posted_job):
+        endpoint = '/jobs/%s?wait=0.01' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 200
+        assert json.loads(
+            response.data.decode('utf-8')
+        )['data']['status'] == 'REGISTERED'
+
+
+class TestJobPagination(object):
+    @staticmethod
+    def get_page(endpoint):
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 200
+        return json.loads(response.data.decode('utf-8'))
+
+    @pytest.mark.parametrize('endpoint_template', [
+        '/jobs', '/services/%s/jobs'
+    ])
+    def test_follow_next_link(self, posted_service, posted_job, next_job,
+                              endpoint_template):
+        if '%s' in endpoint_template:
+            endpoint = endpoint_template % str(posted_service)
+        else:
+            endpoint = endpoint_template
+
+        first_page = self.get_page(endpoint + '?limit=1')
+
+        assert [job['id'] for job in first_page['data']] == [str(posted_job)]
+
+        next_url = urlparse(first_page['meta']['next'])
+        second_page = self.get_page('%s?%s' % (next_url.path, next_url.query))
+
+        assert [job['id'] for job in second_page['data']] == [str(next_job)]
+        assert 'next' not in second_page['meta']
+
+    def test_status_filter(self, posted_job):
+        page = self.get_page('/jobs?status=WORKING')
+
+        assert page['data'] == []
+
+        page = self.get_page('/jobs?status=REGISTERED')
+
+        assert [job['id'] for job in page['data']] == [str(posted_job)]
+
+    def test_date_filter(self, posted_job):
+        page = self.get_page('/jobs?submitted_before=2000-01-01T00:00:00Z')
+
+        assert page['data'] == []
+
+    @pytest.mark.parametrize('query', [
+        'limit=0', 'limit=many', 'after=garbage', 'status=DONE',
+        'submitted_after=yesterday'
+    ])
+    def test_bad_query(self, database, query):
+        endpoint = '/jobs?%s' % query
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+
+        assert response.status_code == 400
+
+
+class TestBatchJobSubmission(object):
+    @staticmethod
+    def post_batch(service_id, jobs):
+        endpoint = '/services/%s/jobs:batch' % str(service_id)
+
+        with app_client(endpoint) as client:
+            response = client.post(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(jobs)
+            )
+
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def test_batch(self, posted_service):
+        jobs = [{'parameters': {'value': value}} for value in range(5)]
+
+        response, body = self.post_batch(posted_service, jobs)
+
+        assert response.status_code == 201
+        assert body['meta'] == {'created': 5, 'failed': 0}
+
+        with app_client('/jobs') as client:
+            listed_jobs = json.loads(
+                client.get('/jobs').data.decode('utf-8')
+            )['data']
+
+        assert [job['id'] for job in listed_jobs] == [
+            outcome['id'] for outcome in body['data']
+        ]
+
+    def test_batch_partial_failure(self, posted_service):
+        jobs = [
+            {'parameters': {'value': 1}},
+            {'parameters': {'value': 'one'}},
+            {'no_parameters': {}}
+        ]
+
+        response, body = self.post_batch(posted_service, jobs)
+
+        assert response.status_code == 201
+        assert body['meta'] == {'created': 1, 'failed': 2}
+        assert 'id' in body['data'][0]
+        assert 'errors' in body['data'][1]
+        assert 'errors' in body['data'][2]
+
+    def test_batch_all_invalid(self, posted_service):
+        response, body = self.post_batch(
+            posted_service, [{'parameters': {'value': 'one'}}]
+        )
+
+        assert response.status_code == 400
+
+    def test_batch_item_not_an_object(self, posted_service):
+        response, body = self.post_batch(
+            posted_service, [{'parameters': {'value': 1}}, 'value', 1]
+        )
+
+        assert response.status_code == 201
+        assert body['meta'] == {'created': 1, 'failed': 2}
+        assert 'errors' in body['data'][1]
+
+        response, _ = self.post_batch(posted_service, ['value', None])
+
+        assert response.status_code == 400
+
+    def test_batch_commit_fails(self, posted_service):
+        service_path = os.path.join(
+            config.SCHEMA_DIRECTORY, str(posted_service)
+        )
+        entries = set(os.listdir(service_path))
+        jobs = [{'parameters': {'value': value}} for value in range(3)]
+
+        with mock.patch(
+            'sqlalchemy.orm.Session.commit',
+            side_effect=IntegrityError('INSERT', {}, Exception())
+        ):
+            response, _ = self.post_batch(posted_service, jobs)
+
+        assert response.status_code == 400
+        assert set(os.listdir(service_path)) == entries
+
+    def test_batch_not_a_list(self, posted_service):
+        response, _ = self.post_batch(posted_service, VALID_JOB_SCHEMA)
+
+        assert response.status_code == 400
+
+    def test_batch_no_service(self, database):
+        service_id = 'd753ddf0-7053-11e6-b1ce-843a4b768af4'
+
+        response, _ = self.post_batch(service_id, [VALID_JOB_SCHEMA])
+
+        assert response.status_code == 404
+
+
+class TestBatchJobUpdate(object):
+    endpoint = '/jobs:batch'
+
+    def put_batch(self, updates):
+        with app_client(self.endpoint) as client:
+            response = client.put(
+                self.endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(updates)
+            )
+
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def test_batch_update(self, posted_job, next_job):
+        response, body = self.put_batch([
+            {'id': str(posted_job), 'status': 'COMPLETED',
+             'result': {'value': 3}},
+            {'id': str(next_job), 'status': 'WORKING'}
+        ])
+
+        assert response.status_code == 200
+        assert body['meta'] == {'updated': 2, 'failed': 0}
+
+        job_details = TestPutJob.get_job_details('/jobs/%s' % posted_job)
+
+        assert job_details['status'] == 'COMPLETED'
+        assert job_details['result'] == {'value': 3}
+        assert TestPutJob.get_job_details(
+            '/jobs/%s' % next_job
+        )['status'] == 'WORKING'
+
+    def test_batch_update_partial_failure(self, posted_job):
+        missing_job = 'd753ddf0-7053-11e6-b1ce-843a4b768af4'
+
+        response, body = self.put_batch([
+            {'id': str(posted_job), 'status': 'COMPLETED'},
+            {'id': missing_job, 'status': 'COMPLETED'},
+            {'id': 'foo', 'status': 'COMPLETED'},
+            {'id': str(posted_job), 'status': 'DONE'}
+        ])
+
+        assert response.status_code == 200
+        assert body['meta'] == {'updated': 1, 'failed': 3}
+        assert body['data'][0] == {
+            'id': str(posted_job), 'status': 'COMPLETED'
+        }
+        assert all('errors' in outcome for outcome in body['data'][1:])
+
+    @pytest.mark.parametrize('item', ['COMPLETED', None, 3, []])
+    def test_batch_update_item_not_an_object(self, posted_job, item):
+        response, body = self.put_batch([
+            {'id': str(posted_job), 'status': 'COMPLETED'}, item
+        ])
+
+        assert response.status_code == 200
+        assert body['meta'] == {'updated': 1, 'failed': 1}
+        assert 'is not an object' in body['data'][1]['errors']
+
+    def test_batch_update_commit_fails(self, posted_job):
+        with mock.patch(
+            'sqlalchemy.orm.Session.commit',
+            side_effect=IntegrityError('UPDATE', {}, Exception())
+        ):
+            response, _ = self.put_batch([
+                {'id': str(posted_job), 'status': 'COMPLETED',
+                 'result': {'value': 3}}
+            ])
+
+        assert response.status_code == 400
+
+        job_details = TestPutJob.get_job_details('/jobs/%s' % posted_job)
+
+        assert job_details['status'] == 'REGISTERED'
+        assert job_details['result'] != {'value': 3}
+
+    def test_batch_update_nothing_valid(self, posted_job):
+        response, _ = self.put_batch([{'status': 'COMPLETED'}])
+
+        assert response.status_code == 400
+
+    def test_batch_update_not_a_list(self, posted_job):
+        response, _ = self.put_batch({'id': str(posted_job)})
+
+        assert response.status_code == 400
+
+
+class TestListQueryCount(object):
+    """
+    Listing jobs must cost the same number of queries whatever the size of
+    the page. With the default ``filesystem`` job storage, each job's
+    parameters are still read from its own file. Only the ``database``
+    storage lists a page without any file reads.
+    """
+    @staticmethod
+    def count_list_cost(endpoint):
+        statements = []
+
+        def count_statement(*args):
+            statements.append(args[2])
+
+        event.listen(config.database_engine, 'before_cursor_execute',
+                     count_statement)
+        try:
+            with mock.patch('topchef.storage.open', create=True,
+                            side_effect=open) as mock_open:
+                with app_client(endpoint) as client:
+                    response = client.get(endpoint)
+        finally:
+            event.remove(config.database_engine, 'before_cursor_execute',
+                         count_statement)
+
+        assert response.status_code == 200
+        return len(statements), mock_open.call_count
+
+    def list_costs(self, service_id, endpoint_template):
+        """
+        :return: The cost of listing one job, and of listing five jobs
+        """
+        if '%s' in endpoint_template:
+            endpoint = endpoint_template % str(service_id)
+        else:
+            endpoint = endpoint_template
+
+        TestBatchJobSubmission.post_batch(service_id, [VALID_JOB_SCHEMA])
+        cost_of_one_job = self.count_list_cost(endpoint)
+
+        TestBatchJobSubmission.post_batch(service_id, [VALID_JOB_SCHEMA] * 4)
+        cost_of_five_jobs = self.count_list_cost(endpoint)
+
+        return cost_of_one_job, cost_of_five_jobs
+
+    @pytest.mark.parametrize('endpoint_template', [
+        '/jobs', '/services/%s/jobs', '/services/%s/queue'
+    ])
+    def test_constant_queries(self, posted_service, endpoint_template):
+        cost_of_one_job, cost_of_five_jobs = self.list_costs(
+            posted_service, endpoint_template
+        )
+
+        statements_for_one_job, files_for_one_job = cost_of_one_job
+        statements_for_five_jobs, files_for_five_jobs = cost_of_five_jobs
+
+        assert statements_for_one_job == statements_for_five_jobs
+        assert files_for_five_jobs - files_for_one_job == 4
+
+    @pytest.mark.parametrize('endpoint_template', [
+        '/jobs', '/services/%s/jobs', '/services/%s/queue'
+    ])
+    def test_constant_cost_database_storage(
+            self, posted_service, monkeypatch, endpoint_template
+    ):
+        monkeypatch.setattr(
+            'topchef.models.Job.storage', storage.DatabaseStorage()
+        )
+
+        cost_of_one_job, cost_of_five_jobs = self.list_costs(
+            posted_service, endpoint_template
+        )
+
+        assert cost_of_one_job == cost_of_five_jobs
+
+    def test_jobs_of_many_services(self, posted_service, posted_job):
+        statements_for_one_service, _ = self.count_list_cost('/jobs')
+
+        with app_client('/services') as client:
+            for _ in range(3):
+                response = client.post(
+                    '/services', headers={'Content-Type': 'application/json'},
+                    data=json.dumps(JOB_REGISTRATION_SCHEMA)
+                )
+                service_id = json.loads(
+                    response.data.decode('utf-8')
+                )['data']['service_details']['id']
+                TestBatchJobSubmission.post_batch(
+                    service_id, [VALID_JOB_SCHEMA]
+                )
+
+        statements_for_many_services, _ = self.count_list_cost('/jobs')
+
+        assert statements_for_one_service == statements_for_many_services
+
+
+class TestGeneratedSchemas(object):
+    def test_list_schemas(self):
+        with app_client('/schemas') as client:
+            response = client.get('/schemas')
+
+        assert response.status_code == 200
+        assert 'service' in json.loads(response.data.decode('utf-8'))['data']
+
+    def test_schema_matches_post_schema(self, database):
+        with app_client('/schemas/service') as client:
+            schema_response = client.get('/schemas/service')
+            services_response = client.get('/services')
+
+        assert schema_response.status_code == 200
+        assert schema_response.headers['ETag']
+        assert 'max-age' in schema_response.headers['Cache-Control']
+        assert json.loads(schema_response.data.decode('utf-8')) == \
+            json.loads(
+                services_response.data.decode('utf-8')
+            )['meta']['POST_schema']
+
+    def test_not_modified(self):
+        with app_client('/schemas/job') as client:
+            etag = client.get('/schemas/job').headers['ETag']
+            response = client.get(
+                '/schemas/job', headers={'If-None-Match': etag}
+            )
+
+        assert response.status_code == 304
+
+    def test_unknown_schema(self):
+        with app_client('/schemas/foo') as client:
+            response = client.get('/schemas/foo')
+
+        assert response.status_code == 404
+
+    def test_generated_once(self):
+        assert get_schema_document('job_details') is \
+            get_schema_document('job_details')
+
+
+class TestConditionalGet(object):
+    def test_job_not_modified(self, posted_job):
+        endpoint = '/jobs/%s' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            etag = client.get(endpoint).headers['ETag']
+
+            with mock.patch('topchef.models.Job.parameters',
+                            new_callable=mock.PropertyMock) as parameters:
+                response = client.get(
+                    endpoint, headers={'If-None-Match': etag}
+                )
+
+        assert response.status_code == 304
+        assert not parameters.called
+
+    def test_job_modified(self, posted_job):
+        endpoint = '/jobs/%s' % str(posted_job)
+
+        with app_client(endpoint) as client:
+            response = client.get(endpoint)
+            etag = response.headers['ETag']
+
+            job_details = json.loads(response.data.decode('utf-8'))['data']
+            job_details['status'] = 'WORKING'
+            client.put(
+                endpoint, headers={'Content-Type': 'application/json'},
+                data=json.dumps(job_details)
+            )
+
+            response = client.get(endpoint, headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_service_heartbeat_changes_etag(self, posted_service):
+        endpoint = '/services/%s' % str(posted_service)
+
+        with app_client(endpoint) as client:
+            etag = client.get(endpoint).headers['ETag']
+
+            assert client.get(
+                endpoint, headers={'If-None-Match': etag}
+            ).status_code == 304
+
+            client.patch(endpoint)
+
+            response = client.get(endpoint, headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+
+    def test_heartbeat_unknown_service(self, database):
+        endpoint = '/services/%s' % uuid1()
+
+        with app_client(endpoint) as client:
+            response = client.patch(endpoint)
+
+        assert response.status_code == 404
+
+    def test_heartbeat_written_through(self, posted_service):
+        endpoint = '/services/%s' % str(posted_service)
+        session = server.SESSION_FACTORY()
+
+        with mock.patch.object(config, 'HEARTBEAT_FLUSH_INTERVAL', 0):
+            before = session.query(Service).filter_by(
+                id=posted_service
+            ).one().version
+            session.close()
+
+            with app_client(endpoint) as client:
+                response = client.patch(endpoint)
+
+        assert response.status_code == 200
+        assert session.query(Service).filter_by(
+            id=posted_service
+        ).one().version == before + 1
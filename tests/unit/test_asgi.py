@@ -0,0 +1,239 @@
+"""
+Contains unit tests for :mod:`topchef.asgi`
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import mock
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+import topchef.api_server as server
+from topchef.api_server import app
+from topchef import asgi
+from topchef.asgi import ASGIApplication, wait_for_publish
+from topchef.config import config
+from topchef.database import METADATA
+from topchef.notifications import NOTIFICATIONS
+
+SERVICE = {
+    "name": "TestService",
+    "description": "Some test data",
+    "job_registration_schema": {
+        "type": "object",
+        "properties": {"value": {"type": "integer"}}
+    }
+}
+
+
+@pytest.yield_fixture
+def asgi_application(tmpdir):
+    if not os.path.isdir(config.SCHEMA_DIRECTORY):
+        os.mkdir(config.SCHEMA_DIRECTORY)
+
+    engine = create_engine('sqlite:///%s' % tmpdir.join('topchef.sqlite3'))
+    METADATA.create_all(bind=engine)
+    config._engine = engine
+    server.SESSION_FACTORY = scoped_session(sessionmaker(bind=engine))
+
+    application = ASGIApplication(app, 4)
+    yield application
+    application.executor.shutdown(wait=True)
+
+
+@pytest.yield_fixture
+def event_loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def service_id(asgi_application):
+    response = app.test_client().post(
+        '/services', headers={'Content-Type': 'application/json'},
+        data=json.dumps(SERVICE)
+    )
+    assert response.status_code == 201
+    return json.loads(
+        response.data.decode('utf-8')
+    )['data']['service_details']['id']
+
+
+def post_job(service_id):
+    response = app.test_client().post(
+        '/services/%s/jobs' % service_id,
+        headers={'Content-Type': 'application/json'},
+        data=json.dumps({'parameters': {'value': 1}})
+    )
+    assert response.status_code == 201
+
+
+def call(loop, application, path, method='GET', query_string=b'',
+         body_chunks=(b'',), headers=()):
+    """
+    :return: The messages sent by the application in response to a request
+    """
+    requests = [
+        {'type': 'http.request', 'body': chunk, 'more_body': True}
+        for chunk in body_chunks
+    ]
+    requests[-1]['more_body'] = False
+    messages = []
+
+    async def receive():
+        return requests.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path,
+        'query_string': query_string, 'headers': list(headers),
+        'server': ('localhost', 5000), 'scheme': 'http'
+    }
+
+    loop.run_until_complete(application(scope, receive, send))
+    return messages
+
+
+def body_of(messages):
+    return b''.join(
+        message.get('body', b'') for message in messages
+        if message['type'] == 'http.response.body'
+    )
+
+
+class TestASGIApplication(object):
+    def test_get(self, event_loop, asgi_application):
+        messages = call(event_loop, asgi_application, '/services')
+
+        assert messages[0]['type'] == 'http.response.start'
+        assert messages[0]['status'] == 200
+        assert 'data' in json.loads(body_of(messages).decode('utf-8'))
+
+    def test_chunked_body(self, event_loop, asgi_application):
+        body = json.dumps(SERVICE).encode('utf-8')
+
+        messages = call(
+            event_loop, asgi_application, '/services', method='POST',
+            body_chunks=(body[:10], body[10:20], body[20:]),
+            headers=[(b'content-type', b'application/json')]
+        )
+
+        assert messages[0]['status'] == 201
+
+    def test_body_too_large(self, event_loop, asgi_application):
+        body = json.dumps(SERVICE).encode('utf-8')
+
+        with mock.patch.object(config, 'ATTACHMENT_MAX_SIZE', 16):
+            messages = call(
+                event_loop, asgi_application, '/services', method='POST',
+                body_chunks=(body[:10], body[10:]),
+                headers=[(b'content-type', b'application/json')]
+            )
+
+        assert messages[0]['status'] == 413
+
+    def test_long_poll_wait_not_finite(self, event_loop, asgi_application,
+                                       service_id):
+        messages = call(
+            event_loop, asgi_application, '/services/%s/queue' % service_id,
+            query_string=b'wait=nan'
+        )
+
+        assert messages[0]['status'] == 400
+
+    def test_streamed_export(self, event_loop, asgi_application, service_id):
+        post_job(service_id)
+        post_job(service_id)
+
+        messages = call(
+            event_loop, asgi_application,
+            '/services/%s/jobs/export' % service_id
+        )
+
+        body_messages = [
+            message for message in messages
+            if message['type'] == 'http.response.body' and message['body']
+        ]
+
+        assert len(body_messages) == 2
+        assert not messages[-1].get('more_body', False)
+
+    def test_long_poll_woken_by_job(self, event_loop, asgi_application,
+                                    service_id):
+        publisher = threading.Timer(0.1, post_job, args=(service_id,))
+        publisher.start()
+
+        start = time.time()
+        messages = call(
+            event_loop, asgi_application, '/services/%s/queue' % service_id,
+            query_string=b'wait=5'
+        )
+        publisher.join()
+
+        assert time.time() - start < 5
+        assert len(json.loads(body_of(messages).decode('utf-8'))['data']) == 1
+
+    def test_long_poll_times_out(self, event_loop, asgi_application,
+                                 service_id):
+        messages = call(
+            event_loop, asgi_application, '/services/%s/queue' % service_id,
+            query_string=b'wait=0.05'
+        )
+
+        assert messages[0]['status'] == 200
+        assert json.loads(body_of(messages).decode('utf-8')) == {'data': []}
+
+    def test_long_poll_unknown_service(self, event_loop, asgi_application):
+        messages = call(
+            event_loop, asgi_application,
+            '/services/d753ddf0-7053-11e6-b1ce-843a4b768af4/queue',
+            query_string=b'wait=5'
+        )
+
+        assert messages[0]['status'] == 404
+
+    def test_lifespan(self, event_loop):
+        application = ASGIApplication(app, 1)
+        events = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        messages = []
+
+        async def receive():
+            return events.pop(0)
+
+        async def send(message):
+            messages.append(message)
+
+        with mock.patch.object(asgi, 'start_reaper') as start_reaper:
+            event_loop.run_until_complete(
+                application({'type': 'lifespan'}, receive, send)
+            )
+
+        assert start_reaper.called
+        assert [message['type'] for message in messages] == [
+            'lifespan.startup.complete', 'lifespan.shutdown.complete'
+        ]
+
+
+class TestWaitForPublish(object):
+    def test_woken_by_publish(self, event_loop):
+        key = 'eb511c46-6577-11e6-a72a-3c970e7271f5'
+        version = NOTIFICATIONS.version(key)
+
+        event_loop.call_later(0.05, NOTIFICATIONS.publish, key)
+
+        assert event_loop.run_until_complete(
+            wait_for_publish(key, version, 5)
+        )
+
+    def test_times_out(self, event_loop):
+        key = 'eb511c46-6577-11e6-a72a-3c970e7271f6'
+
+        assert not event_loop.run_until_complete(
+            wait_for_publish(key, NOTIFICATIONS.version(key), 0.01)
+        )
@@ -1,3 +1,4 @@
+import mock
 from topchef.config import Config
 
 
@@ -15,3 +16,38 @@ def test_port():
     config = Config(environment)
 
     assert config.PORT == 12321
+
+
+def test_numeric_and_boolean_parameters():
+    environment = {
+        'DATABASE_POOL_SIZE': '42', 'DATABASE_POOL_PRE_PING': 'false'
+    }
+
+    config = Config(environment)
+
+    assert config.DATABASE_POOL_SIZE == 42
+    assert config.DATABASE_POOL_PRE_PING is False
+
+
+@mock.patch('topchef.config.create_engine')
+def test_pooled_engine(mock_create_engine):
+    Config({'DATABASE_URI': 'postgresql://localhost/topchef'})
+
+    _, kwargs = mock_create_engine.call_args
+    assert kwargs == {
+        'pool_size': Config.DATABASE_POOL_SIZE,
+        'max_overflow': Config.DATABASE_MAX_OVERFLOW,
+        'pool_recycle': Config.DATABASE_POOL_RECYCLE,
+        'pool_pre_ping': Config.DATABASE_POOL_PRE_PING
+    }
+
+
+def test_sqlite_engine_uses_wal(tmpdir):
+    database_uri = 'sqlite:///%s' % tmpdir.join('db.sqlite3')
+
+    config = Config({'DATABASE_URI': database_uri})
+
+    with config.database_engine.connect() as connection:
+        assert connection.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.execute('PRAGMA busy_timeout').scalar() == \
+            Config.SQLITE_BUSY_TIMEOUT
@@ -0,0 +1,49 @@
+"""
+Contains unit tests for :mod:`topchef.export`
+"""
+import math
+import mock
+from topchef.export import numeric_columns, _to_float
+
+
+class TestNumericColumns(object):
+    def test_numeric_columns(self):
+        service = mock.MagicMock()
+        service.job_registration_schema = {
+            'type': 'object',
+            'properties': {
+                'temperature': {'type': 'number'},
+                'repeats': {'type': 'integer'},
+                'sample': {'type': 'string'}
+            }
+        }
+        service.job_result_schema = {
+            'type': 'object',
+            'properties': {
+                'converged': {'type': 'boolean'},
+                'spectrum': {'type': 'array'}
+            }
+        }
+
+        assert numeric_columns(service) == [
+            ('parameters', 'repeats'), ('parameters', 'temperature'),
+            ('result', 'converged')
+        ]
+
+    def test_no_properties(self):
+        service = mock.MagicMock()
+        service.job_registration_schema = {'type': 'object'}
+        service.job_result_schema = {'type': 'object'}
+
+        assert numeric_columns(service) == []
+
+
+class TestToFloat(object):
+    def test_numbers(self):
+        assert _to_float(3) == 3.0
+        assert _to_float(2.5) == 2.5
+        assert _to_float(True) == 1.0
+
+    def test_missing_values(self):
+        assert math.isnan(_to_float(None))
+        assert math.isnan(_to_float('3'))
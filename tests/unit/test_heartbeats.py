@@ -0,0 +1,113 @@
+"""
+Contains unit tests for :mod:`topchef.heartbeats` and
+:mod:`topchef.scheduler`
+"""
+import threading
+from datetime import datetime
+from uuid import uuid1
+import pytest
+from sqlalchemy import create_engine, select
+from topchef.database import METADATA, services
+from topchef.heartbeats import HeartbeatBuffer
+from topchef.scheduler import PeriodicTask
+
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = create_engine('sqlite:///%s' % tmpdir.join('topchef.sqlite3'))
+    METADATA.create_all(bind=engine)
+    return engine
+
+
+@pytest.fixture
+def service_id(engine):
+    service_id = uuid1()
+    engine.execute(services.insert().values(
+        service_id=service_id, name='Service', description='A service',
+        is_service_available=True,
+        last_checked_in=datetime(2016, 1, 1),
+        heartbeat_timeout_seconds=30
+    ))
+    return service_id
+
+
+def _stored_service(engine, service_id):
+    return engine.execute(select([
+        services.c.last_checked_in, services.c.version
+    ]).where(services.c.service_id == service_id)).first()
+
+
+class TestHeartbeatBuffer(object):
+    def test_record(self):
+        buffer = HeartbeatBuffer()
+        service_id = uuid1()
+        date = datetime(2016, 1, 2)
+
+        assert buffer.last_checked_in(service_id) is None
+
+        buffer.record(service_id, date)
+
+        assert buffer.last_checked_in(service_id) == date
+
+    def test_flush_writes_latest_heartbeat(self, engine, service_id):
+        buffer = HeartbeatBuffer()
+        latest_date = datetime(2016, 1, 3)
+
+        buffer.record(service_id, datetime(2016, 1, 2))
+        buffer.record(service_id, latest_date)
+
+        assert _stored_service(engine, service_id).version == 1
+        assert buffer.flush(engine) == 1
+
+        stored_service = _stored_service(engine, service_id)
+        assert stored_service.last_checked_in == latest_date
+        assert stored_service.version == 2
+
+    def test_flush_nothing_pending(self, engine, service_id):
+        buffer = HeartbeatBuffer()
+        buffer.record(service_id)
+        buffer.flush(engine)
+
+        assert buffer.flush(engine) == 0
+        assert _stored_service(engine, service_id).version == 2
+
+    def test_failed_flush_keeps_heartbeats(self, tmpdir, engine, service_id):
+        buffer = HeartbeatBuffer()
+        buffer.record(service_id)
+
+        empty_engine = create_engine(
+            'sqlite:///%s' % tmpdir.join('empty.sqlite3')
+        )
+
+        with pytest.raises(Exception):
+            buffer.flush(empty_engine)
+
+        assert buffer.flush(engine) == 1
+
+
+class TestPeriodicTask(object):
+    def test_runs_periodically(self):
+        calls = threading.Semaphore(0)
+        task = PeriodicTask('test-task', 0.01, calls.release)
+
+        task.start()
+        try:
+            assert calls.acquire(timeout=1)
+            assert calls.acquire(timeout=1)
+        finally:
+            task.stop(timeout=1)
+
+        assert not task.is_running
+
+    def test_survives_errors(self):
+        calls = []
+
+        def fail():
+            calls.append(None)
+            raise RuntimeError('Task failed')
+
+        task = PeriodicTask('test-task', 1, fail)
+        task.run_once()
+        task.run_once()
+
+        assert len(calls) == 2
@@ -0,0 +1,104 @@
+"""
+Contains unit tests for :mod:`topchef.migrations`
+"""
+from sqlalchemy import create_engine, inspect
+from sqlalchemy import MetaData, Table, Column, Integer, String, Enum
+from topchef.database import METADATA
+from topchef.migrations import upgrade
+
+
+def test_upgrade_empty_database():
+    engine = create_engine('sqlite://')
+
+    upgrade(engine)
+
+    assert set(inspect(engine).get_table_names()) == set(METADATA.tables)
+
+
+def test_upgrade_adds_missing_columns():
+    engine = create_engine('sqlite://')
+
+    old_metadata = MetaData()
+    Table('things', old_metadata, Column('thing_id', Integer, primary_key=True))
+    old_metadata.create_all(bind=engine)
+    engine.execute('INSERT INTO things (thing_id) VALUES (1)')
+
+    new_metadata = MetaData()
+    Table(
+        'things', new_metadata,
+        Column('thing_id', Integer, primary_key=True),
+        Column('name', String(30), nullable=True),
+        Column('count', Integer, nullable=False, server_default='0')
+    )
+
+    upgrade(engine, metadata=new_metadata)
+    upgrade(engine, metadata=new_metadata)
+
+    columns = {
+        column['name'] for column in inspect(engine).get_columns('things')
+    }
+    assert columns == {'thing_id', 'name', 'count'}
+    assert engine.execute('SELECT count FROM things').scalar() == 0
+
+
+def test_upgrade_adds_missing_indexes():
+    engine = create_engine('sqlite://')
+    METADATA.create_all(bind=engine)
+
+    jobs = METADATA.tables['jobs']
+    for index in jobs.indexes:
+        index.drop(bind=engine)
+
+    upgrade(engine)
+
+    index_names = {
+        index['name'] for index in inspect(engine).get_indexes('jobs')
+    }
+    assert index_names == {index.name for index in jobs.indexes}
+
+
+def test_upgrade_drops_retired_indexes():
+    engine = create_engine('sqlite://')
+    METADATA.create_all(bind=engine)
+    engine.execute(
+        'CREATE INDEX ix_jobs_service_status_date '
+        'ON jobs (service_id, status, date_submitted)'
+    )
+
+    upgrade(engine)
+    upgrade(engine)
+
+    index_names = {
+        index['name'] for index in inspect(engine).get_indexes('jobs')
+    }
+    assert 'ix_jobs_service_status_date' not in index_names
+    assert 'ix_jobs_service_status_priority' in index_names
+
+
+def test_upgrade_adds_enum_values():
+    engine = create_engine('sqlite://')
+
+    old_metadata = MetaData()
+    Table(
+        'things', old_metadata,
+        Column('thing_id', Integer, primary_key=True),
+        Column('status', Enum('NEW', 'DONE', name='thing_status'))
+    )
+    old_metadata.create_all(bind=engine)
+    engine.execute("INSERT INTO things (thing_id, status) VALUES (1, 'NEW')")
+
+    new_metadata = MetaData()
+    things = Table(
+        'things', new_metadata,
+        Column('thing_id', Integer, primary_key=True),
+        Column('status', Enum('NEW', 'DONE', 'FAILED', name='thing_status')),
+        Column('count', Integer, nullable=False, server_default='0')
+    )
+
+    upgrade(engine, metadata=new_metadata)
+    upgrade(engine, metadata=new_metadata)
+
+    engine.execute(things.update().values(status='FAILED'))
+    assert engine.execute(
+        'SELECT thing_id, status, count FROM things'
+    ).fetchall() == [(1, 'FAILED', 0)]
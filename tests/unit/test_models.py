@@ -3,11 +3,15 @@ Contains tests for :mod:`topchef.models`
 """
 import pytest
 import os
+import errno
+import mock
 import jsonschema
 import shutil
-from uuid import UUID
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from uuid import UUID, uuid1
 from topchef.models import SchemaDirectoryOrganizer
-from topchef import models
+from topchef import models, database
 from topchef.config import config
 from topchef.api_server import app
 from .test_api_server import app_client
@@ -140,6 +144,275 @@ class TestSchemaDirectoryOrganizer(object):
             with pytest.raises(ValueError):
                 schema_directory_organizer[bad_model]
 
+class TestWrite(object):
+    @pytest.fixture
+    def target_path(self, tmpdir):
+        return str(tmpdir.join('result.json'))
+
+    def test_write(self, target_path):
+        organizer = SchemaDirectoryOrganizer(SCHEMA_DIRECTORY)
+
+        organizer.write('{"value": 1}', target_path)
+        organizer.write('{"value": 2}', target_path)
+
+        with open(target_path) as written_file:
+            assert written_file.read() == '{"value": 2}'
+        assert os.listdir(os.path.dirname(target_path)) == ['result.json']
+
+    def test_write_no_directory(self, tmpdir):
+        organizer = SchemaDirectoryOrganizer(SCHEMA_DIRECTORY)
+
+        with pytest.raises(OSError) as error:
+            organizer.write('{}', str(tmpdir.join('missing', 'result.json')))
+
+        assert error.value.errno == errno.ENOENT
+
+    def test_failed_write_removes_temporary_file(self, target_path):
+        organizer = SchemaDirectoryOrganizer(SCHEMA_DIRECTORY)
+
+        with mock.patch('topchef.models._replace', side_effect=OSError):
+            with pytest.raises(OSError):
+                organizer.write('{}', target_path)
+
+        assert os.listdir(os.path.dirname(target_path)) == []
+
+    def test_fsync_always(self, target_path):
+        organizer = SchemaDirectoryOrganizer(
+            SCHEMA_DIRECTORY, fsync_policy='always'
+        )
+
+        with mock.patch('os.fsync') as fsync:
+            organizer.write('{}', target_path)
+
+        assert fsync.call_count == 2
+
+    def test_fsync_batch(self, target_path):
+        organizer = SchemaDirectoryOrganizer(
+            SCHEMA_DIRECTORY, fsync_policy='batch'
+        )
+
+        with mock.patch('topchef.models.PeriodicTask') as task, \
+                mock.patch('atexit.register'), \
+                mock.patch('os.fsync') as fsync:
+            organizer.write('{}', target_path)
+            organizer.write('{}', target_path)
+
+            assert not fsync.called
+            assert task.return_value.start.call_count == 1
+
+            organizer.sync()
+            assert fsync.call_count == 2
+
+            organizer.sync()
+            assert fsync.call_count == 2
+
+    def test_write_stream(self, target_path):
+        organizer = SchemaDirectoryOrganizer(SCHEMA_DIRECTORY)
+
+        size = organizer.write_stream([b'\x00\x01', b'\x02'], target_path)
+
+        assert size == 3
+        with open(target_path, mode='rb') as written_file:
+            assert written_file.read() == b'\x00\x01\x02'
+
+    def test_write_permissions(self, target_path, tmpdir):
+        organizer = SchemaDirectoryOrganizer(SCHEMA_DIRECTORY)
+        opened_path = str(tmpdir.join('opened.json'))
+
+        organizer.write('{}', target_path)
+        with open(opened_path, 'w') as opened_file:
+            opened_file.write('{}')
+
+        assert os.stat(target_path).st_mode == os.stat(opened_path).st_mode
+
+    def test_invalid_fsync_policy(self):
+        with pytest.raises(ValueError):
+            SchemaDirectoryOrganizer(SCHEMA_DIRECTORY, fsync_policy='often')
+
+
+class TestDeduplication(object):
+    @pytest.fixture
+    def organizer(self, tmpdir):
+        return SchemaDirectoryOrganizer(str(tmpdir), deduplicate=True)
+
+    @pytest.fixture
+    def target_paths(self, tmpdir):
+        return [
+            str(tmpdir.mkdir(name).join('parameters.json'))
+            for name in ('first', 'second')
+        ]
+
+    def test_identical_documents_share_inode(self, organizer, target_paths):
+        for target_path in target_paths:
+            organizer.write_deduplicated('{"value":1}', target_path)
+
+        first_status, second_status = [
+            os.stat(target_path) for target_path in target_paths
+        ]
+
+        assert first_status.st_ino == second_status.st_ino
+        assert first_status.st_nlink == 3
+
+        with open(target_paths[1]) as written_file:
+            assert written_file.read() == '{"value":1}'
+
+    def test_overwrite_leaves_other_links(self, organizer, target_paths):
+        for target_path in target_paths:
+            organizer.write_deduplicated('{"value":1}', target_path)
+
+        organizer.write_deduplicated('{"value":2}', target_paths[0])
+
+        with open(target_paths[0]) as written_file:
+            assert written_file.read() == '{"value":2}'
+        with open(target_paths[1]) as written_file:
+            assert written_file.read() == '{"value":1}'
+
+    def test_unable_to_link(self, organizer, target_paths):
+        with mock.patch('os.link', side_effect=OSError(errno.EXDEV, '')):
+            organizer.write_deduplicated('{"value":1}', target_paths[0])
+
+        assert os.stat(target_paths[0]).st_nlink == 1
+        with open(target_paths[0]) as written_file:
+            assert written_file.read() == '{"value":1}'
+
+    def test_disabled(self, tmpdir, target_paths):
+        organizer = SchemaDirectoryOrganizer(str(tmpdir))
+        organizer.write_deduplicated('{"value":1}', target_paths[0])
+
+        assert not os.path.exists(organizer.blobs.root_path)
+
+    def test_collect_garbage(self, organizer, target_paths):
+        organizer.write_deduplicated('{"value":1}', target_paths[0])
+        organizer.write_deduplicated('{"value":2}', target_paths[1])
+        os.remove(target_paths[1])
+
+        assert organizer.blobs.collect_garbage() == 1
+        assert organizer.blobs.collect_garbage() == 0
+        assert os.stat(target_paths[0]).st_nlink == 2
+
+    def test_identical_parameters(self, tmpdir):
+        organizer = SchemaDirectoryOrganizer(str(tmpdir), deduplicate=True)
+        service = models.Service(
+            SERVICE_NAME, job_registration_schema=SERVICE_SCHEMA,
+            organizer=organizer
+        )
+        jobs = [
+            models.Job(service, {'value': 1}, file_manager=organizer)
+            for _ in range(2)
+        ]
+
+        first_status, second_status = [
+            os.stat(os.path.join(
+                organizer[job], organizer.JOB_PARAMETER_FILE_NAME
+            )) for job in jobs
+        ]
+
+        assert first_status.st_ino == second_status.st_ino
+        assert jobs[1].parameters == {'value': 1}
+
+    def test_changing_parameters_leaves_other_jobs(self, tmpdir):
+        organizer = SchemaDirectoryOrganizer(str(tmpdir), deduplicate=True)
+        service = models.Service(
+            SERVICE_NAME, job_registration_schema=SERVICE_SCHEMA,
+            organizer=organizer
+        )
+        jobs = [
+            models.Job(service, {'value': 1}, file_manager=organizer)
+            for _ in range(3)
+        ]
+
+        jobs[0].parameters['value'] = 2
+        jobs[1].parameters = {'value': 3}
+
+        assert [job.parameters for job in jobs] == [
+            {'value': 1}, {'value': 3}, {'value': 1}
+        ]
+
+    def test_changing_schema_leaves_other_services(self, tmpdir):
+        organizer = SchemaDirectoryOrganizer(str(tmpdir), deduplicate=True)
+        services = [
+            models.Service(
+                SERVICE_NAME, job_registration_schema=SERVICE_SCHEMA,
+                organizer=organizer
+            ) for _ in range(2)
+        ]
+
+        services[0].job_registration_schema['type'] = 'array'
+
+        assert services[1].job_registration_schema == SERVICE_SCHEMA
+
+
+class TestShardedLayout(object):
+    @pytest.fixture
+    def sharded_organizer(self, schema_directory):
+        return SchemaDirectoryOrganizer(SCHEMA_DIRECTORY, 'sharded')
+
+    @pytest.fixture
+    def sharded_job(self, sharded_organizer):
+        sharded_service = models.Service(
+            SERVICE_NAME, job_registration_schema=SERVICE_SCHEMA,
+            organizer=sharded_organizer
+        )
+        return models.Job(
+            sharded_service, VALID_JOB_SCHEMA,
+            file_manager=sharded_organizer
+        )
+
+    def test_invalid_layout(self):
+        with pytest.raises(ValueError):
+            SchemaDirectoryOrganizer(SCHEMA_DIRECTORY, 'nested')
+
+    def test_register_job(self, sharded_organizer, sharded_job):
+        job_path = sharded_organizer[sharded_job]
+        shard_path, job_directory = os.path.split(job_path)
+
+        assert job_directory == str(sharded_job.id)
+        assert os.path.dirname(os.path.dirname(shard_path)) == \
+            sharded_organizer[sharded_job.parent_service]
+        assert os.path.isdir(job_path)
+        assert sharded_job.parameters == VALID_JOB_SCHEMA
+
+    def test_getitem_does_not_stat(self, sharded_organizer, sharded_job):
+        with mock.patch('os.path.isdir') as isdir, \
+                mock.patch('os.stat') as stat:
+            sharded_organizer[sharded_job]
+
+        assert not isdir.called
+        assert not stat.called
+
+    def test_register_job_twice(self, sharded_organizer, sharded_job):
+        with pytest.raises(ValueError):
+            sharded_organizer.register(sharded_job)
+
+    def test_register_job_without_service_directory(
+            self, sharded_organizer
+    ):
+        orphan_job = mock.MagicMock(id=uuid1())
+        orphan_job.parent_service.id = uuid1()
+
+        with pytest.raises(ValueError):
+            sharded_organizer._register_job(orphan_job)
+
+    def test_shard_schema_directory(self, schema_directory_organizer, job):
+        migrating_organizer = SchemaDirectoryOrganizer(
+            SCHEMA_DIRECTORY, 'migrating'
+        )
+        flat_path = schema_directory_organizer[job]
+
+        assert migrating_organizer[job] == flat_path
+
+        assert models.shard_schema_directory(migrating_organizer) == 1
+        assert models.shard_schema_directory(migrating_organizer) == 0
+
+        sharded_organizer = SchemaDirectoryOrganizer(
+            SCHEMA_DIRECTORY, 'sharded'
+        )
+
+        assert not os.path.isdir(flat_path)
+        assert migrating_organizer[job] == sharded_organizer[job]
+        assert os.path.isdir(sharded_organizer[job])
+
+
 class TestService(object):
     def test_constructor(self, service):
         assert service.name == SERVICE_NAME
@@ -255,6 +528,105 @@ class TestJobConstructor(object):
         with pytest.raises(jsonschema.ValidationError):
             models.Job(service, {'value': -1})
 
+class TestJobUpdate(object):
+    def test_invalid_status(self, job):
+        with pytest.raises(ValueError):
+            job.update({'status': 'DONE'})
+
+        assert job.status == 'REGISTERED'
+
+    def test_concurrent_updates(self, job, tmpdir):
+        engine = create_engine('sqlite:///%s' % tmpdir.join('jobs.sqlite3'))
+        database.METADATA.create_all(bind=engine)
+        make_session = sessionmaker(bind=engine)
+
+        job_id = job.id
+
+        session = make_session()
+        session.add(job.parent_service)
+        session.add(job)
+        session.commit()
+        session.close()
+
+        first_session, second_session = make_session(), make_session()
+        first_copy = first_session.query(models.Job).get(job_id)
+        second_copy = second_session.query(models.Job).get(job_id)
+
+        first_copy.update({'status': 'WORKING'})
+        first_session.commit()
+        first_etag = first_copy.etag
+
+        second_copy.update({'status': 'COMPLETED'})
+        second_session.commit()
+        second_etag = second_copy.etag
+
+        assert first_etag != second_etag
+        assert second_etag == \
+            make_session().query(models.Job).get(job_id).etag
+
+    def test_deferred_writes(self, job):
+        job.update({'status': 'COMPLETED', 'result': {'value': 3}},
+                   defer_writes=True)
+
+        assert job.result == {}
+
+        job.write_deferred()
+
+        assert job.result == {'value': 3}
+
+
+def query_plans(lookup):
+    """
+    :param callable lookup: A function that takes a session, and runs
+        queries in it
+    :return: The SQLite query plan of every statement that the function
+        ran against an empty database
+    :rtype: list
+    """
+    engine = create_engine('sqlite://')
+    database.METADATA.create_all(bind=engine)
+
+    statements = []
+
+    def record(connection, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    lookup(sessionmaker(bind=engine)())
+    event.remove(engine, 'before_cursor_execute', record)
+
+    return [
+        ' '.join(
+            row[-1] for row in engine.execute(
+                'EXPLAIN QUERY PLAN %s' % statement, parameters
+            )
+        ) for statement, parameters in statements
+    ]
+
+
+class TestClaimNext(object):
+    def test_lookups_use_indexes(self):
+        plans = query_plans(
+            lambda session: models.Job.claim_next(session, uuid1())
+        )
+
+        assert len(plans) == 2
+        for plan in plans:
+            assert 'USING INDEX' in plan
+            assert 'TEMP B-TREE' not in plan
+
+
+class TestNext(object):
+    def test_lookup_uses_index(self, job):
+        job.service_id = job.parent_service.id
+
+        plans = query_plans(job.next)
+
+        assert len(plans) == 1
+        assert 'USING INDEX ix_jobs_service_date' in plans[0]
+        assert 'TEMP B-TREE' not in plans[0]
+
+
 class TestJobSchema(object):
     VALID_STRING = "WORKING"
     INVALID_STRING = "The job is WORKING"
@@ -277,3 +649,25 @@ class TestJobSchema(object):
 
         assert errors 
 
+
+
+class TestSchemaCaching(object):
+    def test_validator_compiled_once(self, service):
+        assert service.job_registration_validator is \
+            service.job_registration_validator
+
+    def test_setter_invalidates_cache(self, service):
+        new_schema = {'type': 'object', 'required': ['value']}
+
+        service.job_registration_schema = new_schema
+
+        assert service.job_registration_schema == new_schema
+
+        with pytest.raises(jsonschema.ValidationError):
+            service.job_registration_validator.validate({})
+
+    def test_schema_copy_leaves_validator(self, service):
+        service.job_registration_schema['type'] = 'array'
+
+        service.job_registration_validator.validate({'value': 1})
+        assert service.job_registration_schema == SERVICE_SCHEMA
@@ -0,0 +1,135 @@
+"""
+Contains unit tests for :mod:`topchef.notifications`
+"""
+import threading
+import mock
+import pytest
+from uuid import uuid1
+from topchef.notifications import NotificationBus
+
+
+class TestNotificationBus(object):
+    def test_publish_bumps_version(self):
+        bus = NotificationBus()
+        key = uuid1()
+
+        assert bus.version(key) == 0
+
+        bus.publish(key)
+
+        assert bus.version(key) == 1
+        assert bus.version(str(key)) == 1
+
+    def test_wait_times_out(self):
+        bus = NotificationBus()
+
+        assert not bus.wait(uuid1(), 0, 0.01)
+
+    def test_wait_returns_if_already_published(self):
+        bus = NotificationBus()
+        key = uuid1()
+
+        version = bus.version(key)
+        bus.publish(key)
+
+        assert bus.wait(key, version, 0.01)
+
+    def test_wait_woken_by_publish(self):
+        bus = NotificationBus()
+        key = uuid1()
+
+        publisher = threading.Timer(0.05, bus.publish, args=(key,))
+        publisher.start()
+
+        assert bus.wait(key, bus.version(key), 5)
+
+        publisher.join()
+
+    def test_publish_many_bumps_every_key(self):
+        bus = NotificationBus()
+        keys = [uuid1(), uuid1()]
+        versions = [bus.version(key) for key in keys]
+
+        bus.publish_many(keys)
+
+        for key, version in zip(keys, versions):
+            assert bus.wait(key, version, 0.01)
+
+    def test_publish_many_sends_one_notify(self):
+        bus = NotificationBus()
+        engine = mock.MagicMock()
+        engine.dialect.name = 'postgresql'
+        keys = [str(uuid1()) for _ in range(3)]
+
+        bus.publish_many(keys, engine=engine)
+
+        assert engine.execute.call_count == 1
+        _, kwargs = engine.execute.call_args
+        assert kwargs['payload'].split(',') == keys
+
+    def test_payloads_fit_in_notify(self):
+        bus = NotificationBus()
+        keys = [str(uuid1()) for _ in range(1000)]
+
+        payloads = bus._payloads(keys)
+
+        assert len(payloads) > 1
+        assert all(
+            len(payload) <= bus.MAX_PAYLOAD_BYTES for payload in payloads
+        )
+        assert ','.join(payloads).split(',') == keys
+
+
+class TestPruning(object):
+    @pytest.fixture
+    def bus(self):
+        bus = NotificationBus()
+        bus.MAX_TRACKED_KEYS = 10
+        return bus
+
+    def test_keys_forgotten(self, bus):
+        bus.publish_many([uuid1() for _ in range(bus.MAX_TRACKED_KEYS + 1)])
+
+        assert not bus._versions
+
+    def test_version_never_goes_back(self, bus):
+        key = uuid1()
+        bus.publish(key)
+        version = bus.version(key)
+
+        bus.publish_many([uuid1() for _ in range(bus.MAX_TRACKED_KEYS)])
+
+        assert str(key) not in bus._versions
+        assert bus.version(key) > version
+
+    def test_unpublished_key_stays_put(self, bus):
+        key = uuid1()
+        version = bus.version(key)
+
+        bus.publish(key)
+        bus.publish_many([uuid1() for _ in range(bus.MAX_TRACKED_KEYS)])
+
+        assert bus.wait(key, version, 0.01)
+
+    def test_subscribed_key_kept(self, bus):
+        key = str(uuid1())
+        bus.subscribe(key, lambda: None)
+        bus.publish(key)
+
+        bus.publish_many([uuid1() for _ in range(bus.MAX_TRACKED_KEYS)])
+
+        assert key in bus._versions
+
+    def test_waiter_not_woken_by_pruning(self, bus):
+        key = uuid1()
+        version = bus.version(key)
+
+        pruner = threading.Timer(
+            0.05, bus.publish_many,
+            args=([uuid1() for _ in range(bus.MAX_TRACKED_KEYS + 1)],)
+        )
+        pruner.start()
+
+        assert not bus.wait(key, version, 0.2)
+
+        pruner.join()
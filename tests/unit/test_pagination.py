@@ -0,0 +1,42 @@
+"""
+Contains unit tests for :mod:`topchef.pagination`
+"""
+import pytest
+from collections import namedtuple
+from datetime import datetime
+from uuid import uuid1
+from topchef.pagination import encode_cursor, decode_cursor, parse_date
+
+FakeJob = namedtuple('FakeJob', ['id', 'date_submitted'])
+
+
+class TestCursor(object):
+    @pytest.mark.parametrize('date_submitted', [
+        datetime(2016, 8, 23, 19, 2, 51, 496045),
+        datetime(2016, 8, 23, 19, 2, 51)
+    ])
+    def test_round_trip(self, date_submitted):
+        job = FakeJob(uuid1(), date_submitted)
+
+        assert decode_cursor(encode_cursor(job)) == (
+            job.date_submitted, job.id
+        )
+
+    @pytest.mark.parametrize('cursor', ['', 'garbage', 'Zm9vfGJhcg=='])
+    def test_invalid_cursor(self, cursor):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+class TestParseDate(object):
+    def test_naive_date(self):
+        assert parse_date('2016-08-23T19:02:51') == \
+            datetime(2016, 8, 23, 19, 2, 51)
+
+    def test_converted_to_utc(self):
+        assert parse_date('2016-08-23T21:02:51+02:00') == \
+            datetime(2016, 8, 23, 19, 2, 51)
+
+    def test_invalid_date(self):
+        with pytest.raises(ValueError):
+            parse_date('not a date')
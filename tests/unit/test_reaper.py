@@ -0,0 +1,160 @@
+"""
+Contains unit tests for :mod:`topchef.reaper`
+"""
+from datetime import datetime, timedelta
+from uuid import uuid1
+import mock
+import pytest
+from sqlalchemy import create_engine, event, select
+from topchef.config import config
+from topchef.database import METADATA, services, jobs
+from topchef import reaper
+from topchef.reaper import reap, reap_services, reap_jobs
+
+NOW = datetime(2016, 6, 1, 12)
+
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = create_engine('sqlite:///%s' % tmpdir.join('topchef.sqlite3'))
+    METADATA.create_all(bind=engine)
+    return engine
+
+
+def _add_service(engine, seconds_since_check_in, timeout=30):
+    service_id = uuid1()
+    engine.execute(services.insert().values(
+        service_id=service_id, name='Service', description='A service',
+        is_service_available=True,
+        last_checked_in=NOW - timedelta(seconds=seconds_since_check_in),
+        heartbeat_timeout_seconds=timeout
+    ))
+    return service_id
+
+
+def _add_job(engine, service_id, status, lease_expires_at=None,
+             attempts=1):
+    job_id = uuid1()
+    engine.execute(jobs.insert().values(
+        job_id=job_id, service_id=service_id, date_submitted=NOW,
+        status=status, lease_expires_at=lease_expires_at, attempts=attempts
+    ))
+    return job_id
+
+
+def _column(engine, table, column, row_id):
+    return engine.execute(
+        select([column]).where(table.primary_key.columns.values()[0] == row_id)
+    ).scalar()
+
+
+class TestReapServices(object):
+    def test_timed_out_service_unavailable(self, engine):
+        dead_service = _add_service(engine, 60)
+        live_service = _add_service(engine, 10)
+        slow_service = _add_service(engine, 60, timeout=120)
+
+        assert reap_services(engine, now=NOW) == 1
+
+        available = services.c.is_service_available
+        assert not _column(engine, services, available, dead_service)
+        assert _column(engine, services, available, live_service)
+        assert _column(engine, services, available, slow_service)
+        assert _column(engine, services, services.c.version, dead_service) == 2
+
+    def test_grace_period(self, engine):
+        _add_service(engine, 40)
+
+        assert reap_services(engine, now=NOW, grace_period=20) == 0
+        assert reap_services(engine, now=NOW) == 1
+
+    def test_reaped_once(self, engine):
+        _add_service(engine, 60)
+
+        assert reap_services(engine, now=NOW) == 1
+        assert reap_services(engine, now=NOW) == 0
+
+
+class TestReapJobs(object):
+    @pytest.fixture
+    def service_id(self, engine):
+        return _add_service(engine, 0)
+
+    @pytest.mark.parametrize('action, new_status', [
+        ('requeue', 'REGISTERED'), ('fail', 'FAILED')
+    ])
+    def test_expired_lease(self, engine, service_id, action, new_status):
+        job_id = _add_job(
+            engine, service_id, 'WORKING', NOW - timedelta(seconds=1)
+        )
+
+        assert reap_jobs(engine, now=NOW, action=action) == [job_id]
+        assert _column(engine, jobs, jobs.c.status, job_id) == new_status
+        assert _column(engine, jobs, jobs.c.lease_expires_at, job_id) is None
+        assert _column(engine, jobs, jobs.c.version, job_id) == 2
+
+    def test_leases_not_expired(self, engine, service_id):
+        leased_job = _add_job(
+            engine, service_id, 'WORKING', NOW + timedelta(seconds=1)
+        )
+        finished_job = _add_job(
+            engine, service_id, 'COMPLETED', NOW - timedelta(seconds=1)
+        )
+
+        assert reap_jobs(engine, now=NOW) == []
+        assert _column(engine, jobs, jobs.c.status, leased_job) == 'WORKING'
+        assert _column(
+            engine, jobs, jobs.c.status, finished_job
+        ) == 'COMPLETED'
+
+    def test_max_attempts_fails_job(self, engine, service_id):
+        job_id = _add_job(
+            engine, service_id, 'WORKING', NOW - timedelta(seconds=1),
+            attempts=3
+        )
+
+        with mock.patch.object(config, 'JOB_MAX_ATTEMPTS', 3):
+            reap_jobs(engine, now=NOW, action='requeue')
+
+        assert _column(engine, jobs, jobs.c.status, job_id) == 'FAILED'
+
+    def test_unknown_action(self, engine):
+        with pytest.raises(ValueError):
+            reap_jobs(engine, action='ignore')
+
+    def test_single_update(self, engine, service_id):
+        for _ in range(3):
+            _add_job(engine, service_id, 'WORKING', NOW - timedelta(seconds=1))
+
+        statements = []
+        event.listen(
+            engine, 'before_cursor_execute',
+            lambda *args: statements.append(args[2])
+        )
+
+        assert len(reap_jobs(engine, now=NOW)) == 3
+
+        job_updates = [
+            statement for statement in statements
+            if statement.startswith('UPDATE jobs SET status')
+        ]
+        assert len(job_updates) == 1
+        assert 'lease_expires_at <' in job_updates[0]
+
+
+class TestReap(object):
+    def test_reaped_when_lock_acquired(self, engine):
+        with mock.patch.object(reaper, 'reap_jobs') as reap_jobs_mock:
+            reap(engine)
+
+        assert reap_jobs_mock.called
+
+    def test_skipped_when_lock_held_elsewhere(self, engine):
+        lock = mock.MagicMock()
+        lock.return_value.__enter__.return_value = False
+
+        with mock.patch.object(reaper, '_reaper_lock', lock), \
+                mock.patch.object(reaper, 'reap_jobs') as reap_jobs_mock:
+            reap(engine)
+
+        assert not reap_jobs_mock.called
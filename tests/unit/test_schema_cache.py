@@ -0,0 +1,123 @@
+"""
+Contains unit tests for :mod:`topchef.schema_cache`
+"""
+import os
+import json
+import mock
+import pytest
+import jsonschema
+from topchef.schema_cache import SchemaCache
+
+SCHEMA = {'type': 'object', 'properties': {'value': {'type': 'integer'}}}
+
+
+@pytest.fixture
+def schema_file(tmpdir):
+    path = tmpdir.join('schema.json')
+    path.write(json.dumps(SCHEMA))
+    return str(path)
+
+
+def load(path):
+    with open(path) as schema_file:
+        return json.loads(schema_file.read())
+
+
+class TestSchemaCache(object):
+    def test_get(self, schema_file):
+        cache = SchemaCache(10)
+
+        entry = cache.get('key', schema_file, load)
+
+        assert entry.schema == SCHEMA
+        entry.validator.validate({'value': 1})
+
+        with pytest.raises(jsonschema.ValidationError):
+            entry.validator.validate({'value': 'string'})
+
+    def test_get_cached(self, schema_file):
+        cache = SchemaCache(10)
+        loader = mock.MagicMock(side_effect=load)
+
+        first_entry = cache.get('key', schema_file, loader)
+        second_entry = cache.get('key', schema_file, loader)
+
+        assert first_entry.validator is second_entry.validator
+        assert loader.call_count == 1
+
+    def test_file_changed(self, schema_file):
+        cache = SchemaCache(10)
+        cache.get('key', schema_file, load)
+
+        with open(schema_file, mode='w') as new_file:
+            new_file.write(json.dumps({'type': 'array'}))
+        os.utime(schema_file, (0, 0))
+
+        assert cache.get('key', schema_file, load).schema == {'type': 'array'}
+
+    def test_invalidate(self, schema_file):
+        cache = SchemaCache(10)
+        loader = mock.MagicMock(side_effect=load)
+
+        cache.get('key', schema_file, loader)
+        cache.invalidate('key')
+        cache.get('key', schema_file, loader)
+
+        assert loader.call_count == 2
+
+    def test_least_recently_used_evicted(self, tmpdir):
+        schema_files = {}
+        for key in ('first', 'second', 'third'):
+            path = tmpdir.join('%s.json' % key)
+            path.write(json.dumps(SCHEMA))
+            schema_files[key] = str(path)
+
+        cache = SchemaCache(2)
+        loader = mock.MagicMock(side_effect=load)
+
+        cache.get('first', schema_files['first'], loader)
+        cache.get('second', schema_files['second'], loader)
+        cache.get('first', schema_files['first'], loader)
+        cache.get('third', schema_files['third'], loader)
+
+        assert len(cache) == 2
+
+        cache.get('first', schema_files['first'], loader)
+        assert loader.call_count == 3
+
+        cache.get('second', schema_files['second'], loader)
+        assert loader.call_count == 4
+
+    def test_entry_not_copied(self, schema_file):
+        cache = SchemaCache(10)
+
+        first_entry = cache.get('key', schema_file, load)
+        second_entry = cache.get('key', schema_file, load)
+
+        assert first_entry.schema is second_entry.schema
+        assert first_entry.validator is second_entry.validator
+
+    def test_invalid_schema(self, tmpdir):
+        path = tmpdir.join('schema.json')
+        path.write(json.dumps({'type': 12}))
+
+        with pytest.raises(jsonschema.SchemaError):
+            SchemaCache(10).get('key', str(path), load)
+
+    def test_hard_links_share_entry(self, schema_file, tmpdir):
+        linked_file = str(tmpdir.join('linked_schema.json'))
+        os.link(schema_file, linked_file)
+
+        cache = SchemaCache(10)
+        loader = mock.MagicMock(side_effect=load)
+
+        first_entry = cache.get('first', schema_file, loader)
+        second_entry = cache.get('second', linked_file, loader)
+
+        assert first_entry.validator is second_entry.validator
+        assert loader.call_count == 1
+
+        cache.invalidate('first')
+        cache.invalidate('second')
+        cache.get('first', schema_file, loader)
+        assert loader.call_count == 2
@@ -0,0 +1,106 @@
+"""
+Contains unit tests for :mod:`topchef.serve`
+"""
+import mock
+import pytest
+from sqlalchemy import create_engine, inspect
+from topchef import serve
+from topchef.config import config
+
+
+@pytest.yield_fixture
+def postgresql():
+    engine = mock.MagicMock()
+    engine.dialect.name = 'postgresql'
+
+    with mock.patch.object(config, '_engine', engine):
+        yield engine
+
+
+class TestServerOptions(object):
+    @pytest.fixture(autouse=True)
+    def database(self, postgresql):
+        return postgresql
+
+    def test_defaults(self):
+        with mock.patch.object(config, 'WORKERS', 0):
+            options = serve.server_options()
+
+        assert options['workers'] == serve.default_worker_count()
+        assert options['threads'] == config.THREADS
+        assert options['bind'] == '%s:%d' % (config.HOSTNAME, config.PORT)
+        assert options['preload_app']
+
+    def test_overrides(self):
+        options = serve.server_options(
+            workers=2, threads=8, hostname='0.0.0.0', port=8080
+        )
+
+        assert options['workers'] == 2
+        assert options['threads'] == 8
+        assert options['bind'] == '0.0.0.0:8080'
+
+    def test_configured_workers(self):
+        with mock.patch.object(config, 'WORKERS', 5):
+            assert serve.server_options()['workers'] == 5
+
+    def test_one_worker_on_sqlite(self, tmpdir):
+        engine = create_engine(
+            'sqlite:///%s' % tmpdir.join('topchef.sqlite3')
+        )
+
+        with mock.patch.object(config, '_engine', engine):
+            assert serve.server_options(workers=4)['workers'] == 1
+
+
+class TestHooks(object):
+    @pytest.yield_fixture
+    def engine(self, tmpdir):
+        engine = create_engine(
+            'sqlite:///%s' % tmpdir.join('topchef.sqlite3')
+        )
+        with mock.patch.object(config, '_engine', engine):
+            yield engine
+
+    def test_prepare_master(self, engine):
+        with mock.patch.object(engine, 'dispose') as dispose:
+            serve.prepare_master()
+
+        assert 'jobs' in inspect(engine).get_table_names()
+        assert dispose.called
+
+    def test_post_fork(self):
+        engine = mock.MagicMock()
+
+        with mock.patch.object(config, '_engine', engine), \
+                mock.patch('topchef.serve.start_reaper') as start_reaper:
+            serve.post_fork(mock.MagicMock(), mock.MagicMock())
+
+        assert engine.dispose.called
+        assert start_reaper.called
+
+    def test_worker_exit_flushes_heartbeats(self, engine):
+        with mock.patch.object(serve.HEARTBEATS, 'flush') as flush:
+            serve.worker_exit(mock.MagicMock(), mock.MagicMock())
+
+        flush.assert_called_once_with(engine)
+
+
+class TestTopChefServer(object):
+    def test_load(self, postgresql):
+        pytest.importorskip('gunicorn')
+        application = mock.MagicMock()
+
+        server = serve.TopChefServer(
+            application, serve.server_options(workers=2, threads=4)
+        )
+
+        assert server.cfg.workers == 2
+        assert server.cfg.threads == 4
+        assert server.cfg.preload_app
+        assert server.load() is application
+
+    def test_no_gunicorn(self):
+        with mock.patch('topchef.serve.BaseApplication', object):
+            with pytest.raises(RuntimeError):
+                serve.TopChefServer(mock.MagicMock(), {})
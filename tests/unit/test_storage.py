@@ -0,0 +1,143 @@
+"""
+Contains unit tests for :mod:`topchef.storage`
+"""
+import os
+import mock
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from topchef import models
+from topchef.config import config
+from topchef.database import METADATA
+from topchef.storage import storage_from_name, migrate_to_database
+from topchef.storage import JobStorage, FileSystemStorage, DatabaseStorage
+from topchef.storage import GZIP_MAGIC, compress
+from .test_models import schema_directory, schema_directory_organizer
+from .test_models import service
+
+PARAMETERS = {'value': 1}
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    METADATA.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def test_storage_from_name():
+    assert isinstance(storage_from_name('filesystem'), FileSystemStorage)
+    assert isinstance(storage_from_name('database'), DatabaseStorage)
+
+    with pytest.raises(ValueError):
+        storage_from_name('tape')
+
+
+def test_incomplete_backend():
+    class ParametersOnly(JobStorage):
+        def read_parameters(self, job):
+            return {}
+
+        def write_parameters(self, job, parameters):
+            pass
+
+    with pytest.raises(TypeError):
+        ParametersOnly()
+
+
+class TestDatabaseStorage(object):
+    def test_no_job_directory(self, service, schema_directory_organizer):
+        job = models.Job(service, PARAMETERS, storage=DatabaseStorage())
+
+        assert not os.path.isdir(schema_directory_organizer[job])
+        assert job.parameters == PARAMETERS
+        assert job.result == {}
+
+    def test_round_trip(self, service, session):
+        job = models.Job(service, PARAMETERS, storage=DatabaseStorage())
+        job.result = {'answer': 42}
+
+        job_id = job.id
+
+        session.add(job)
+        session.commit()
+        session.expunge_all()
+
+        loaded_job = session.query(models.Job).filter_by(id=job_id).first()
+
+        assert loaded_job._parameters == PARAMETERS
+        assert loaded_job._result == {'answer': 42}
+
+
+class TestFileSystemStorage(object):
+    def test_round_trip(self, service, schema_directory_organizer):
+        job = models.Job(
+            service, PARAMETERS, file_manager=schema_directory_organizer,
+            storage=FileSystemStorage()
+        )
+        job.result = {'answer': 42}
+
+        assert os.path.isfile(os.path.join(
+            schema_directory_organizer[job],
+            schema_directory_organizer.JOB_PARAMETER_FILE_NAME
+        ))
+        assert job.parameters == PARAMETERS
+        assert job.result == {'answer': 42}
+        assert job._parameters is None
+
+    def test_compressed_result(self, service, schema_directory_organizer):
+        job = models.Job(
+            service, PARAMETERS, file_manager=schema_directory_organizer,
+            storage=FileSystemStorage()
+        )
+
+        with mock.patch.object(config, 'RESULT_COMPRESSION_THRESHOLD', 10):
+            job.result = {'answer': 42}
+
+        result_file, content_encoding = job.storage.open_result(job)
+        with result_file:
+            assert result_file.read(2) == GZIP_MAGIC
+
+        assert content_encoding == 'gzip'
+        assert job.result == {'answer': 42}
+
+    def test_small_result_uncompressed(
+            self, service, schema_directory_organizer
+    ):
+        job = models.Job(
+            service, PARAMETERS, file_manager=schema_directory_organizer,
+            storage=FileSystemStorage()
+        )
+        job.result = {'answer': 42}
+
+        result_file, content_encoding = job.storage.open_result(job)
+        with result_file:
+            assert result_file.read() == b'{"answer": 42}'
+
+        assert content_encoding is None
+
+    def test_compress_is_deterministic(self):
+        assert compress('{"answer": 42}') == compress('{"answer": 42}')
+
+
+def test_migrate_to_database(service, schema_directory_organizer, session):
+    job = models.Job(
+        service, PARAMETERS, file_manager=schema_directory_organizer,
+        storage=FileSystemStorage()
+    )
+    job.result = {'answer': 42}
+    job_id = job.id
+
+    session.add(job)
+    session.commit()
+
+    assert migrate_to_database(
+        session, schema_directory_organizer, batch_size=1
+    ) == 1
+    assert migrate_to_database(session, schema_directory_organizer) == 0
+
+    session.expunge_all()
+    loaded_job = session.query(models.Job).filter_by(id=job_id).first()
+
+    assert loaded_job._parameters == PARAMETERS
+    assert loaded_job._result == {'answer': 42}
@@ -1,12 +1,63 @@
 #!/usr/bin/env python
+"""
+Runs the TopChef server.
+
+With no arguments, or with ``run``, the Flask development server is
+started. ``serve`` starts the production server, described in
+:mod:`topchef.serve`.
+"""
 import os
-from topchef.api_server import app
+import argparse
 from topchef.config import config
-from topchef.database import METADATA
 
-METADATA.create_all(bind=config.database_engine)
 
-if not os.path.isdir(config.SCHEMA_DIRECTORY):
-    os.mkdir(config.SCHEMA_DIRECTORY)
+def run_development_server(hostname=None, port=None):
+    from topchef.api_server import app
+    from topchef.database import METADATA
+    from topchef.reaper import start_reaper
+
+    METADATA.create_all(bind=config.database_engine)
+
+    if not os.path.isdir(config.SCHEMA_DIRECTORY):
+        os.mkdir(config.SCHEMA_DIRECTORY)
+
+    start_reaper()
+
+    app.run(
+        host=hostname or config.HOSTNAME, port=port or config.PORT,
+        debug=config.DEBUG
+    )
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(prog='topchef', description=__doc__)
+    parser.add_argument(
+        'command', nargs='?', choices=['run', 'serve'], default='run',
+        help='run starts the development server, and serve starts the '
+             'production server'
+    )
+    parser.add_argument(
+        '--workers', type=int,
+        help='The number of worker processes. Defaults to WORKERS'
+    )
+    parser.add_argument(
+        '--threads', type=int,
+        help='The number of threads per worker. Defaults to THREADS'
+    )
+    parser.add_argument('--host', help='Defaults to HOSTNAME')
+    parser.add_argument('--port', type=int, help='Defaults to PORT')
+
+    arguments = parser.parse_args(arguments)
+
+    if arguments.command == 'serve':
+        from topchef.serve import serve
+        serve(
+            workers=arguments.workers, threads=arguments.threads,
+            hostname=arguments.host, port=arguments.port
+        )
+    else:
+        run_development_server(hostname=arguments.host, port=arguments.port)
+
 
-app.run(host=config.HOSTNAME, port=config.PORT, debug=config.DEBUG)
+if __name__ == '__main__':
+    main()
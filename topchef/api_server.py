@@ -2,26 +2,133 @@
 Contains the routing map for the API, along with function definitions for the
 endpoints
 """
+import os
+import gzip
 import logging
+import math
+import mimetypes
+import time
+import tempfile
 import jsonschema
 from uuid import uuid1, UUID
 from marshmallow_jsonschema import JSONSchema
 from .config import config
 from flask import Flask, jsonify, request, url_for, redirect
+from flask import Response, send_file, stream_with_context
 from datetime import datetime
 from .models import Service, Job, UnableToFindItemError, FILE_MANAGER
 from .decorators import check_json
-from sqlalchemy.orm import sessionmaker
+from .export import EXPORT_CONTENT_TYPES, export_query, ndjson_rows
+from .export import numeric_columns, write_npz
+from .heartbeats import HEARTBEATS
+from .notifications import NOTIFICATIONS
+from .pagination import paginate_jobs
+from .schema_documents import GENERATED_SCHEMAS, get_schema_document
+from sqlalchemy.orm import sessionmaker, scoped_session, joinedload
 from sqlalchemy.exc import IntegrityError
+from werkzeug.wsgi import wrap_file
 
 app = Flask(__name__)
 app.config.update(config.parameter_dict)
 
-SESSION_FACTORY = sessionmaker(bind=config.database_engine)
+SESSION_FACTORY = scoped_session(sessionmaker(bind=config.database_engine))
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
 
+@app.teardown_request
+def remove_session(exception=None):
+    """
+    Close the session used by the request, returning its connection to the
+    pool. Each request gets a new session from ``SESSION_FACTORY``.
+    """
+    SESSION_FACTORY.remove()
+
+
+def _get_wait_time():
+    """
+    Read the ``wait`` query parameter of a long-polling request
+
+    :return: The number of seconds for which the request may block. This is
+        ``0`` if the parameter is not given, and is never more than
+        ``LONG_POLL_MAX_WAIT``.
+    :rtype: float
+    :raises: ValueError if the parameter is not a finite, non-negative
+        number
+    """
+    wait_time = float(request.args.get('wait', 0))
+
+    if math.isnan(wait_time) or math.isinf(wait_time):
+        raise ValueError('The wait time %s is not finite' % wait_time)
+
+    if wait_time < 0:
+        raise ValueError('The wait time %s is negative' % wait_time)
+
+    return min(wait_time, float(config.LONG_POLL_MAX_WAIT))
+
+
+def _not_modified(etag):
+    """
+    :param str etag: The current entity tag of the requested model
+    :return: A 304 response if the ``If-None-Match`` header of the request
+        matches the tag, otherwise ``None``
+    :rtype: flask.Response | None
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def _job_page_response(query, endpoint, **endpoint_arguments):
+    """
+    Page through a query for jobs with the arguments in the query string of
+    the request, and serialize the page. The page costs the same number of
+    queries whatever its size. With the ``filesystem`` job storage, each
+    job's parameters are read from its own file, so only the ``database``
+    storage serializes a page without touching the disk.
+
+    :param Query query: The query for the jobs to page through
+    :param str endpoint: The endpoint for which a link to the next page is
+        to be made
+    :param endpoint_arguments: Any other arguments needed to build the URL
+        to the endpoint
+    :return: The page of jobs, or a 400 response if the query string is
+        invalid
+    :rtype: flask.Response
+    """
+    try:
+        page = paginate_jobs(
+            query, Job, request.args,
+            config.JOB_PAGE_SIZE, config.MAX_JOB_PAGE_SIZE
+        )
+    except ValueError as error:
+        response = jsonify({'errors': str(error)})
+        response.status_code = 400
+        return response
+
+    for job in page.items:
+        job.file_manager = FILE_MANAGER
+
+    meta = {'count': len(page.items)}
+
+    if page.next_cursor is not None:
+        endpoint_arguments.update(page.arguments)
+        meta['next'] = url_for(
+            endpoint, after=page.next_cursor, _external=True,
+            **endpoint_arguments
+        )
+
+    response = jsonify({
+        'data': Job.JobSchema(many=True).dump(page.items).data,
+        'meta': meta
+    })
+    response.status_code = 200
+    return response
+
+
 @app.route('/')
 def hello_world():
     """
@@ -171,8 +278,7 @@ def get_services():
     response = jsonify({
         'data': Service.ServiceSchema(many=True).dump(service_list).data,
         'meta': {
-            "POST_schema":
-                JSONSchema().dump(Service.DetailedServiceSchema()).data
+            "POST_schema": get_schema_document('service').document
         }
     })
 
@@ -181,6 +287,71 @@ def get_services():
     return response
 
 
+@app.route('/schemas', methods=["GET"])
+def get_generated_schemas():
+    """
+    Returns links to the JSON schemas that request bodies sent to this API
+    must satisfy
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+
+        {
+          "data": {
+            "job": "http://localhost:5000/schemas/job",
+            "service": "http://localhost:5000/schemas/service"
+          }
+        }
+
+    :statuscode 200: The links were returned
+    """
+    return jsonify({
+        'data': {
+            name: url_for(
+                'get_generated_schema', schema_name=name, _external=True
+            ) for name in GENERATED_SCHEMAS
+        }
+    })
+
+
+@app.route('/schemas/<schema_name>', methods=["GET"])
+def get_generated_schema(schema_name):
+    """
+    Returns one of the JSON schemas that request bodies sent to this API must
+    satisfy. The schema for registering a service is also given as the
+    ``POST_schema`` in ``GET /services``.
+
+    These documents only change when the server is upgraded, so they are
+    served with an ``ETag`` and a ``Cache-Control`` header. A request with
+    a matching ``If-None-Match`` header gets a 304 response.
+
+    :statuscode 200: The schema was returned
+    :statuscode 304: The client's copy of the schema is up to date
+    :statuscode 404: There is no schema with this name
+    """
+    try:
+        schema_document = get_schema_document(schema_name)
+    except KeyError:
+        response = jsonify({
+            'errors': 'There is no schema named %s' % schema_name
+        })
+        response.status_code = 404
+        return response
+
+    response = app.response_class(
+        schema_document.body, mimetype='application/json'
+    )
+    response.set_etag(schema_document.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = config.SCHEMA_DOCUMENT_MAX_AGE
+
+    return response.make_conditional(request)
+
+
 @app.route('/services', methods=["POST"])
 @check_json
 def register_service():
@@ -278,6 +449,18 @@ def register_service():
 
 @app.route('/services/<service_id>', methods=["GET"])
 def get_service_data(service_id):
+    """
+    Returns the details of a service.
+
+    The response has an ``ETag`` that changes whenever the service
+    heartbeats or times out. If the request's ``If-None-Match`` header
+    matches it, a 304 response is returned without reading the service's
+    schemas.
+
+    :statuscode 200: The service was returned
+    :statuscode 304: The client's copy of the service is up to date
+    :statuscode 404: The service with this id could not be found
+    """
     try:
         service_id = UUID(service_id)
     except ValueError:
@@ -289,7 +472,6 @@ def get_service_data(service_id):
     session = SESSION_FACTORY()
 
     service = session.query(Service).filter_by(id=service_id).first()
-    service.file_manager = FILE_MANAGER
 
     if service is None:
         response = jsonify({
@@ -298,13 +480,31 @@ def get_service_data(service_id):
         response.status_code = 404
         return response
 
+    not_modified_response = _not_modified(service.etag)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    service.file_manager = FILE_MANAGER
+
     data, _ = service.DetailedServiceSchema().dump(service)
 
-    return jsonify({'data': data})
+    response = jsonify({'data': data})
+    response.set_etag(service.etag)
+    return response
 
 
 @app.route('/services/<service_id>', methods=["PATCH"])
 def heartbeat(service_id):
+    """
+    Record that a service has checked in.
+
+    Heartbeats are buffered in memory, and are written to the database in
+    one batch every ``HEARTBEAT_FLUSH_INTERVAL`` seconds. Until then, this
+    process reports the service's availability from the buffer.
+
+    :statuscode 200: The heartbeat was recorded
+    :statuscode 404: The service with this id could not be found
+    """
     session = SESSION_FACTORY()
     try:
         service_id = UUID(service_id)
@@ -315,24 +515,31 @@ def heartbeat(service_id):
         response.status_code = 404
         return response
 
-    try:
-        service = Service.from_session(session, service_id)
-    except UnableToFindItemError:
+    service_exists = session.query(
+        Service.id
+    ).filter_by(id=service_id).first() is not None
+
+    if not service_exists:
         response = jsonify({
-            'errors': 'The job with id %s does not exist'
+            'errors': 'The service with id %s does not exist' % service_id
         })
         response.status_code = 404
         return response
 
-    service.heartbeat()
+    HEARTBEATS.record(service_id)
 
-    session.add(service)
-    session.commit()
+    if config.HEARTBEAT_FLUSH_INTERVAL > 0:
+        HEARTBEATS.start_flusher(
+            lambda: config.database_engine, config.HEARTBEAT_FLUSH_INTERVAL
+        )
+    else:
+        session.close()
+        HEARTBEATS.flush(session.get_bind())
 
     if not request.json:
         response = jsonify({
             'data': 'service %s checked in at %s' % (
-                service.id, datetime.utcnow().isoformat()
+                service_id, datetime.utcnow().isoformat()
             )
         })
         response.status_code = 200
@@ -345,6 +552,52 @@ def heartbeat(service_id):
 
 @app.route('/services/<service_id>/jobs', methods=["GET"])
 def get_jobs_for_service(service_id):
+    """
+    Returns a page of the jobs submitted to a service, oldest first.
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+
+        {
+          "data": [
+            {
+              "date_submitted": "2016-08-23T19:02:51.496045+00:00",
+              "id": "eb511c46-6577-11e6-a72a-3c970e7271f5",
+              "parameters": {"value": 1},
+              "status": "COMPLETED"
+            }
+          ],
+          "meta": {
+            "count": 1,
+            "next": "http://localhost:5000/services/ba6d7f78-6577-11e6-a72a-3c970e7271f5/jobs?after=MjAxNi0wOC0yM1QxOTowMjo1MS40OTYwNDV8ZWI1MTFjNDY2NTc3MTFlNmE3MmEzYzk3MGU3MjcxZjU%3D&limit=1"
+          }
+        }
+
+    :query int limit: The number of jobs per page
+    :query str after: The cursor to the next page, as given in the ``next``
+        link of the previous page
+    :query str status: Only return jobs with this status
+    :query str submitted_after: Only return jobs submitted at or after this
+        ISO 8601 date
+    :query str submitted_before: Only return jobs submitted before this
+        ISO 8601 date
+    :statuscode 200: The page of jobs was returned
+    :statuscode 400: An argument in the query string is invalid
+    :statuscode 404: The service with this id could not be found
+    """
+    try:
+        service_id = UUID(service_id)
+    except ValueError:
+        response = jsonify({
+            'errors': 'A service with id %s was not found' % service_id
+        })
+        response.status_code = 404
+        return response
+
     session = SESSION_FACTORY()
     service = session.query(Service).filter_by(id=service_id).first()
 
@@ -355,21 +608,119 @@ def get_jobs_for_service(service_id):
         response.status_code = 404
         return response
 
-    service.file_manager = FILE_MANAGER
+    return _job_page_response(
+        session.query(Job).filter(Job.service_id == service_id),
+        'get_jobs_for_service', service_id=service_id
+    )
 
-    response = jsonify({
-        'data': Job.JobSchema(many=True).dump(service.jobs).data
-    })
 
-    response.status_code = 200
-    return response
+@app.route('/services/<service_id>/jobs/export', methods=["GET"])
+def export_jobs_for_service(service_id):
+    """
+    Stream every job of a service, with its parameters and result, in one
+    response. Jobs are read in batches and written out as they are read, so
+    exports of any size use a bounded amount of memory on the server.
+
+    With ``format=npz``, the ``COMPLETED`` jobs are returned as a NumPy
+    ``.npz`` archive instead, with one array per numeric or boolean
+    property in the service's job registration and job result schemas.
+    This needs NumPy to be installed on the server.
+
+    **Example Request**
+
+    .. sourcecode:: http
+
+        GET /services/ba6d7f78-6577-11e6-a72a-3c970e7271f5/jobs/export?format=ndjson HTTP/1.1
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/x-ndjson
+
+        {"attempts": 1, "date_submitted": "2016-08-23T19:02:51.496045+00:00", "id": "eb511c46-6577-11e6-a72a-3c970e7271f5", "parameters": {"value": 1}, "priority": 0, "result": {"value": 2}, "status": "COMPLETED"}
+        {"attempts": 0, "date_submitted": "2016-08-23T19:03:12.183911+00:00", "id": "f7c2a0d2-6577-11e6-a72a-3c970e7271f5", "parameters": {"value": 3}, "priority": 0, "result": {}, "status": "REGISTERED"}
+
+    :query str format: The export format, either ``ndjson`` or ``npz``.
+        The default is ``ndjson``
+    :statuscode 200: The jobs are being streamed
+    :statuscode 400: The export format is not supported
+    :statuscode 404: The service with this id could not be found
+    :statuscode 501: The ``npz`` format was asked for, but NumPy is not
+        installed
+    """
+    try:
+        service_id = UUID(service_id)
+    except ValueError:
+        response = jsonify({
+            'errors': 'A service with id %s was not found' % service_id
+        })
+        response.status_code = 404
+        return response
+
+    export_format = request.args.get('format', 'ndjson')
+
+    if export_format not in EXPORT_CONTENT_TYPES:
+        response = jsonify({
+            'errors': 'Unknown export format %s. Expected one of %s' % (
+                export_format, ', '.join(sorted(EXPORT_CONTENT_TYPES))
+            )
+        })
+        response.status_code = 400
+        return response
+
+    session = SESSION_FACTORY()
+
+    service = session.query(Service).filter_by(id=service_id).first()
+
+    if not service:
+        response = jsonify({
+            'errors': 'A service with id %s was not found' % service_id
+        })
+        response.status_code = 404
+        return response
+
+    if export_format == 'npz':
+        service.file_manager = FILE_MANAGER
+        archive = tempfile.TemporaryFile()
+
+        try:
+            write_npz(
+                export_query(session, service_id, status='COMPLETED'),
+                numeric_columns(service), FILE_MANAGER, archive
+            )
+        except RuntimeError as error:
+            archive.close()
+            response = jsonify({'errors': str(error)})
+            response.status_code = 501
+            return response
+
+        archive.seek(0)
+        response = Response(
+            wrap_file(request.environ, archive),
+            mimetype=EXPORT_CONTENT_TYPES[export_format],
+            direct_passthrough=True
+        )
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=%s.npz' % service_id
+        return response
+
+    rows = ndjson_rows(export_query(session, service_id), FILE_MANAGER)
+
+    return Response(
+        stream_with_context(rows),
+        mimetype=EXPORT_CONTENT_TYPES[export_format]
+    )
 
 
 @app.route('/services/<service_id>/jobs', methods=["POST"])
 @check_json
 def request_job(service_id):
     """
-    Request a job from a particular service to run on the system
+    Request a job from a particular service to run on the system. The
+    optional integer ``priority`` of the job defaults to 0. Jobs with a
+    higher priority are taken off the service's queue first.
 
     **Example Response**
     
@@ -431,7 +782,10 @@ def request_job(service_id):
         response.status_code = 400
         return response
 
-    job = Job(service, job_data['parameters'])
+    job = Job(
+        service, job_data['parameters'],
+        priority=job_data.get('priority', 0)
+    )
 
     session.add(job)
 
@@ -451,6 +805,8 @@ def request_job(service_id):
         response.status_code = 400
         return response
 
+    NOTIFICATIONS.publish(service.id, engine=session.get_bind())
+
     response = jsonify({
         'data': {
             'message': 'Job %s successfully created' % job.__repr__(),
@@ -464,79 +820,882 @@ def request_job(service_id):
     response.status_code = 201
     return response
 
-@app.route('/services/<service_id>/queue', methods=["GET"])
-def get_service_queue(service_id):
-    session = SESSION_FACTORY()
+@app.route('/services/<service_id>/jobs:batch', methods=["POST"])
+@check_json
+def request_jobs(service_id):
+    """
+    Submit many jobs to a service at once. The request body is a list of
+    jobs, in the same format as for ``POST /services/<service_id>/jobs``.
+    All jobs are checked against the service's job registration schema
+    before any of them is stored, and the valid jobs are inserted in one
+    transaction. If the transaction fails, the directories made for its
+    jobs are removed.
+
+    **Example Request**
+
+    .. sourcecode:: http
+
+        POST /services/ba6d7f78-6577-11e6-a72a-3c970e7271f5/jobs:batch HTTP/1.1
+        Content-Type: application/json
 
+        [
+          {"parameters": {"value": 1}},
+          {"parameters": {"value": "one"}}
+        ]
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 201 CREATED
+        Content-Type: application/json
+
+        {
+          "data": [
+            {
+              "id": "eb511c46-6577-11e6-a72a-3c970e7271f5",
+              "url": "http://localhost:5000/jobs/eb511c46-6577-11e6-a72a-3c970e7271f5"
+            },
+            {
+              "errors": "'one' is not of type 'integer'"
+            }
+          ],
+          "meta": {"created": 1, "failed": 1}
+        }
+
+    :statuscode 201: At least one job was created. Jobs that could not be
+        created have an ``errors`` entry in place of their id.
+    :statuscode 400: The body is not a list, the list is too long, or none
+        of the jobs could be created
+    :statuscode 404: The service with this id could not be found
+    """
     try:
         service_id = UUID(service_id)
     except ValueError:
         response = jsonify({
-            'errors': 'Could not parse job_id=%s as a UUID' % service_id
+            'errors': 'A service with id %s was not found' % service_id
         })
         response.status_code = 404
         return response
 
+    if not isinstance(request.json, list):
+        response = jsonify({'errors': 'The request body is not a list'})
+        response.status_code = 400
+        return response
+
+    if len(request.json) > config.MAX_JOB_BATCH_SIZE:
+        response = jsonify({
+            'errors': 'Cannot submit more than %d jobs at once' % (
+                config.MAX_JOB_BATCH_SIZE)
+        })
+        response.status_code = 400
+        return response
+
+    session = SESSION_FACTORY()
     service = session.query(Service).filter_by(id=service_id).first()
 
     if not service:
         response = jsonify({
-            'errors': 'Could not find service with id %s' % str(service_id)
+            'errors': 'A service with id %s was not found' % service_id
         })
         response.status_code = 404
         return response
 
-    job_list = [job for job in service.jobs if job.status == "REGISTERED"]
+    service.file_manager = FILE_MANAGER
 
-    job_data = Job.JobSchema(many=True).dump(job_list).data
+    validator = service.job_registration_validator
+    outcomes = []
+    valid_requests = []
 
-    response = jsonify({'data': job_data})
-    response.status_code = 200
-    return response
-    
+    for job_request in request.json:
+        if not isinstance(job_request, dict):
+            outcomes.append({'errors': 'The job %r is not an object' % (
+                job_request,
+            )})
+            continue
 
-@app.route('/jobs', methods=["GET"])
-def get_jobs():
-    session = SESSION_FACTORY()
-    job_list = session.query(Job).all()
+        job_data, errors = Job.JobSchema().load(job_request)
 
-    for job in job_list:
-        job.file_manager = FILE_MANAGER
+        if errors:
+            outcomes.append({
+                'errors': 'Schema loading produced errors %s' % errors
+            })
+            continue
 
-    response = jsonify({'data': Job.JobSchema(many=True).dump(job_list).data})
-    response.status_code = 200
+        try:
+            validator.validate(job_data['parameters'])
+        except jsonschema.ValidationError as error:
+            outcomes.append({'errors': error.message})
+            continue
 
-    return response
+        valid_requests.append((len(outcomes), job_data))
+        outcomes.append(None)
+
+    if not valid_requests:
+        session.rollback()
+        response = jsonify({'data': outcomes})
+        response.status_code = 400
+        return response
 
+    new_jobs = []
 
-@app.route('/jobs/<job_id>', methods=['GET'])
-def get_job(job_id):
     try:
-        job_id = UUID(job_id)
-    except ValueError:
-        response = jsonify({
-            'errors': 'Could not parse job_id=%s as a UUID' % job_id
-        })
-        response.status_code = 404
-        return response
+        for position, job_data in valid_requests:
+            job = Job(
+                service, job_data['parameters'],
+                priority=job_data.get('priority', 0)
+            )
+            new_jobs.append(job)
+            outcomes[position] = job.id
 
-    session = SESSION_FACTORY()
-    job = session.query(Job).filter_by(id=job_id).first()
+        session.add_all(new_jobs)
+        session.commit()
+    except Exception as error:
+        session.rollback()
+        for job in new_jobs:
+            job.storage.unregister(job)
+
+        if not isinstance(error, IntegrityError):
+            raise
+
+        case_number = uuid1()
+        LOG.error('case_number: %s, message: %s', case_number, error)
 
-    if not job:
         response = jsonify({
-            'errors': 'A job with id %s was not found' % job_id
+            'errors': {
+                'case_number': case_number,
+                'message': 'Integrity error thrown when attempting commit'
+            }
         })
-        response.status_code = 404
+        response.status_code = 400
         return response
 
-    job.file_manager = FILE_MANAGER
+    NOTIFICATIONS.publish(service_id, engine=session.get_bind())
 
-    response = jsonify({'data': job.DetailedJobSchema().dump(job).data})
-    response.status_code = 200
+    response = jsonify({
+        'data': [
+            {
+                'id': str(outcome),
+                'url': url_for('get_job', job_id=outcome, _external=True)
+            } if isinstance(outcome, UUID) else outcome
+            for outcome in outcomes
+        ],
+        'meta': {
+            'created': len(new_jobs),
+            'failed': len(outcomes) - len(new_jobs)
+        }
+    })
+    response.status_code = 201
     return response
 
-@app.route('/jobs/<job_id>', methods=["PUT"])
+
+@app.route('/services/<service_id>/queue', methods=["GET"])
+def get_service_queue(service_id):
+    """
+    Returns the jobs of a service that are waiting to be worked on, in the
+    order in which they will be claimed. Jobs with a higher ``priority`` go
+    first, and jobs with the same priority are returned oldest first.
+
+    If the ``wait`` query parameter is given, and the queue is empty, the
+    request blocks for up to ``wait`` seconds until a job is submitted to
+    this service. Workers should use this instead of polling the queue in a
+    loop.
+
+    **Example Request**
+
+    .. sourcecode:: http
+
+        GET /services/eb511c46-6577-11e6-a72a-3c970e7271f5/queue?wait=20 HTTP/1.1
+
+    :query float wait: The longest time in seconds to wait for a job
+    :statuscode 200: The queue was returned. If the wait timed out, the
+        queue is empty.
+    :statuscode 400: The wait time is not a non-negative number
+    :statuscode 404: The service with this id could not be found
+    """
+    session = SESSION_FACTORY()
+
+    try:
+        service_id = UUID(service_id)
+    except ValueError:
+        response = jsonify({
+            'errors': 'Could not parse job_id=%s as a UUID' % service_id
+        })
+        response.status_code = 404
+        return response
+
+    service = session.query(Service).filter_by(id=service_id).first()
+
+    if not service:
+        response = jsonify({
+            'errors': 'Could not find service with id %s' % str(service_id)
+        })
+        response.status_code = 404
+        return response
+
+    try:
+        wait_time = _get_wait_time()
+    except ValueError as error:
+        response = jsonify({'errors': str(error)})
+        response.status_code = 400
+        return response
+
+    deadline = time.time() + wait_time
+    queue = session.query(Job).filter(
+        Job.service_id == service_id, Job.status == "REGISTERED"
+    ).order_by(*Job.queue_order())
+
+    while True:
+        version = NOTIFICATIONS.version(service_id)
+        job_list = queue.all()
+
+        remaining_time = deadline - time.time()
+        if job_list or remaining_time <= 0:
+            break
+
+        session.rollback()
+        NOTIFICATIONS.wait(
+            service_id, version, remaining_time, engine=session.get_bind()
+        )
+
+    for job in job_list:
+        job.file_manager = FILE_MANAGER
+
+    job_data = Job.JobSchema(many=True).dump(job_list).data
+
+    response = jsonify({'data': job_data})
+    response.status_code = 200
+    return response
+    
+
+@app.route('/services/<service_id>/queue/claim', methods=["POST"])
+def claim_next_job(service_id):
+    """
+    Take the first job off the queue of a service, as ordered by priority
+    and then age, and mark it as ``WORKING`` in one transaction. Workers
+    should use this endpoint instead of reading the queue and updating the
+    job status, as two workers reading the queue at the same time may end
+    up running the same job.
+
+    The job's ``attempts`` is the worker's lease token. It must be sent as
+    ``attempt`` when renewing the lease and when updating the job, so that
+    a worker whose lease was taken over can no longer change the job.
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Location: http://localhost:5000/jobs/eb511c46-6577-11e6-a72a-3c970e7271f5
+
+        {
+          "data": {
+            "message": "Job eb511c46-6577-11e6-a72a-3c970e7271f5 claimed",
+            "job_details": {
+              "attempts": 1,
+              "date_submitted": "2016-08-23T19:02:51.496045+00:00",
+              "id": "eb511c46-6577-11e6-a72a-3c970e7271f5",
+              "parameters": {
+                "value": 1
+              },
+              "result": {},
+              "status": "WORKING"
+            }
+          }
+        }
+
+    :statuscode 200: A job was claimed
+    :statuscode 204: There are no jobs waiting on this service's queue
+    :statuscode 404: The service with this id could not be found
+    """
+    try:
+        service_id = UUID(service_id)
+    except ValueError:
+        response = jsonify({
+            'errors': 'Could not parse service_id=%s as a UUID' % service_id
+        })
+        response.status_code = 404
+        return response
+
+    session = SESSION_FACTORY()
+
+    service = session.query(Service).filter_by(id=service_id).first()
+
+    if not service:
+        response = jsonify({
+            'errors': 'Could not find service with id %s' % str(service_id)
+        })
+        response.status_code = 404
+        return response
+
+    job = Job.claim_next(session, service_id)
+
+    if job is None:
+        session.rollback()
+        return ('', 204)
+
+    job.file_manager = FILE_MANAGER
+
+    try:
+        session.commit()
+    except IntegrityError as error:
+        case_number = uuid1()
+        LOG.error('case_number: %s, message: %s', case_number, error)
+        session.rollback()
+
+        response = jsonify({
+            'errors': {
+                'case_number': case_number,
+                'message': 'Integrity error thrown when attempting commit'
+            }
+        })
+        response.status_code = 400
+        return response
+
+    NOTIFICATIONS.publish(job.id, engine=session.get_bind())
+
+    response = jsonify({
+        'data': {
+            'message': 'Job %s claimed' % str(job.id),
+            'job_details': job.DetailedJobSchema().dump(job).data
+        }
+    })
+    response.headers['Location'] = url_for(
+        'get_job', job_id=job.id, _external=True
+    )
+    response.status_code = 200
+    return response
+
+
+@app.route('/jobs', methods=["GET"])
+def get_jobs():
+    """
+    Returns a page of all jobs, oldest first. This endpoint takes the same
+    query string arguments as ``GET /services/<service_id>/jobs``.
+
+    :statuscode 200: The page of jobs was returned
+    :statuscode 400: An argument in the query string is invalid
+    """
+    session = SESSION_FACTORY()
+
+    return _job_page_response(session.query(Job), 'get_jobs')
+
+
+@app.route('/jobs:batch', methods=["PUT"])
+@check_json
+def put_many_job_details():
+    """
+    Update the status and result of many jobs at once. The request body is
+    a list of updates, each with the ``id`` of the job, and optionally its
+    new ``status``, ``result`` and ``parameters``. Updates to ``WORKING``
+    jobs must give the ``attempt`` that holds the job's lease. All jobs are
+    loaded in one query, each update is validated, each result is checked
+    against the cached result schema of its service, and all valid updates
+    are committed together.
+    Results and parameters are written once the commit has succeeded.
+
+    **Example Request**
+
+    .. sourcecode:: http
+
+        PUT /jobs:batch HTTP/1.1
+        Content-Type: application/json
+
+        [
+          {
+            "id": "eb511c46-6577-11e6-a72a-3c970e7271f5",
+            "attempt": 1,
+            "status": "COMPLETED",
+            "result": {"value": 3}
+          },
+          {
+            "id": "d753ddf0-7053-11e6-b1ce-843a4b768af4",
+            "status": "COMPLETED"
+          }
+        ]
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+
+        {
+          "data": [
+            {
+              "id": "eb511c46-6577-11e6-a72a-3c970e7271f5",
+              "status": "COMPLETED"
+            },
+            {
+              "id": "d753ddf0-7053-11e6-b1ce-843a4b768af4",
+              "errors": "A job with this id was not found"
+            }
+          ],
+          "meta": {"updated": 1, "failed": 1}
+        }
+
+    :statuscode 200: At least one job was updated. Updates that failed have
+        an ``errors`` entry.
+    :statuscode 400: The body is not a list, the list is too long, or none
+        of the jobs could be updated
+    """
+    if not isinstance(request.json, list):
+        response = jsonify({'errors': 'The request body is not a list'})
+        response.status_code = 400
+        return response
+
+    if len(request.json) > config.MAX_JOB_BATCH_SIZE:
+        response = jsonify({
+            'errors': 'Cannot update more than %d jobs at once' % (
+                config.MAX_JOB_BATCH_SIZE)
+        })
+        response.status_code = 400
+        return response
+
+    updates = []
+    for job_update in request.json:
+        if not isinstance(job_update, dict):
+            updates.append((None, {
+                'errors': 'The job %r is not an object' % (job_update,)
+            }))
+            continue
+
+        new_job_data, errors = Job.JobUpdateSchema().load(job_update)
+
+        if not errors:
+            try:
+                updates.append((UUID(new_job_data['id']), new_job_data))
+                continue
+            except ValueError:
+                errors = 'The id %s is not a UUID' % new_job_data['id']
+
+        updates.append((None, {'errors': errors}))
+
+    session = SESSION_FACTORY()
+
+    job_ids = list({job_id for job_id, _ in updates if job_id is not None})
+    jobs = {}
+
+    if job_ids:
+        jobs = {
+            job.id: job for job in session.query(Job).options(
+                joinedload('parent_service')
+            ).filter(Job.id.in_(job_ids))
+        }
+
+    outcomes = []
+    updated_jobs = []
+
+    for job_id, new_job_data in updates:
+        if job_id is None:
+            outcomes.append(new_job_data)
+            continue
+
+        job = jobs.get(job_id)
+
+        if job is None:
+            outcomes.append({
+                'id': str(job_id),
+                'errors': 'A job with this id was not found'
+            })
+            continue
+
+        if not job.holds_lease(new_job_data.get('attempt')):
+            outcomes.append({
+                'id': str(job_id),
+                'errors': 'The job is leased to attempt %d' % job.attempts
+            })
+            continue
+
+        job.file_manager = FILE_MANAGER
+        job.parent_service.file_manager = FILE_MANAGER
+
+        try:
+            job.update(new_job_data, defer_writes=True)
+        except jsonschema.ValidationError as error:
+            outcomes.append({'id': str(job_id), 'errors': error.message})
+            continue
+        except ValueError as error:
+            outcomes.append({'id': str(job_id), 'errors': str(error)})
+            continue
+
+        updated_jobs.append(job)
+        outcomes.append({'id': str(job_id), 'status': job.status})
+
+    if not updated_jobs:
+        session.rollback()
+        response = jsonify({'data': outcomes})
+        response.status_code = 400
+        return response
+
+    changed_keys = {job.id for job in updated_jobs} | {
+        job.service_id for job in updated_jobs
+    }
+
+    # The results are written after the commit, and the jobs are not
+    # reloaded to find their directories
+    session.expire_on_commit = False
+
+    try:
+        session.commit()
+    except IntegrityError as error:
+        case_number = uuid1()
+        LOG.error('case_number: %s, message: %s', case_number, error)
+        session.rollback()
+
+        response = jsonify({
+            'errors': {
+                'case_number': case_number,
+                'message': 'Integrity error thrown when attempting commit'
+            }
+        })
+        response.status_code = 400
+        return response
+
+    for job in updated_jobs:
+        job.write_deferred()
+
+    NOTIFICATIONS.publish_many(changed_keys, engine=session.get_bind())
+
+    response = jsonify({
+        'data': outcomes,
+        'meta': {
+            'updated': len(updated_jobs),
+            'failed': len(outcomes) - len(updated_jobs)
+        }
+    })
+    response.status_code = 200
+    return response
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Returns the details of a job, including its result.
+
+    If the ``wait`` query parameter is given, the request blocks for up to
+    ``wait`` seconds until the status of the job is different from its
+    status when the request was made. Clients waiting on a job to finish
+    should use this instead of polling the job.
+
+    The response has an ``ETag`` that changes whenever the job is updated.
+    If the request's ``If-None-Match`` header matches it, a 304 response is
+    returned without reading the job's parameters or result.
+
+    The result is always sent inline, so results that are stored gzipped
+    are decompressed and parsed to build the response. Clients fetching
+    large results should follow the ``result`` link in ``meta`` instead,
+    which sends stored gzip as it is to clients that accept it.
+
+    :query float wait: The longest time in seconds to wait for the status
+        of the job to change
+    :statuscode 200: The job was returned
+    :statuscode 304: The client's copy of the job is up to date
+    :statuscode 400: The wait time is not a non-negative number
+    :statuscode 404: The job with this id could not be found
+    """
+    try:
+        job_id = UUID(job_id)
+    except ValueError:
+        response = jsonify({
+            'errors': 'Could not parse job_id=%s as a UUID' % job_id
+        })
+        response.status_code = 404
+        return response
+
+    try:
+        wait_time = _get_wait_time()
+    except ValueError as error:
+        response = jsonify({'errors': str(error)})
+        response.status_code = 400
+        return response
+
+    session = SESSION_FACTORY()
+
+    deadline = time.time() + wait_time
+    version = NOTIFICATIONS.version(job_id)
+    job = session.query(Job).filter_by(id=job_id).first()
+
+    if not job:
+        response = jsonify({
+            'errors': 'A job with id %s was not found' % job_id
+        })
+        response.status_code = 404
+        return response
+
+    initial_status = job.status
+    remaining_time = deadline - time.time()
+
+    while job.status == initial_status and remaining_time > 0:
+        session.rollback()
+        NOTIFICATIONS.wait(
+            job_id, version, remaining_time, engine=session.get_bind()
+        )
+        version = NOTIFICATIONS.version(job_id)
+        job = session.query(Job).filter_by(id=job_id).first()
+        remaining_time = deadline - time.time()
+
+    not_modified_response = _not_modified(job.etag)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    job.file_manager = FILE_MANAGER
+
+    response = jsonify({
+        'data': job.DetailedJobSchema().dump(job).data,
+        'meta': {
+            'result': url_for(
+                'get_job_result', job_id=str(job.id), _external=True
+            )
+        }
+    })
+    response.set_etag(job.etag)
+    response.status_code = 200
+    return response
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    Returns the result of a job on its own, as it is stored. Large results
+    are stored gzipped. If the request's ``Accept-Encoding`` header allows
+    gzip, these are sent with ``Content-Encoding: gzip`` straight from the
+    file, without being decompressed or parsed by the server. Otherwise,
+    they are decompressed as they are sent.
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Encoding: gzip
+        Vary: Accept-Encoding
+
+        {"value": 1}
+
+    :statuscode 200: The result was returned
+    :statuscode 304: The client's copy of the result is up to date
+    :statuscode 404: The job with this id could not be found, or has no
+        result
+    """
+    job = _find_job(job_id)
+    if not isinstance(job, Job):
+        return job
+
+    stored_result = job.storage.open_result(job)
+
+    if stored_result is None:
+        response = jsonify({
+            'errors': 'The job with id %s has no result' % job.id
+        })
+        response.status_code = 404
+        return response
+
+    result_file, content_encoding = stored_result
+    send_encoded = content_encoding is not None and \
+        request.accept_encodings[content_encoding] > 0
+
+    etag = '%s-%s' % (job.etag, content_encoding) if send_encoded \
+        else job.etag
+    not_modified_response = _not_modified(etag)
+    if not_modified_response is not None:
+        result_file.close()
+        return not_modified_response
+
+    if content_encoding is None or send_encoded:
+        result_file.seek(0, 2)
+        content_length = result_file.tell()
+        result_file.seek(0)
+        response = Response(
+            wrap_file(request.environ, result_file),
+            mimetype='application/json', direct_passthrough=True
+        )
+        response.content_length = content_length
+        if send_encoded:
+            response.content_encoding = content_encoding
+    else:
+        response = Response(
+            wrap_file(request.environ, gzip.GzipFile(fileobj=result_file)),
+            mimetype='application/json', direct_passthrough=True
+        )
+        response.call_on_close(result_file.close)
+
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/jobs/<job_id>/attachments/<name>', methods=['PUT'])
+def put_job_attachment(job_id, name):
+    """
+    Store the body of the request as a binary attachment of a job, such as
+    an array in NumPy's ``.npy`` format, replacing any attachment with the
+    same name. The body is not parsed, and is streamed to the job's
+    ``attachments`` directory ``ATTACHMENT_CHUNK_SIZE`` bytes at a time.
+    The request must have a ``Content-Length`` header. Attachments of a
+    claimed ``WORKING`` job may only be stored by the worker holding its
+    lease, which gives its ``attempt`` in the query string, since the body
+    is not JSON.
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 201 CREATED
+        Content-Type: application/json
+        Location: http://localhost:5000/jobs/<job_id>/attachments/spectrum.npy
+
+        {
+            "data": {
+                "name": "spectrum.npy",
+                "size": 8000128,
+                "url": "http://localhost:5000/jobs/<job_id>/attachments/spectrum.npy"
+            }
+        }
+
+    :param str job_id: The id of the job
+    :param str name: The name of the attachment
+    :query int attempt: The attempt that holds the job's lease
+    :statuscode 201: The attachment was stored
+    :statuscode 400: The name is not a valid attachment name
+    :statuscode 404: The job with this id could not be found
+    :statuscode 409: The job is ``WORKING``, and its lease is held by
+        another attempt
+    :statuscode 411: The request has no ``Content-Length`` header
+    :statuscode 413: The body is longer than ``ATTACHMENT_MAX_SIZE`` bytes
+    """
+    job = _find_job(job_id)
+    if not isinstance(job, Job):
+        return job
+
+    if not job.holds_lease(request.args.get('attempt', type=int)):
+        return _lease_conflict(job)
+
+    if request.content_length is None:
+        response = jsonify({
+            'errors': 'Attachments must be sent with a Content-Length'
+        })
+        response.status_code = 411
+        return response
+
+    if request.content_length > int(config.ATTACHMENT_MAX_SIZE):
+        response = jsonify({
+            'errors': 'Attachments may be at most %d bytes long' % (
+                int(config.ATTACHMENT_MAX_SIZE)
+            )
+        })
+        response.status_code = 413
+        return response
+
+    try:
+        path = FILE_MANAGER.attachment_path(job, name, create=True)
+    except ValueError as error:
+        response = jsonify({'errors': str(error)})
+        response.status_code = 400
+        return response
+
+    chunk_size = int(config.ATTACHMENT_CHUNK_SIZE)
+    size = FILE_MANAGER.write_stream(
+        iter(lambda: request.stream.read(chunk_size), b''), path
+    )
+
+    url = url_for(
+        '.get_job_attachment', job_id=job.id, name=name, _external=True
+    )
+
+    response = jsonify({'data': {'name': name, 'size': size, 'url': url}})
+    response.status_code = 201
+    response.headers['Location'] = url
+    return response
+
+
+@app.route('/jobs/<job_id>/attachments/<name>', methods=['GET'])
+def get_job_attachment(job_id, name):
+    """
+    Returns an attachment of a job as it was stored. The file is handed to
+    the server's ``wsgi.file_wrapper``, which sends it with ``sendfile``
+    where the server supports it. If ``USE_X_SENDFILE`` is set, the file is
+    left to the web server to send through an ``X-Sendfile`` header. The
+    response has an ``ETag``, and conditional requests are answered with
+    304 responses.
+
+    :param str job_id: The id of the job
+    :param str name: The name of the attachment
+    :statuscode 200: The attachment was returned
+    :statuscode 304: The client's copy of the attachment is up to date
+    :statuscode 404: The job or the attachment could not be found
+    """
+    job = _find_job(job_id)
+    if not isinstance(job, Job):
+        return job
+
+    try:
+        path = FILE_MANAGER.attachment_path(job, name)
+    except ValueError:
+        path = None
+
+    if path is None or not os.path.isfile(path):
+        response = jsonify({
+            'errors': 'The job with id %s has no attachment %s' % (
+                job.id, name
+            )
+        })
+        response.status_code = 404
+        return response
+
+    return send_file(
+        path, conditional=True,
+        mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    )
+
+
+def _find_job(job_id):
+    """
+    :param str job_id: The id of the job in the URL of the request
+    :return: The job with this id, or a 404 response if the id is not a
+        UUID or no job has it
+    :rtype: :class:`topchef.models.Job` | flask.Response
+    """
+    try:
+        job_id = UUID(job_id)
+    except ValueError:
+        response = jsonify({
+            'errors': 'Could not parse job_id=%s as a UUID' % job_id
+        })
+        response.status_code = 404
+        return response
+
+    job = SESSION_FACTORY().query(Job).filter_by(id=job_id).first()
+
+    if not job:
+        response = jsonify({
+            'errors': 'A job with id %s was not found' % job_id
+        })
+        response.status_code = 404
+        return response
+
+    job.file_manager = FILE_MANAGER
+    return job
+
+
+def _lease_conflict(job):
+    """
+    :param job: A ``WORKING`` job that is updated without its lease
+    :return: A 409 response
+    :rtype: flask.Response
+    """
+    response = jsonify({
+        'errors': 'The job with id %s is leased to attempt %d, which must '
+                  'be given as the attempt' % (str(job.id), job.attempts)
+    })
+    response.status_code = 409
+    return response
+
+
+@app.route('/jobs/<job_id>', methods=["PUT"])
 @check_json
 def put_job_details(job_id):
     try:
@@ -570,6 +1729,9 @@ def put_job_details(job_id):
         response.status_code = 400
         return response
 
+    if not job.holds_lease(request.json.get('attempt')):
+        return _lease_conflict(job)
+
     job.update(new_job_data)
     
     session.add(job)
@@ -590,6 +1752,10 @@ def put_job_details(job_id):
         response.status_code = 400
         return response
 
+    NOTIFICATIONS.publish_many(
+        [job.id, job.service_id], engine=session.get_bind()
+    )
+
     response = jsonify({
         'data': {
             'message': 'Job %s updated successfully' % str(job_id),
@@ -604,6 +1770,108 @@ def put_job_details(job_id):
     return response
 
 
+@app.route('/jobs/<job_id>/lease', methods=["PATCH"])
+def renew_job_lease(job_id):
+    """
+    Extend the lease of a ``WORKING`` job. Workers running a job must call
+    this before the lease expires, or the job may be claimed by another
+    worker. The request body gives the ``attempt`` that the worker got
+    when it claimed the job, and may give the length of the new lease in
+    seconds, up to ``MAX_JOB_LEASE_SECONDS``.
+
+    **Example Request**
+
+    .. sourcecode:: http
+
+        PATCH /jobs/eb511c46-6577-11e6-a72a-3c970e7271f5/lease HTTP/1.1
+        Content-Type: application/json
+
+        {
+          "attempt": 1,
+          "seconds": 600
+        }
+
+    **Example Response**
+
+    .. sourcecode:: http
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+
+        {
+          "data": {
+            "message": "Lease of job eb511c46-6577-11e6-a72a-3c970e7271f5 renewed",
+            "lease_expires_at": "2016-08-23T19:12:51.496045"
+          }
+        }
+
+    :statuscode 200: The lease was renewed
+    :statuscode 400: The attempt is missing, or the requested lease length
+        is not valid
+    :statuscode 404: The job with this id could not be found
+    :statuscode 409: The job is not ``WORKING``, its lease has expired, or
+        it is leased to another attempt
+    """
+    try:
+        job_id = UUID(job_id)
+    except ValueError:
+        response = jsonify({
+            'errors': 'Unable to cast job id %s to a UUID' % str(job_id)
+        })
+        response.status_code = 404
+        return response
+
+    lease_request = request.get_json(silent=True) or {}
+    attempt = lease_request.get('attempt')
+    seconds = lease_request.get('seconds', config.JOB_LEASE_SECONDS)
+
+    if not isinstance(attempt, int) or isinstance(attempt, bool):
+        response = jsonify({
+            'errors': 'The attempt that claimed the job must be given'
+        })
+        response.status_code = 400
+        return response
+
+    if not isinstance(seconds, int) or isinstance(seconds, bool) or \
+            not 1 <= seconds <= config.MAX_JOB_LEASE_SECONDS:
+        response = jsonify({
+            'errors': 'The lease must be an integer number of seconds '
+                      'between 1 and %d' % config.MAX_JOB_LEASE_SECONDS
+        })
+        response.status_code = 400
+        return response
+
+    session = SESSION_FACTORY()
+
+    try:
+        lease_expires_at = Job.renew_lease(session, job_id, attempt, seconds)
+    except UnableToFindItemError:
+        session.rollback()
+        response = jsonify({
+            'errors': 'Unable to find job with id %s' % str(job_id)
+        })
+        response.status_code = 404
+        return response
+
+    if lease_expires_at is None:
+        session.rollback()
+        response = jsonify({
+            'errors': 'The job with id %s has no unexpired lease held by '
+                      'attempt %d' % (str(job_id), attempt)
+        })
+        response.status_code = 409
+        return response
+
+    session.commit()
+
+    return jsonify({
+        'data': {
+            'message': 'Lease of job %s renewed' % str(job_id),
+            'lease_expires_at': lease_expires_at.isoformat()
+        }
+    })
+
+
 @app.route('/jobs/<job_id>/next', methods=['GET'])
 def get_next_job(job_id):
     """
@@ -669,6 +1937,9 @@ def update_job_results(service_id, job_id):
 
     new_job_data, errors = Job.DetailedJobSchema().load(request.json)
 
+    if not job.holds_lease(request.json.get('attempt')):
+        return _lease_conflict(job)
+
     job.update(new_job_data)
 
     session.add(job)
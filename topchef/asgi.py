@@ -0,0 +1,445 @@
+"""
+Contains an ASGI entry point for the API, for serving it with an
+asynchronous server such as uvicorn::
+
+    uvicorn topchef.asgi:application
+
+The routes are the ones of :mod:`topchef.api_server`. Each request is
+dispatched to the Flask application in a pool of ``ASGI_WORKER_THREADS``
+threads, so that database queries and schema directory reads never block
+the event loop. Responses are sent as the application produces them, so
+streamed exports stay streamed.
+
+Long-polling requests, which are ``GET`` requests with a ``wait`` query
+parameter on a service's queue or on a job, do not hold a thread while they
+wait. The application is asked for the current state with ``wait=0``, and
+if nothing has happened yet, the request waits on the event loop for the
+service or job to be published to :data:`topchef.notifications.NOTIFICATIONS`.
+This lets one process hold thousands of idle workers.
+
+Request bodies are not buffered. The application reads ``wsgi.input`` from
+its thread, and each read waits for the next chunk of the body from the
+server. Bodies longer than ``ATTACHMENT_MAX_SIZE`` are refused with a 413.
+
+The reaper is started when the server sends the lifespan startup event.
+
+This module needs Python 3.5 or later. The WSGI entry point in
+``apache/topchef.wsgi`` is unchanged.
+"""
+import asyncio
+import io
+import json
+import logging
+import math
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+from uuid import UUID
+from werkzeug.exceptions import RequestEntityTooLarge
+from .api_server import app
+from .config import config
+from .notifications import NOTIFICATIONS
+from .reaper import start_reaper
+
+LOG = logging.getLogger(__name__)
+
+#: Paths that accept a ``wait`` query parameter, and the name of the check
+#: that tells whether a response to them is worth returning
+_LONG_POLL_ROUTES = (
+    (re.compile(r'^/services/(?P<key>[^/]+)/queue$'), 'queue'),
+    (re.compile(r'^/jobs/(?P<key>[^/]+)$'), 'job')
+)
+
+
+class ASGIApplication(object):
+    """
+    Serves a WSGI application over ASGI 3, waiting on long-polling requests
+    asynchronously
+
+    :var wsgi_application: The WSGI application to serve
+    :var ThreadPoolExecutor executor: The threads in which the WSGI
+        application is called
+    """
+    def __init__(self, wsgi_application, threads):
+        """
+        Instantiates the variables listed in the class description
+
+        :param int threads: The number of threads in the pool
+        """
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type %s' % scope['type'])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_reaper()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        environ = _make_environ(scope, _ReceiveStream(
+            receive, asyncio.get_event_loop(),
+            int(config.ATTACHMENT_MAX_SIZE)
+        ))
+
+        long_poll = _long_poll_target(environ)
+        if long_poll is None:
+            await self._stream(environ, send)
+        else:
+            await self._long_poll(environ, send, *long_poll)
+
+    async def _stream(self, environ, send):
+        """
+        Call the WSGI application in the thread pool, and send each chunk of
+        its response as soon as it is produced
+        """
+        loop = asyncio.get_event_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        await loop.run_in_executor(
+            self.executor, _call_application, self.wsgi_application,
+            environ, send_from_thread
+        )
+
+    async def _long_poll(self, environ, send, check, key, wait_time):
+        """
+        Ask the application for the current state of a service's queue or a
+        job until it is worth returning, waiting on the notification bus in
+        between
+        """
+        loop = asyncio.get_event_loop()
+        deadline = time.time() + wait_time
+        poll_environ = _without_wait(environ)
+        initial_state = None
+
+        while True:
+            version = NOTIFICATIONS.version(key)
+            status, headers, body = await loop.run_in_executor(
+                self.executor, _call_buffered, self.wsgi_application,
+                dict(poll_environ)
+            )
+
+            if not status.startswith('200'):
+                break
+
+            state = _STATE_CHECKS[check](body)
+            if initial_state is None:
+                initial_state = state
+
+            remaining_time = deadline - time.time()
+            if _is_ready(check, state, initial_state) or remaining_time <= 0:
+                break
+
+            await wait_for_publish(key, version, remaining_time)
+
+        if 'HTTP_IF_NONE_MATCH' in environ and status.startswith('200'):
+            status, headers, body = await loop.run_in_executor(
+                self.executor, _call_buffered, self.wsgi_application,
+                _without_wait(environ, keep_conditions=True)
+            )
+
+        await _send_buffered(send, status, headers, body)
+
+
+async def wait_for_publish(key, version, timeout):
+    """
+    Wait on the event loop until a key is published past the given version,
+    without blocking a thread
+
+    :param key: The id of the service or job to wait on
+    :param int version: The version of the key that the caller has seen
+    :param float timeout: The maximum number of seconds to wait
+    :return: ``True`` if the key was published, otherwise ``False``
+    :rtype: bool
+    """
+    loop = asyncio.get_event_loop()
+    published = loop.create_future()
+
+    def wake_up():
+        loop.call_soon_threadsafe(_resolve, published)
+
+    NOTIFICATIONS.subscribe(key, wake_up, engine=config.database_engine)
+    try:
+        if NOTIFICATIONS.version(key) != version:
+            return True
+        await asyncio.wait_for(published, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        NOTIFICATIONS.unsubscribe(key, wake_up)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _ReceiveStream(object):
+    """
+    A ``wsgi.input`` that reads the body of an ASGI request as the
+    application asks for it. It is read from a worker thread, and waits for
+    each message from the server on the event loop.
+
+    :var int limit: The number of bytes after which the body is refused
+    """
+    def __init__(self, receive, loop, limit):
+        self.receive = receive
+        self.loop = loop
+        self.limit = limit
+        self._buffer = b''
+        self._bytes_received = 0
+        self._more_body = True
+
+    def _receive_chunk(self):
+        message = asyncio.run_coroutine_threadsafe(
+            self.receive(), self.loop
+        ).result()
+
+        if message['type'] != 'http.request':
+            self._more_body = False
+            return
+
+        chunk = message.get('body', b'')
+        self._more_body = message.get('more_body', False)
+        self._bytes_received += len(chunk)
+
+        if self._bytes_received > self.limit:
+            self._more_body = False
+            raise RequestEntityTooLarge()
+
+        self._buffer += chunk
+
+    def read(self, size=-1):
+        while self._more_body and (size < 0 or len(self._buffer) < size):
+            self._receive_chunk()
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while self._more_body and b'\n' not in self._buffer and (
+                size < 0 or len(self._buffer) < size):
+            self._receive_chunk()
+
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+        return line
+
+
+def _make_environ(scope, input_stream):
+    """
+    :param input_stream: The ``wsgi.input`` of the request
+    :return: The WSGI environment for an ASGI HTTP request. Bodies without
+        a ``Content-Length`` are read until the server says they are over.
+    :rtype: dict
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': input_stream,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = 'HTTP_%s' % name
+            if key in environ:
+                value = '%s,%s' % (environ[key], value)
+            environ[key] = value
+
+    if 'CONTENT_LENGTH' not in environ:
+        environ['wsgi.input_terminated'] = True
+
+    return environ
+
+
+def _long_poll_target(environ):
+    """
+    :return: The name of the readiness check, the notification key and the
+        wait time of a long-polling request, or ``None`` if the request does
+        not wait. Requests with an invalid wait time or id are left to the
+        application, which rejects them.
+    :rtype: tuple | None
+    """
+    if environ['REQUEST_METHOD'] != 'GET':
+        return None
+
+    arguments = dict(parse_qsl(environ['QUERY_STRING']))
+    try:
+        wait_time = float(arguments.get('wait', 0))
+    except ValueError:
+        return None
+
+    if math.isnan(wait_time) or math.isinf(wait_time) or wait_time <= 0:
+        return None
+
+    for pattern, check in _LONG_POLL_ROUTES:
+        match = pattern.match(environ['PATH_INFO'])
+        if match is not None:
+            try:
+                key = str(UUID(match.group('key')))
+            except ValueError:
+                return None
+            return check, key, min(
+                wait_time, float(config.LONG_POLL_MAX_WAIT)
+            )
+
+    return None
+
+
+def _without_wait(environ, keep_conditions=False):
+    """
+    :return: A copy of the environment with ``wait=0`` in the query string,
+        and without conditional headers unless asked to keep them
+    :rtype: dict
+    """
+    arguments = [
+        (name, value) for name, value in parse_qsl(environ['QUERY_STRING'])
+        if name != 'wait'
+    ]
+
+    poll_environ = dict(environ)
+    poll_environ['QUERY_STRING'] = urlencode(arguments + [('wait', '0')])
+    poll_environ['wsgi.input'] = io.BytesIO(b'')
+
+    if not keep_conditions:
+        poll_environ.pop('HTTP_IF_NONE_MATCH', None)
+
+    return poll_environ
+
+
+def _queue_state(body):
+    return bool(json.loads(body.decode('utf-8'))['data'])
+
+
+def _job_state(body):
+    return json.loads(body.decode('utf-8'))['data']['status']
+
+
+_STATE_CHECKS = {'queue': _queue_state, 'job': _job_state}
+
+
+def _is_ready(check, state, initial_state):
+    if check == 'queue':
+        return state
+    return state != initial_state
+
+
+def _call_application(wsgi_application, environ, send_message):
+    """
+    Call a WSGI application, and pass its response to ``send_message`` as
+    ASGI messages. This runs in a worker thread.
+    """
+    response_start = {'type': 'http.response.start'}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]
+
+    result = wsgi_application(environ, start_response)
+    started = False
+
+    try:
+        for chunk in result:
+            if not chunk:
+                continue
+            if not started:
+                send_message(response_start)
+                started = True
+            send_message({
+                'type': 'http.response.body', 'body': chunk,
+                'more_body': True
+            })
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    if not started:
+        send_message(response_start)
+    send_message({'type': 'http.response.body', 'body': b''})
+
+
+def _call_buffered(wsgi_application, environ):
+    """
+    Call a WSGI application and read its whole response. This runs in a
+    worker thread, and is only used for the small JSON responses of
+    long-polling requests.
+
+    :return: The status line, headers and body of the response
+    :rtype: tuple
+    """
+    response_start = []
+
+    def start_response(status, headers, exc_info=None):
+        response_start[:] = [status, headers]
+
+    result = wsgi_application(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    status, headers = response_start
+    return status, headers, body
+
+
+async def _send_buffered(send, status, headers, body):
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+application = ASGIApplication(app, config.ASGI_WORKER_THREADS)
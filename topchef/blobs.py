@@ -0,0 +1,152 @@
+"""
+Contains a content-addressed store for the JSON documents kept in the schema
+directory.
+
+Each distinct document is stored once, under the SHA-256 hash of its text.
+Job parameter files and service schema files are hard links to the stored
+document, so identical documents share one inode and one copy on disk. As
+linked files share an inode, :class:`topchef.schema_cache.SchemaCache` also
+shares one compiled validator between services with identical schemas.
+"""
+import os
+import json
+import errno
+import hashlib
+import logging
+import uuid
+
+LOG = logging.getLogger(__name__)
+
+
+class BlobStore(object):
+    """
+    Stores documents in ``<root_path>/<ab>/<digest>.json``, where ``ab`` are
+    the first two hex digits of the digest.
+
+    Stored documents are never changed. A path linked to a document is
+    changed by renaming a new file over it, which leaves the document and
+    its other links as they were.
+
+    :var str root_path: The directory holding the documents
+    """
+    def __init__(self, root_path, write):
+        """
+        Instantiates the variables listed in the class description
+
+        :param callable write: A function taking the text of a file and its
+            path, and writing the file atomically
+        """
+        self.root_path = root_path
+        self._write = write
+
+    @staticmethod
+    def digest(data):
+        """
+        :param str data: The text of a document
+        :return: The SHA-256 hex digest of the text encoded as UTF-8
+        :rtype: str
+        """
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def path(self, digest):
+        """
+        :param str digest: The digest of a document
+        :return: The path at which the document is stored
+        :rtype: str
+        """
+        return os.path.join(self.root_path, digest[:2], '%s.json' % digest)
+
+    def put(self, data):
+        """
+        Store a document, unless it is already stored
+
+        :param str data: The text of the document
+        :return: The digest of the document
+        :rtype: str
+        """
+        digest = self.digest(data)
+        blob_path = self.path(digest)
+
+        if not os.path.exists(blob_path):
+            _make_directories(os.path.dirname(blob_path))
+            self._write(data, blob_path)
+
+        return digest
+
+    def link(self, data, target_path):
+        """
+        Store a document, and atomically replace the file at the target path
+        with a hard link to it
+
+        :param str data: The text of the document
+        :param str target_path: The path of the file to replace
+        :raises: OSError if the file system does not support hard links
+            between the store and the target
+        """
+        temporary_path = os.path.join(
+            os.path.dirname(target_path),
+            '.%s.%s.tmp' % (os.path.basename(target_path), uuid.uuid4().hex)
+        )
+
+        for _ in range(2):
+            blob_path = self.path(self.put(data))
+            try:
+                os.link(blob_path, temporary_path)
+                break
+            except OSError as error:
+                # The document may have been collected after it was put
+                if error.errno != errno.ENOENT or \
+                        not os.path.isdir(os.path.dirname(temporary_path)):
+                    raise
+        else:
+            raise OSError(errno.ENOENT, 'Unable to link document', blob_path)
+
+        try:
+            os.rename(temporary_path, target_path)
+        except OSError:
+            os.remove(temporary_path)
+            raise
+
+    def collect_garbage(self):
+        """
+        Remove the documents that are no longer linked from anywhere else
+
+        :return: The number of documents that were removed
+        :rtype: int
+        """
+        if not os.path.isdir(self.root_path):
+            return 0
+
+        blobs_removed = 0
+
+        for shard in os.listdir(self.root_path):
+            shard_path = os.path.join(self.root_path, shard)
+            for blob_name in os.listdir(shard_path):
+                blob_path = os.path.join(shard_path, blob_name)
+                if os.stat(blob_path).st_nlink == 1:
+                    os.remove(blob_path)
+                    blobs_removed += 1
+
+        LOG.info('Removed %d unused documents', blobs_removed)
+        return blobs_removed
+
+    def __repr__(self):
+        return '%s(root_path=%s)' % (self.__class__.__name__, self.root_path)
+
+
+def canonical_json(data):
+    """
+    :param data: A JSON-serializable value
+    :return: The value as compact JSON with sorted keys, so that equal
+        values always have the same text, and so the same digest
+    :rtype: str
+    """
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def _make_directories(path):
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
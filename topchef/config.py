@@ -4,7 +4,8 @@ Contains user-serviceable configuration parameters
 import os
 import logging
 from collections import namedtuple, Iterable
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
 
 LOG = logging.getLogger(__name__)
 
@@ -23,15 +24,107 @@ class Config(Iterable):
     THREADS = 3
     DEBUG = True
 
+    # The number of processes run by ``python -m topchef serve``. If 0, this
+    # is twice the number of cores, plus one. Workers restarted with SIGHUP
+    # get this many seconds to finish their requests
+    WORKERS = 0
+    GRACEFUL_TIMEOUT = 30
+
+    # The longest time in seconds that a request with ``?wait=`` may block
+    LONG_POLL_MAX_WAIT = 30
+
+    # The number of threads in which the ASGI entry point runs requests.
+    # Long-polling requests do not hold a thread while they wait
+    ASGI_WORKER_THREADS = 20
+
+    # The default and largest number of jobs on a page of a list of jobs
+    JOB_PAGE_SIZE = 100
+    MAX_JOB_PAGE_SIZE = 1000
+
+    # The largest number of jobs that may be submitted or updated at once
+    MAX_JOB_BATCH_SIZE = 10000
+
+    # The number of jobs read from the database at a time when exporting
+    # all the jobs of a service
+    JOB_EXPORT_BATCH_SIZE = 1000
+
+    # The time in seconds for which clients may cache the schemas in
+    # ``/schemas``
+    SCHEMA_DOCUMENT_MAX_AGE = 86400
+
+    # Seconds between writes of buffered heartbeats to the database. If 0,
+    # every heartbeat is written when it is received
+    HEARTBEAT_FLUSH_INTERVAL = 5
+
+    # Seconds between scans for timed-out services and jobs whose lease has
+    # expired. If 0, the reaper is not started
+    REAPER_INTERVAL = 10
+
+    # The time in seconds for which a claimed job belongs to its worker, and
+    # what happens to the job if the lease runs out. Either 'requeue' or
+    # 'fail'
+    JOB_LEASE_SECONDS = 300
+    JOB_LEASE_EXPIRED_ACTION = 'requeue'
+
+    # The longest lease that a worker may ask for when renewing one, and the
+    # number of times a job is claimed before it is failed instead of
+    # being requeued
+    MAX_JOB_LEASE_SECONDS = 3600
+    JOB_MAX_ATTEMPTS = 3
+
     #DIRECTORY
     BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
     SCHEMA_DIRECTORY = os.path.join(BASE_DIRECTORY, 'schemas')
 
+    # How job directories are laid out in the schema directory. Either
+    # 'flat', 'sharded', or 'migrating' while moving from flat to sharded
+    SCHEMA_DIRECTORY_LAYOUT = 'flat'
+
+    # When files written to the schema directory are synced to disk. Either
+    # 'always', 'batch' to sync every SCHEMA_FSYNC_INTERVAL seconds, or
+    # 'never'
+    SCHEMA_FSYNC_POLICY = 'batch'
+    SCHEMA_FSYNC_INTERVAL = 1
+
+    # If True, identical job parameters and service schemas are stored once,
+    # in the .blobs directory of the schema directory, and hard-linked into
+    # each job and service directory
+    DEDUPLICATE_DOCUMENTS = False
+
+    # Job results longer than this many bytes of JSON are stored gzipped in
+    # the schema directory. 0 stores every result uncompressed
+    RESULT_COMPRESSION_THRESHOLD = 64 * 1024
+    RESULT_COMPRESSION_LEVEL = 6
+
+    # Job attachments are streamed to disk this many bytes at a time, and
+    # may be at most ATTACHMENT_MAX_SIZE bytes long
+    ATTACHMENT_CHUNK_SIZE = 64 * 1024
+    ATTACHMENT_MAX_SIZE = 1024 * 1024 * 1024
+
+    # If True, attachments are sent by the web server through an X-Sendfile
+    # header, as with Apache's mod_xsendfile, instead of by the application
+    USE_X_SENDFILE = False
+
     LOGFILE = '/var/tmp/topchef.log'
 
+    # The number of parsed service schemas kept in memory
+    SCHEMA_CACHE_SIZE = 1024
+
     # DATABASE
     DATABASE_URI = 'sqlite:///%s/db.sqlite3' % BASE_DIRECTORY
 
+    # Where job parameters and results are kept. Either 'filesystem' or
+    # 'database'
+    JOB_STORAGE = 'filesystem'
+
+    # Connection pool settings. These are not used with SQLite, which
+    # always gets WAL journaling and a busy timeout in milliseconds instead
+    DATABASE_POOL_SIZE = 10
+    DATABASE_MAX_OVERFLOW = 20
+    DATABASE_POOL_RECYCLE = 3600
+    DATABASE_POOL_PRE_PING = True
+    SQLITE_BUSY_TIMEOUT = 5000
+
     def __init__(self, environment=os.environ):
 
         Parameter = namedtuple('Parameter', ['key', 'from_env', 'from_file'])
@@ -62,7 +155,7 @@ class Config(Iterable):
         for parameter in new_parameters:
             self.__dict__[parameter.key] = parameter.value
 
-        self._engine = create_engine(self.DATABASE_URI)
+        self._engine = self._create_engine()
 
         if self.LOGFILE:
             hdlr = logging.FileHandler(self.LOGFILE)
@@ -84,7 +177,9 @@ class Config(Iterable):
             )
             value_from_environment = value_from_config
 
-        if parameter.upper() == 'DEBUG' \
+        value_from_config = self.__class__.__dict__[parameter]
+
+        if isinstance(value_from_config, bool) \
             and isinstance(value_from_environment, str):
             if value_from_environment.upper() == "TRUE":
                 return True
@@ -94,8 +189,46 @@ class Config(Iterable):
         if parameter.upper() == "PORT":
             return int(value_from_environment)
 
+        if isinstance(value_from_environment, str) \
+            and isinstance(value_from_config, (int, float)) \
+                and not isinstance(value_from_config, bool):
+            return type(value_from_config)(value_from_environment)
+
         return value_from_environment
 
+    def _create_engine(self):
+        """
+        :return: An engine for ``DATABASE_URI``. SQLite databases get a busy
+            timeout, and on-disk SQLite databases are switched to WAL
+            journaling so that readers do not wait on writers. Other
+            databases get a connection pool configured by the
+            ``DATABASE_POOL_*`` parameters.
+        """
+        url = make_url(self.DATABASE_URI)
+
+        if url.get_backend_name() != 'sqlite':
+            return create_engine(
+                url,
+                pool_size=self.DATABASE_POOL_SIZE,
+                max_overflow=self.DATABASE_MAX_OVERFLOW,
+                pool_recycle=self.DATABASE_POOL_RECYCLE,
+                pool_pre_ping=self.DATABASE_POOL_PRE_PING
+            )
+
+        engine = create_engine(url)
+        use_wal = url.database not in (None, '', ':memory:')
+        busy_timeout = int(self.SQLITE_BUSY_TIMEOUT)
+
+        @event.listens_for(engine, 'connect')
+        def configure_sqlite_connection(dbapi_connection, _):
+            cursor = dbapi_connection.cursor()
+            if use_wal:
+                cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA busy_timeout=%d' % busy_timeout)
+            cursor.close()
+
+        return engine
+
     def __iter__(self):
         for attribute in self.__class__.__dict__:
             if attribute == attribute.upper():
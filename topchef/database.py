@@ -1,8 +1,9 @@
 from sqlalchemy import String, ForeignKey, DateTime
 from sqlalchemy import MetaData, Table, Column, Integer, Boolean
-from sqlalchemy import Enum
-from sqlalchemy.types import TypeDecorator, CHAR
-from sqlalchemy.dialects.postgres import UUID
+from sqlalchemy import Enum, Index
+from sqlalchemy.types import TypeDecorator, CHAR, Text
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+import json
 import uuid
 from datetime import datetime
 
@@ -38,6 +39,35 @@ class GUID(TypeDecorator):
     def copy(self, *args, **kwargs):
         return GUID(*args, **kwargs)
 
+
+class JSONDocument(TypeDecorator):
+    """
+    A JSON document. This is stored as ``JSONB`` on PostgreSQL, and as
+    serialized text on other databases.
+    """
+    impl = Text
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONB())
+        else:
+            return dialect.type_descriptor(Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        else:
+            return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        else:
+            return json.loads(value)
+
+    def copy(self, *args, **kwargs):
+        return JSONDocument(*args, **kwargs)
+
 services = Table(
     'services', METADATA,
     Column('service_id', GUID, primary_key=True, nullable=False),
@@ -48,7 +78,8 @@ services = Table(
     Column('last_checked_in', DateTime, nullable=False,
            default=datetime.utcnow()),
     Column('heartbeat_timeout_seconds', Integer, nullable=False, default=30),
-    Column('is_service_available', Boolean, nullable=False)
+    Column('is_service_available', Boolean, nullable=False),
+    Column('version', Integer, nullable=False, default=1, server_default='1')
 )
 
 jobs = Table(
@@ -59,7 +90,32 @@ jobs = Table(
            ),
     Column('date_submitted', DateTime, nullable=False,
            default=datetime.utcnow()),
-    Column('status', Enum("REGISTERED", "WORKING", "COMPLETED"), 
-        default="REGISTERED")
+    Column('status', Enum("REGISTERED", "WORKING", "COMPLETED", "FAILED",
+                          name='job_status'),
+        default="REGISTERED"),
+    Column('lease_expires_at', DateTime, nullable=True),
+    Column('attempts', Integer, nullable=False, default=0,
+           server_default='0'),
+    Column('priority', Integer, nullable=False, default=0,
+           server_default='0'),
+    Column('parameters', JSONDocument, nullable=True),
+    Column('result', JSONDocument, nullable=True),
+    Column('version', Integer, nullable=False, default=1, server_default='1')
 )
 
+Index('ix_jobs_date_submitted', jobs.c.date_submitted, jobs.c.job_id)
+Index(
+    'ix_jobs_service_date',
+    jobs.c.service_id, jobs.c.date_submitted, jobs.c.job_id
+)
+Index(
+    'ix_jobs_service_status_priority',
+    jobs.c.service_id, jobs.c.status, jobs.c.priority.desc(),
+    jobs.c.date_submitted
+)
+Index('ix_jobs_status_lease', jobs.c.status, jobs.c.lease_expires_at)
+Index(
+    'ix_services_available_timeout',
+    services.c.is_service_available, services.c.heartbeat_timeout_seconds,
+    services.c.last_checked_in
+)
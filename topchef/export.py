@@ -0,0 +1,212 @@
+"""
+Contains generators that serialize every job of a service for bulk export.
+
+Jobs are read from the database in batches of ``JOB_EXPORT_BATCH_SIZE`` with
+``Query.yield_per``, which uses a server-side cursor where the database
+supports one. Rows are serialized as they arrive, so the memory used by an
+export does not grow with the number of jobs.
+
+The ``npz`` format needs NumPy, which is an optional dependency.
+"""
+import os
+import json
+import numbers
+import shutil
+import tempfile
+import zipfile
+from .config import config
+from .models import Job
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#: The content types of the export formats, keyed by the value of the
+#: ``format`` query parameter
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'npz': 'application/octet-stream'
+}
+
+#: The JSON schema types that are exported as columns in ``npz`` exports
+NUMERIC_TYPES = frozenset(['integer', 'number', 'boolean'])
+
+
+def export_query(session, service_id, status=None):
+    """
+    :param Session session: The session from which jobs are read
+    :param UUID service_id: The id of the service whose jobs are exported
+    :param str status: If given, only export jobs with this status
+    :return: A query for all the jobs of the service, oldest first, that is
+        fetched in batches
+    :rtype: Query
+    """
+    query = session.query(Job).filter(Job.service_id == service_id)
+
+    if status is not None:
+        query = query.filter(Job.status == status)
+
+    return query.order_by(
+        Job.date_submitted, Job.id
+    ).yield_per(config.JOB_EXPORT_BATCH_SIZE)
+
+
+def ndjson_rows(jobs, file_manager):
+    """
+    Serialize jobs as newline-delimited JSON, one job per line
+
+    :param jobs: The jobs to serialize
+    :param SchemaDirectoryOrganizer file_manager: The manager of the schema
+        directory, from which jobs stored on the file system are read
+    :return: A generator of lines, each holding the id, submission date,
+        status, priority, parameters and result of a job
+    """
+    schema = Job.DetailedJobSchema()
+
+    for job in jobs:
+        job.file_manager = file_manager
+        yield json.dumps(schema.dump(job).data, sort_keys=True) + '\n'
+
+
+def numeric_columns(service):
+    """
+    :param service: The service whose jobs are exported
+    :type service: :class:`topchef.models.Service`
+    :return: The ``(document, property)`` pairs of the top-level numeric
+        and boolean properties in the service's job registration and job
+        result schemas, where ``document`` is ``parameters`` or ``result``
+    :rtype: list
+    """
+    columns = []
+
+    for document, schema in (
+            ('parameters', service.job_registration_schema),
+            ('result', service.job_result_schema)
+    ):
+        for name, property_schema in sorted(
+                schema.get('properties', {}).items()
+        ):
+            if property_schema.get('type') in NUMERIC_TYPES:
+                columns.append((document, name))
+
+    return columns
+
+
+def write_npz(jobs, columns, file_manager, output):
+    """
+    Write jobs to a NumPy ``.npz`` archive with one array per column.
+
+    The archive holds an ``id`` array of job ids as 32-character hex
+    strings, a ``date_submitted`` array of ``datetime64[us]``, and one
+    ``float64`` array named ``<document>.<property>`` for each column.
+    Booleans are stored as 0 and 1, and missing or non-numeric values as
+    NaN. Members are stored uncompressed, so an extracted ``.npy`` file can
+    be memory-mapped with ``numpy.load(path, mmap_mode='r')``.
+
+    Jobs are converted in chunks of ``JOB_EXPORT_BATCH_SIZE``, and each
+    chunk is appended to a temporary file per column before the archive is
+    assembled, so the whole export is never held in memory.
+
+    :param jobs: The jobs to export
+    :param list columns: The columns to export, as returned by
+        :func:`numeric_columns`
+    :param SchemaDirectoryOrganizer file_manager: The manager of the schema
+        directory, from which jobs stored on the file system are read
+    :param output: A seekable binary file to which the archive is written
+    :return: The number of jobs that were exported
+    :rtype: int
+    :raises: RuntimeError if NumPy is not installed
+    """
+    if numpy is None:
+        raise RuntimeError('Exporting jobs to npz requires NumPy')
+
+    dtypes = [('id', numpy.dtype('S32')),
+              ('date_submitted', numpy.dtype('datetime64[us]'))]
+    dtypes.extend(
+        ('%s.%s' % column, numpy.dtype('float64')) for column in columns
+    )
+
+    working_directory = tempfile.mkdtemp()
+
+    try:
+        raw_files = [
+            open(os.path.join(working_directory, '%d.raw' % index), 'wb')
+            for index in range(len(dtypes))
+        ]
+
+        try:
+            row_count = 0
+            for chunk in _chunks(jobs, config.JOB_EXPORT_BATCH_SIZE):
+                for raw_file, values, (_, dtype) in zip(
+                        raw_files, _chunk_columns(chunk, columns,
+                                                  file_manager),
+                        dtypes
+                ):
+                    numpy.array(values, dtype=dtype).tofile(raw_file)
+                row_count += len(chunk)
+        finally:
+            for raw_file in raw_files:
+                raw_file.close()
+
+        with zipfile.ZipFile(output, mode='w',
+                             compression=zipfile.ZIP_STORED,
+                             allowZip64=True) as archive:
+            for index, (name, dtype) in enumerate(dtypes):
+                array_path = os.path.join(working_directory, '%d.npy' % index)
+                _write_npy(
+                    array_path,
+                    os.path.join(working_directory, '%d.raw' % index),
+                    dtype, row_count
+                )
+                archive.write(array_path, '%s.npy' % name)
+                os.remove(array_path)
+    finally:
+        shutil.rmtree(working_directory, ignore_errors=True)
+
+    return row_count
+
+
+def _chunks(jobs, chunk_size):
+    chunk = []
+    for job in jobs:
+        chunk.append(job)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _chunk_columns(chunk, columns, file_manager):
+    ids = []
+    dates = []
+    values = [[] for _ in columns]
+
+    for job in chunk:
+        job.file_manager = file_manager
+        documents = {'parameters': job.parameters, 'result': job.result or {}}
+
+        ids.append(job.id.hex.encode('ascii'))
+        dates.append(job.date_submitted)
+        for column_values, (document, name) in zip(values, columns):
+            column_values.append(_to_float(documents[document].get(name)))
+
+    return [ids, dates] + values
+
+
+def _to_float(value):
+    if isinstance(value, numbers.Number):
+        return float(value)
+    return float('nan')
+
+
+def _write_npy(path, raw_path, dtype, row_count):
+    with open(path, 'wb') as array_file:
+        numpy.lib.format.write_array_header_1_0(array_file, {
+            'descr': numpy.lib.format.dtype_to_descr(dtype),
+            'fortran_order': False,
+            'shape': (row_count,)
+        })
+        with open(raw_path, 'rb') as raw_file:
+            shutil.copyfileobj(raw_file, array_file)
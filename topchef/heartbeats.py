@@ -0,0 +1,123 @@
+"""
+Contains a buffer that coalesces service heartbeats in memory, so that a
+service checking in every few seconds does not cost a database write each
+time
+"""
+import atexit
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import bindparam
+from .database import services
+from .scheduler import PeriodicTask
+
+LOG = logging.getLogger(__name__)
+
+
+class HeartbeatBuffer(object):
+    """
+    Records the time at which each service last checked in. Pending
+    heartbeats are written to ``services.last_checked_in`` by
+    :meth:`flush`, in one batched ``UPDATE`` that also marks the services as
+    available again. This is done every
+    ``HEARTBEAT_FLUSH_INTERVAL`` seconds by a background task, and once
+    more when the process exits.
+
+    Until then, :meth:`last_checked_in` gives the newer time to readers in
+    this process.
+    """
+    def __init__(self):
+        """
+        Instantiates an empty buffer
+        """
+        self._pending = {}
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def record(self, service_id, date=None):
+        """
+        Record that a service has checked in
+
+        :param UUID service_id: The id of the service
+        :param datetime date: The time at which the service checked in. By
+            default, this is now.
+        """
+        if date is None:
+            date = datetime.utcnow()
+
+        with self._lock:
+            self._pending[service_id] = date
+            self._latest[service_id] = date
+
+    def last_checked_in(self, service_id):
+        """
+        :param UUID service_id: The id of the service
+        :return: The last time that the service checked in with this
+            process, or ``None`` if it has not
+        :rtype: datetime | None
+        """
+        with self._lock:
+            return self._latest.get(service_id)
+
+    def flush(self, engine):
+        """
+        Write all pending heartbeats to the database in one transaction
+
+        :param engine: The engine connected to the database to write to
+        :return: The number of services whose heartbeat was written
+        :rtype: int
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        statement = services.update().where(
+            services.c.service_id == bindparam('flushed_service_id')
+        ).values(
+            last_checked_in=bindparam('flushed_last_checked_in'),
+            is_service_available=True,
+            version=services.c.version + 1
+        )
+
+        try:
+            with engine.begin() as connection:
+                connection.execute(statement, [
+                    {
+                        'flushed_service_id': service_id,
+                        'flushed_last_checked_in': date
+                    } for service_id, date in pending.items()
+                ])
+        except Exception:
+            with self._lock:
+                for service_id, date in pending.items():
+                    self._pending.setdefault(service_id, date)
+            raise
+
+        return len(pending)
+
+    def start_flusher(self, get_engine, interval):
+        """
+        Start flushing heartbeats in the background, if this is not already
+        being done, and flush them once more when the process exits
+
+        :param callable get_engine: A function returning the engine to
+            which heartbeats are written
+        :param float interval: The number of seconds between flushes
+        """
+        with self._lock:
+            if self._flusher is not None:
+                return
+
+            self._flusher = PeriodicTask(
+                'topchef-heartbeat-flusher', interval,
+                lambda: self.flush(get_engine())
+            )
+
+        self._flusher.start()
+        atexit.register(self._flusher.run_once)
+
+
+HEARTBEATS = HeartbeatBuffer()
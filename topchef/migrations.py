@@ -0,0 +1,174 @@
+"""
+Contains functions that bring an existing database up to date with the
+tables declared in :mod:`topchef.database`
+"""
+import logging
+from sqlalchemy import Enum, inspect, text
+from .database import METADATA
+
+LOG = logging.getLogger(__name__)
+
+#: Indexes that earlier versions created, and that are dropped on upgrade,
+#: keyed by the name of their table
+RETIRED_INDEXES = {
+    # Covered by ix_jobs_service_status_priority
+    'jobs': ('ix_jobs_service_status_date',)
+}
+
+
+def upgrade(engine, metadata=METADATA):
+    """
+    Create missing tables, and add the columns and indexes that are declared
+    in the metadata but are missing from existing tables. Indexes listed in
+    :data:`RETIRED_INDEXES` are dropped. This is safe to run more than once.
+
+    New columns are added with ``ALTER TABLE ... ADD COLUMN``. Columns that
+    are not nullable must have a ``server_default``, so that rows that
+    already exist get a value.
+
+    Values that were added to an ``Enum`` column are added to the type on
+    PostgreSQL, with ``ALTER TYPE ... ADD VALUE``. SQLite checks enums with
+    a ``CHECK`` constraint, which cannot be altered, so tables whose
+    constraint is missing values are rebuilt and their rows copied over.
+
+    :param engine: The engine connected to the database to upgrade
+    :param MetaData metadata: The tables that the database should have
+    """
+    metadata.create_all(bind=engine)
+
+    _upgrade_enums(engine, metadata)
+
+    inspector = inspect(engine)
+
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            existing_columns = {
+                column['name'] for column in inspector.get_columns(table.name)
+            }
+
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    _add_column(connection, table, column)
+
+            existing_indexes = {
+                index['name'] for index in inspector.get_indexes(table.name)
+            }
+
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    LOG.info('Creating index %s', index.name)
+                    index.create(bind=connection)
+
+            for index_name in RETIRED_INDEXES.get(table.name, ()):
+                if index_name in existing_indexes:
+                    LOG.info('Dropping index %s', index_name)
+                    connection.execute('DROP INDEX %s' % (
+                        connection.dialect.identifier_preparer.quote(
+                            index_name
+                        )
+                    ))
+
+
+def _add_column(connection, table, column):
+    dialect = connection.dialect
+    column_specification = dialect.ddl_compiler(
+        dialect, None
+    ).get_column_specification(column)
+
+    LOG.info('Adding column %s.%s', table.name, column.name)
+    connection.execute('ALTER TABLE %s ADD COLUMN %s' % (
+        dialect.identifier_preparer.format_table(table), column_specification
+    ))
+
+
+def _upgrade_enums(engine, metadata):
+    if engine.dialect.name == 'postgresql':
+        _add_enum_values(engine, metadata)
+    elif engine.dialect.name == 'sqlite':
+        _rebuild_tables_with_old_enums(engine, metadata)
+
+
+def _enum_columns(table):
+    return [
+        column for column in table.columns
+        if isinstance(column.type, Enum)
+    ]
+
+
+def _add_enum_values(engine, metadata):
+    # ALTER TYPE ... ADD VALUE cannot run inside a transaction block
+    connection = engine.connect().execution_options(
+        isolation_level='AUTOCOMMIT'
+    )
+    try:
+        for table in metadata.sorted_tables:
+            for column in _enum_columns(table):
+                type_name = connection.execute(text(
+                    'SELECT udt_name FROM information_schema.columns '
+                    'WHERE table_name = :table AND column_name = :column'
+                ), table=table.name, column=column.name).scalar()
+
+                existing_values = {row[0] for row in connection.execute(text(
+                    'SELECT enumlabel FROM pg_enum JOIN pg_type '
+                    'ON pg_enum.enumtypid = pg_type.oid '
+                    'WHERE pg_type.typname = :type_name'
+                ), type_name=type_name)}
+
+                for value in column.type.enums:
+                    if value not in existing_values:
+                        LOG.info('Adding %s to type %s', value, type_name)
+                        connection.execute("ALTER TYPE %s ADD VALUE '%s'" % (
+                            connection.dialect.identifier_preparer.quote(
+                                type_name
+                            ), value
+                        ))
+    finally:
+        connection.close()
+
+
+def _rebuild_tables_with_old_enums(engine, metadata):
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            table_sql = connection.execute(text(
+                "SELECT sql FROM sqlite_master "
+                "WHERE type = 'table' AND name = :table"
+            ), table=table.name).scalar()
+
+            is_stale = any(
+                "'%s'" % value not in table_sql
+                for column in _enum_columns(table)
+                if column.type.create_constraint
+                for value in column.type.enums
+            )
+
+            if is_stale:
+                _rebuild_table(connection, table)
+
+
+def _rebuild_table(connection, table):
+    LOG.info('Rebuilding table %s to update its enum constraints', table.name)
+    preparer = connection.dialect.identifier_preparer
+    old_name = '%s_before_upgrade' % table.name
+
+    existing_columns = {
+        column['name'] for column in inspect(connection).get_columns(
+            table.name
+        )
+    }
+    columns_to_copy = ', '.join(
+        preparer.quote(column.name) for column in table.columns
+        if column.name in existing_columns
+    )
+
+    for index in inspect(connection).get_indexes(table.name):
+        connection.execute('DROP INDEX %s' % preparer.quote(index['name']))
+
+    connection.execute('ALTER TABLE %s RENAME TO %s' % (
+        preparer.format_table(table), preparer.quote(old_name)
+    ))
+    table.create(bind=connection)
+    connection.execute('INSERT INTO %s (%s) SELECT %s FROM %s' % (
+        preparer.format_table(table), columns_to_copy, columns_to_copy,
+        preparer.quote(old_name)
+    ))
+    connection.execute('DROP TABLE %s' % preparer.quote(old_name))
@@ -5,24 +5,33 @@ in the database.
 """
 import re
 import os
+import copy
+import time
+import errno
+import hashlib
+import atexit
 import shutil
 import tempfile
+import threading
 import uuid
 import logging
-import json
 from uuid import UUID
 
-import jsonschema
 from datetime import datetime, timedelta
 from flask import url_for
 from marshmallow import Schema, fields, post_dump, post_load
-from marshmallow import validates, ValidationError
+from marshmallow import validates, validates_schema, ValidationError
 from marshmallow_jsonschema import JSONSchema
-from sqlalchemy import inspect, desc
+from sqlalchemy import inspect, and_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, relationship
 from . import database
+from .blobs import BlobStore, canonical_json
 from .config import config
+from .heartbeats import HEARTBEATS
+from .scheduler import PeriodicTask
+from .schema_cache import SchemaCache
+from .storage import storage_from_name
 
 LOG = logging.getLogger(__name__)
 
@@ -52,12 +61,27 @@ class SchemaDirectoryOrganizer(object):
          |   |
          |   |__/2
 
+    With the ``sharded`` layout, job directories are spread over two
+    levels of shard directories under their service, named after the first
+    four hex digits of the MD5 hash of the job id, as in
+    ``/schema_directory/1/ab/cd/2``. This keeps every directory small, however
+    many jobs a service has. The ``migrating`` layout registers new jobs in
+    the sharded layout, but also finds jobs that are still in the flat
+    layout, while :func:`shard_schema_directory` moves them.
+
     The SchemaDirectoryOrganizer also acts as a repository for constants
     for the model classes that have to do with writing the models to their
     required schema directories
 
     :var str root_path: The name of the top directory that this manager
         is to organize.
+    :var str layout: ``flat``, ``sharded`` or ``migrating``
+    :var str fsync_policy: ``always``, ``batch`` or ``never``, as described
+        in :meth:`write`
+    :var bool deduplicate: If ``True``, documents written with
+        :meth:`write_deduplicated` are hard links into a
+        :class:`topchef.blobs.BlobStore` in the ``.blobs`` directory
+    :var BlobStore blobs: The store holding deduplicated documents
     """
     REGISTRATION_SCHEMA_NAME = 'job_registration_schema.json'
     RESULT_SCHEMA_NAME = 'job_result_schema.json'
@@ -65,11 +89,50 @@ class SchemaDirectoryOrganizer(object):
     JOB_PARAMETER_FILE_NAME = 'parameters.json'
     JOB_RESULT_FILE_NAME = 'result.json'
 
-    def __init__(self, schema_directory_path):
+    BLOB_DIRECTORY_NAME = '.blobs'
+    ATTACHMENT_DIRECTORY_NAME = 'attachments'
+
+    _valid_attachment_name = re.compile(
+        r'^[A-Za-z0-9_-][A-Za-z0-9._-]{0,254}$'
+    )
+
+    LAYOUTS = ('flat', 'sharded', 'migrating')
+    FSYNC_POLICIES = ('always', 'batch', 'never')
+
+    def __init__(self, schema_directory_path, layout='flat',
+                 fsync_policy='never', deduplicate=False):
         """
         Instantiates the variables listed in the class description
+
+        :raises: ValueError if the layout is not one of :attr:`LAYOUTS`, or
+            the fsync policy is not one of :attr:`FSYNC_POLICIES`
         """
+        if layout not in self.LAYOUTS:
+            raise ValueError(
+                'Unknown schema directory layout %s. Expected one of %s' % (
+                    layout, ', '.join(self.LAYOUTS)
+                )
+            )
+
+        if fsync_policy not in self.FSYNC_POLICIES:
+            raise ValueError(
+                'Unknown fsync policy %s. Expected one of %s' % (
+                    fsync_policy, ', '.join(self.FSYNC_POLICIES)
+                )
+            )
+
         self.root_path = schema_directory_path
+        self.layout = layout
+        self.fsync_policy = fsync_policy
+        self.deduplicate = deduplicate
+        self.blobs = BlobStore(
+            os.path.join(schema_directory_path, self.BLOB_DIRECTORY_NAME),
+            self.write
+        )
+
+        self._pending_fsync = set()
+        self._pending_fsync_lock = threading.Lock()
+        self._fsync_task = None
 
     @property
     def services(self):
@@ -103,6 +166,17 @@ class SchemaDirectoryOrganizer(object):
         else:
             raise ValueError("Attempted to register an invalid model class")
 
+    def unregister(self, job):
+        """
+        Remove the directory of a job, and everything in it. This is used
+        to clean up after a job that was registered, but whose row was
+        never committed.
+
+        :param job: The job whose directory is to be removed
+        :type job: :class:`topchef.models.Job`
+        """
+        shutil.rmtree(self[job], ignore_errors=True)
+
     def _register_service(self, service):
         """
         Register a service
@@ -119,17 +193,29 @@ class SchemaDirectoryOrganizer(object):
         else:
             os.mkdir(service_path)
 
-        print(service_path)
-        assert os.path.isdir(service_path)
-
     def _register_job(self, job):
         """
-        Register a job
+        Register a job. The job directory is created without checking for
+        it first. The service directory is only checked, and shard
+        directories are only created, if the job directory cannot be made.
 
         :raises: ValueError if the job directory exists or the job's service
             directory doesn't exist
         """
         service_path = os.path.join(self.root_path, str(job.parent_service.id))
+        job_path = self._job_path(job.parent_service.id, job.id)
+
+        try:
+            os.mkdir(job_path)
+            return
+        except OSError as error:
+            if error.errno == errno.EEXIST:
+                raise ValueError("Attempted to register job %s. \
+                        A directory for this job already exists at %s." % (
+                        job, job_path)
+                )
+            elif error.errno != errno.ENOENT:
+                raise
 
         if not os.path.isdir(service_path):
             raise ValueError("Attempted to register job %s. \
@@ -138,19 +224,39 @@ class SchemaDirectoryOrganizer(object):
                     job, job.parent_service, service_path)
             )
 
-        job_path = os.path.join(service_path, str(job.id))
-        
-        if os.path.isdir(job_path):
-            raise ValueError("Attempted to register job %s. \
-                    A directory for this job already exists at %s." % (
-                    job, job_path)
-            )
-        else:
-            os.mkdir(job_path)
+        _make_directories(os.path.dirname(job_path))
+        os.mkdir(job_path)
+
+    def _job_path(self, service_id, job_id, layout=None):
+        """
+        :param UUID service_id: The id of the job's service
+        :param UUID job_id: The id of the job
+        :param str layout: The layout in which to find the job. By default,
+            this is the layout of this manager, or ``sharded`` if the
+            manager is migrating.
+        :return: The path to the job's directory
+        :rtype: str
+        """
+        if layout is None:
+            layout = 'flat' if self.layout == 'flat' else 'sharded'
+
+        service_path = os.path.join(self.root_path, str(service_id))
+
+        if layout == 'flat':
+            return os.path.join(service_path, str(job_id))
+
+        shard = hashlib.md5(job_id.bytes).hexdigest()
+        return os.path.join(service_path, shard[:2], shard[2:4], str(job_id))
 
     def __getitem__(self, model):
         """
-        Return the directory where each model is located
+        Return the directory where each model is located. For a job that
+        has been loaded from the database, this uses the job's
+        ``service_id`` column, so that the job's service is not loaded.
+
+        The path is computed from the ids alone, without touching the file
+        system, except in the ``migrating`` layout, where a job that is not
+        in the sharded layout yet is looked for in the flat layout.
 
         :param model: The model class for which the directory must be found
         :return: The path to the working directory for the model
@@ -161,39 +267,188 @@ class SchemaDirectoryOrganizer(object):
                 self.root_path, str(model.id)
             )
         elif isinstance(model, Job):
-            return os.path.join(
-                self.root_path, str(model.parent_service.id),
-                str(model.id)
-            )
+            service_id = model.service_id
+            if service_id is None:
+                service_id = model.parent_service.id
+
+            job_path = self._job_path(service_id, model.id)
+
+            if self.layout == 'migrating' and not os.path.isdir(job_path):
+                flat_path = self._job_path(service_id, model.id, 'flat')
+                if os.path.isdir(flat_path):
+                    return flat_path
+
+            return job_path
         else:
             raise ValueError(
                 'The model class %s is not a Service or Job',
                 model.__repr__()
             )
 
+    def attachment_path(self, job, name, create=False):
+        """
+        :param job: The job to which the attachment belongs
+        :type job: :class:`Job`
+        :param str name: The name of the attachment. This is a file name of
+            letters, digits, ``.``, ``_`` and ``-``, that does not start
+            with ``.``
+        :param bool create: If ``True``, the job's attachment directory is
+            made if it does not exist, along with the job's directory
+        :return: The path of the file in which the attachment is stored, in
+            the ``attachments`` directory of the job's directory
+        :rtype: str
+        :raises: ValueError if the name is not a valid attachment name
+        """
+        if self._valid_attachment_name.match(name) is None:
+            raise ValueError(
+                'The attachment name %s is not made of letters, digits, '
+                '".", "_" and "-", or starts with "."' % name
+            )
+
+        directory = os.path.join(self[job], self.ATTACHMENT_DIRECTORY_NAME)
+        if create and not os.path.isdir(directory):
+            _make_directories(directory)
+
+        return os.path.join(directory, name)
+
     def write(self, data_to_write, target_path):
         """
-        Write the required data to the target path
+        Atomically replace the file at the target path with the data.
+
+        The data is written through the descriptor of a temporary file made
+        in the target's directory, which is then renamed over the target.
+        Readers see either the old file or the new one, never a partial
+        write. When the data reaches the disk depends on the
+        ``fsync_policy`` of this manager:
+
+        * ``always``: The file and its directory are synced before this
+          returns
+        * ``batch``: The file and its directory are synced by a background
+          task within ``SCHEMA_FSYNC_INTERVAL`` seconds, and when the
+          process exits
+        * ``never``: Syncing is left to the operating system
+
+        :param data_to_write: The text or bytes to write
+        :type data_to_write: str | bytes
+        :param str target_path: The path of the file to write
+        :raises: OSError with ``errno.ENOENT`` if the target's directory
+            does not exist
         """
-        file_descriptor, temporary_filename = tempfile.mkstemp(suffix='.json')
+        mode = 'wb' if isinstance(data_to_write, bytes) else 'w'
+        self._write_chunks([data_to_write], target_path, mode)
 
-        with open(temporary_filename, mode='w') as temporary_file:
-            temporary_file.write(data_to_write)
+    def write_stream(self, chunks, target_path):
+        """
+        Atomically replace the file at the target path with binary data
+        that is read in chunks, such as an upload. Only one chunk is held
+        in memory at a time. The file is synced as in :meth:`write`.
+
+        :param chunks: An iterable of the bytes to write
+        :param str target_path: The path of the file to write
+        :return: The number of bytes written
+        :rtype: int
+        :raises: OSError with ``errno.ENOENT`` if the target's directory
+            does not exist
+        """
+        return self._write_chunks(chunks, target_path, 'wb')
 
-        os.close(file_descriptor)
-        
-        if os.path.isfile(target_path):
-            os.remove(target_path)
-        
-        if not os.path.isdir(os.path.split(target_path)[0]):
-            raise FileNotFoundError("The parent directory %s to which this "
-            "file is to be written does not exist" % os.path.split(target_path)[0])
+    def _write_chunks(self, chunks, target_path, mode):
+        directory = os.path.dirname(target_path)
+
+        try:
+            file_descriptor, temporary_filename = tempfile.mkstemp(
+                dir=directory, prefix='.', suffix='.tmp'
+            )
+        except OSError as error:
+            if error.errno == errno.ENOENT:
+                raise OSError(
+                    errno.ENOENT, 'The parent directory to which this file '
+                    'is to be written does not exist', directory
+                )
+            raise
 
-        shutil.move(temporary_filename, target_path)
+        size = 0
 
-        
-        if os.path.isfile(temporary_filename):
-            os.remove(temporary_filename)
+        try:
+            with os.fdopen(file_descriptor, mode) as temporary_file:
+                for chunk in chunks:
+                    temporary_file.write(chunk)
+                    size += len(chunk)
+                if self.fsync_policy == 'always':
+                    temporary_file.flush()
+                    os.fsync(temporary_file.fileno())
+
+            os.chmod(temporary_filename, _FILE_MODE)
+            _replace(temporary_filename, target_path)
+        except BaseException:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+            raise
+
+        if self.fsync_policy == 'always':
+            _fsync_directory(directory)
+        elif self.fsync_policy == 'batch':
+            self._schedule_fsync(target_path)
+
+        return size
+
+    def write_deduplicated(self, data_to_write, target_path):
+        """
+        Atomically replace the file at the target path with a hard link to
+        the copy of the data in :attr:`blobs`, storing the data there if no
+        file written before had the same data. Files with the same data
+        then share one inode. The data should be written with
+        :func:`topchef.blobs.canonical_json`, so that equal documents have
+        the same text.
+
+        If :attr:`deduplicate` is ``False``, or the file system cannot link
+        the file, this is the same as :meth:`write`.
+
+        :param str data_to_write: The data to write
+        :param str target_path: The path of the file to write
+        """
+        if not self.deduplicate:
+            return self.write(data_to_write, target_path)
+
+        try:
+            self.blobs.link(data_to_write, target_path)
+        except OSError as error:
+            if error.errno not in _UNABLE_TO_LINK:
+                raise
+            LOG.debug('Unable to link %s. Writing a copy', target_path)
+            return self.write(data_to_write, target_path)
+
+        if self.fsync_policy == 'always':
+            _fsync_directory(os.path.dirname(target_path))
+        elif self.fsync_policy == 'batch':
+            self._schedule_fsync(target_path)
+
+    def sync(self):
+        """
+        Sync every file written since the last sync in the ``batch`` fsync
+        policy, along with the directories holding them. Files that have
+        since been removed are skipped.
+        """
+        with self._pending_fsync_lock:
+            pending_paths, self._pending_fsync = self._pending_fsync, set()
+
+        for path in pending_paths:
+            _fsync_path(path)
+
+        for directory in {os.path.dirname(path) for path in pending_paths}:
+            _fsync_directory(directory)
+
+    def _schedule_fsync(self, path):
+        with self._pending_fsync_lock:
+            self._pending_fsync.add(path)
+
+            if self._fsync_task is None:
+                self._fsync_task = PeriodicTask(
+                    'topchef-schema-directory-sync',
+                    config.SCHEMA_FSYNC_INTERVAL, self.sync
+                )
+                self._fsync_task.start()
+                atexit.register(self.sync)
 
     @staticmethod
     def _is_guid(dirname):
@@ -209,7 +464,108 @@ class SchemaDirectoryOrganizer(object):
         )
 
 
-FILE_MANAGER = SchemaDirectoryOrganizer(config.SCHEMA_DIRECTORY)
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _read_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+#: The permissions of written files. :func:`tempfile.mkstemp` makes files
+#: that only their owner can read, so they are given the permissions that
+#: ``open`` would have given them. The umask can only be read by changing
+#: it, so it is read once at import, before other threads are started.
+_FILE_MODE = 0o666 & ~_read_umask()
+
+#: The errors with which linking fails on file systems, or between
+#: directories, that do not support hard links, or when a document already
+#: has as many links as the file system allows
+_UNABLE_TO_LINK = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP)
+
+
+def _fsync_path(path):
+    try:
+        file_descriptor = os.open(path, os.O_RDONLY)
+    except OSError as error:
+        if error.errno == errno.ENOENT:
+            return
+        raise
+
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+def _fsync_directory(path):
+    """
+    Sync a directory, so that a file renamed into it survives a crash. This
+    is not supported on every platform, and is skipped where it is not.
+    """
+    try:
+        _fsync_path(path)
+    except OSError as error:
+        if error.errno not in (errno.EINVAL, errno.EBADF, errno.EACCES):
+            raise
+
+
+def _make_directories(path):
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+
+def shard_schema_directory(file_manager, batch_size=1000, pause=0):
+    """
+    Move the job directories of a schema directory from the flat layout to
+    the sharded layout. The server can keep running while this is done, if
+    its ``SCHEMA_DIRECTORY_LAYOUT`` is ``migrating``. Once this returns, the
+    layout can be changed to ``sharded``. This is safe to run more than
+    once.
+
+    :param SchemaDirectoryOrganizer file_manager: The manager of the schema
+        directory to shard
+    :param int batch_size: The number of jobs moved between pauses
+    :param float pause: The number of seconds to sleep after each batch, to
+        leave disk bandwidth for the server
+    :return: The number of job directories that were moved
+    :rtype: int
+    """
+    jobs_moved = 0
+
+    for service_id in file_manager.services:
+        service_path = os.path.join(file_manager.root_path, str(service_id))
+
+        for entry in os.listdir(service_path):
+            flat_path = os.path.join(service_path, entry)
+            if not file_manager._is_guid(entry) or \
+                    not os.path.isdir(flat_path):
+                continue
+
+            sharded_path = file_manager._job_path(
+                service_id, UUID(entry), 'sharded'
+            )
+            _make_directories(os.path.dirname(sharded_path))
+            os.rename(flat_path, sharded_path)
+
+            jobs_moved += 1
+            if jobs_moved % batch_size == 0:
+                LOG.info('Moved %d job directories', jobs_moved)
+                time.sleep(pause)
+
+    return jobs_moved
+
+
+FILE_MANAGER = SchemaDirectoryOrganizer(
+    config.SCHEMA_DIRECTORY, config.SCHEMA_DIRECTORY_LAYOUT,
+    config.SCHEMA_FSYNC_POLICY, config.DEDUPLICATE_DOCUMENTS
+)
+SCHEMA_CACHE = SchemaCache(config.SCHEMA_CACHE_SIZE)
+JOB_STORAGE = storage_from_name(config.JOB_STORAGE)
 
 
 class UnableToFindItemError(Exception):
@@ -286,18 +642,55 @@ class Service(BASE):
             return service
 
     def heartbeat(self):
-        self.last_checked_in = datetime.utcnow()
+        """
+        Record that the service has checked in. The heartbeat is buffered in
+        memory, and is written to ``last_checked_in`` when the heartbeat
+        buffer is flushed.
+        """
+        HEARTBEATS.record(self.id)
+
+    @property
+    def checked_in_at(self):
+        """
+        :return: The last time that the service checked in, including
+            heartbeats that have not yet been written to the database
+        :rtype: datetime
+        """
+        buffered = HEARTBEATS.last_checked_in(self.id)
+        if buffered is None or buffered < self.last_checked_in:
+            return self.last_checked_in
+        return buffered
+
+    @property
+    def etag(self):
+        """
+        :return: An entity tag that changes whenever the service is changed,
+            checks in, or times out
+        :rtype: str
+        """
+        return '%s-%d-%s-%d' % (
+            self.id.hex, self.version or 0,
+            self.checked_in_at.strftime('%Y%m%d%H%M%S%f'),
+            self.has_timed_out
+        )
 
     @property
     def has_timed_out(self, date=None):
         if date is None:
             date = datetime.utcnow()
-        return (date - self.last_checked_in) >= \
+        return (date - self.checked_in_at) >= \
             timedelta(seconds=self.heartbeat_timeout)
 
     @property
     def is_available(self):
-        return self._is_service_available and not self.has_timed_out
+        """
+        A service is available if it has checked in within its heartbeat
+        timeout. A service marked unavailable by the reaper becomes
+        available again as soon as it checks in.
+        """
+        has_checked_in_since = self.checked_in_at > self.last_checked_in
+        return (self._is_service_available or has_checked_in_since) and \
+            not self.has_timed_out
 
     @is_available.setter
     def is_available(self, new_value):
@@ -327,18 +720,36 @@ class Service(BASE):
         if conditions_for_deletion or dangerous_delete:
             os.remove(self.path_to_schema)
 
-    @property
-    def job_registration_schema(self):
-        registration_schema_path = os.path.join(
-            self.file_manager[self],
-            self.file_manager.REGISTRATION_SCHEMA_NAME
+    def _cached_schema(self, schema_name):
+        """
+        :param str schema_name: The name of the schema file in the service's
+            directory
+        :return: The schema stored in the file, and its compiled validator
+        :rtype: :class:`topchef.schema_cache.CachedSchema`
+        """
+        return SCHEMA_CACHE.get(
+            (self.id, schema_name),
+            os.path.join(self.file_manager[self], schema_name),
+            self._load_schema
         )
 
-        with open(registration_schema_path, mode='r') as schema_file:
-            file_data = ''.join([line for line in schema_file])
+    @staticmethod
+    def _load_schema(schema_path):
+        with open(schema_path, mode='r') as schema_file:
+            file_data = schema_file.read()
 
         return JSONSchema().loads(file_data).data
 
+    @property
+    def job_registration_schema(self):
+        """
+        :return: A copy of the job registration schema, that the caller may
+            change without changing the cached schema
+        """
+        return copy.deepcopy(self._cached_schema(
+            self.file_manager.REGISTRATION_SCHEMA_NAME
+        ).schema)
+
     @job_registration_schema.setter
     def job_registration_schema(self, schema_to_write):
         schema_path = os.path.join(
@@ -348,18 +759,32 @@ class Service(BASE):
 
         JSONSchema().validate(schema_to_write)
 
-        self.file_manager.write(json.dumps(schema_to_write), schema_path)
-
-    @property
-    def job_result_schema(self):
-        schema_path = os.path.join(
-            self.file_manager[self], self.file_manager.RESULT_SCHEMA_NAME
+        self.file_manager.write_deduplicated(
+            canonical_json(schema_to_write), schema_path
+        )
+        SCHEMA_CACHE.invalidate(
+            (self.id, self.file_manager.REGISTRATION_SCHEMA_NAME)
         )
 
-        with open(schema_path, mode='r') as schema_file:
-            schema = json.loads(''.join([line for line in schema_file]))
+    @property
+    def job_registration_validator(self):
+        """
+        :return: A validator for the job registration schema, that is
+            compiled once and cached for as long as the schema is unchanged
+        """
+        return self._cached_schema(
+            self.file_manager.REGISTRATION_SCHEMA_NAME
+        ).validator
 
-        return JSONSchema().load(schema).data
+    @property
+    def job_result_schema(self):
+        """
+        :return: A copy of the job result schema, as in
+            :attr:`job_registration_schema`
+        """
+        return copy.deepcopy(self._cached_schema(
+            self.file_manager.RESULT_SCHEMA_NAME
+        ).schema)
 
     @job_result_schema.setter
     def job_result_schema(self, schema_to_write):
@@ -371,7 +796,20 @@ class Service(BASE):
             self.file_manager[self], self.file_manager.RESULT_SCHEMA_NAME
         )
 
-        self.file_manager.write(data, schema_path)
+        self.file_manager.write_deduplicated(data, schema_path)
+        SCHEMA_CACHE.invalidate(
+            (self.id, self.file_manager.RESULT_SCHEMA_NAME)
+        )
+
+    @property
+    def job_result_validator(self):
+        """
+        :return: A validator for the job result schema, that is compiled
+            once and cached for as long as the schema is unchanged
+        """
+        return self._cached_schema(
+            self.file_manager.RESULT_SCHEMA_NAME
+        ).validator
 
     class ServiceSchema(Schema):
         id = fields.Str()
@@ -412,85 +850,321 @@ class Service(BASE):
 class Job(BASE):
     """
     Base class for a compute job
+
+    :var storage: The backend in which the parameters and result of the job
+        are kept. Jobs loaded from the database use ``JOB_STORAGE``.
+    :type storage: :class:`topchef.storage.JobStorage`
     """
     __table__ = database.jobs
 
     id = __table__.c.job_id
     date_submitted = __table__.c.date_submitted
     status = __table__.c.status
+    _parameters = __table__.c.parameters
+    _result = __table__.c.result
+
+    storage = JOB_STORAGE
+
+    UPDATABLE_FIELDS = ('status', 'result', 'parameters', 'priority')
 
     def __init__(self, parent_service, job_parameters,
                  attached_session=Session(bind=config.database_engine),
-                 file_manager=FILE_MANAGER
+                 file_manager=FILE_MANAGER, storage=JOB_STORAGE, priority=0
                  ):
-        self.parent_service = parent_service
+        parent_service.job_registration_validator.validate(job_parameters)
 
-        jsonschema.validate(
-            job_parameters,
-            self.parent_service.job_registration_schema
-        )
+        self.parent_service = parent_service
  
         self.id = uuid.uuid1()
         self.date_submitted = datetime.utcnow()
         self.status = "REGISTERED"
+        self.priority = priority
         
         self.file_manager = file_manager
-        self.file_manager.register(self)
+        self.storage = storage
+        self.storage.register(self)
 
         self.session = attached_session
         self.parameters = job_parameters
         
         self.result = {}
 
-    def next(self, session):
-        job = session.query(self.__class__).filter(
-            self.__class__.date_submitted > self.date_submitted
-        ).order_by(
-            desc(self.__class__.date_submitted)
-        ).first()
+    @classmethod
+    def claim_next(cls, session, service_id):
+        """
+        Take the first claimable job off the queue of a service, in the order
+        given by :meth:`queue_order`, and mark it as ``WORKING``, so that no
+        other worker can claim it. If no job is ``REGISTERED``, the job whose
+        lease expired first is taken instead, if it is ``WORKING`` and has
+        been attempted fewer than ``JOB_MAX_ATTEMPTS`` times.
+
+        The two lookups are separate queries, so that each one seeks its own
+        index: ``ix_jobs_service_status_priority`` for registered jobs, and
+        ``ix_jobs_status_lease`` for expired leases.
+
+        On PostgreSQL, the candidate row is locked with
+        ``SELECT ... FOR UPDATE SKIP LOCKED``, so that concurrent workers
+        skip over jobs that are being claimed instead of waiting on them.
+        Other databases use a conditional ``UPDATE`` that only succeeds if
+        the job is still claimable. If another worker won the race, the next
+        candidate is tried.
+
+        The claimed job is leased to its worker for ``JOB_LEASE_SECONDS``,
+        and its ``attempts`` are incremented. The new number of attempts is
+        the worker's lease token. Workers extend the lease with
+        :meth:`renew_lease`, and send the token back with their results, so
+        that a worker whose job was claimed again can no longer change it.
+        If the lease expires before the job is finished, the job can be
+        claimed again, or is taken back by the reaper.
+
+        The caller is responsible for committing the session.
+
+        :param Session session: The session in which the job is claimed
+        :param UUID service_id: The id of the service whose queue is to be
+            popped
+        :return: The claimed job, or ``None`` if the queue is empty
+        :rtype: :class:`Job` | None
+        """
+        now = datetime.utcnow()
+        waiting = cls.status == "REGISTERED"
+        lease_expired = and_(
+            cls.status == "WORKING",
+            cls.lease_expires_at < now,
+            cls.attempts < config.JOB_MAX_ATTEMPTS
+        )
 
-        if job is None:
-            return None
+        for claimable, order in (
+                (waiting, cls.queue_order()),
+                (lease_expired, (cls.lease_expires_at,))
+        ):
+            queue = session.query(cls).filter(
+                cls.service_id == service_id, claimable
+            ).order_by(*order)
 
-        return job
+            job = cls._claim_first(session, queue, claimable)
+            if job is not None:
+                return job
 
-    def update(self, new_dictionary):
+        return None
+
+    @classmethod
+    def _claim_first(cls, session, queue, claimable):
         """
-        Update job data with new data
-        :param dict new_dictionary:
-        :return:
+        :param Session session: The session in which the job is claimed
+        :param Query queue: The claimable jobs, in the order in which they
+            are to be claimed
+        :param claimable: The condition that a job must still meet when it
+            is claimed
+        :return: The claimed job, or ``None`` if the queue is empty
+        :rtype: :class:`Job` | None
         """
-        self.DetailedJobSchema().validate(new_dictionary)
+        if session.get_bind().dialect.name == 'postgresql':
+            job = queue.with_for_update(skip_locked=True).first()
+            if job is not None:
+                job.status = "WORKING"
+                job.lease_expires_at = cls._new_lease_expiry()
+                job.attempts += 1
+                job.version += 1
+            return job
+
+        while True:
+            candidate = queue.with_entities(cls.id).first()
+            if candidate is None:
+                return None
+
+            claim = session.execute(
+                database.jobs.update().where(and_(
+                    database.jobs.c.job_id == candidate[0],
+                    claimable
+                )).values(
+                    status="WORKING",
+                    lease_expires_at=cls._new_lease_expiry(),
+                    attempts=database.jobs.c.attempts + 1,
+                    version=database.jobs.c.version + 1
+                )
+            )
 
-        self.status = new_dictionary['status']
-        self.result = new_dictionary['result']
-        self.parameters = new_dictionary['parameters']
+            if claim.rowcount == 1:
+                return session.query(cls).populate_existing().filter_by(
+                    id=candidate[0]
+                ).first()
 
-    @property
-    def parameters(self):
-        schema_path = os.path.join(
-            self.file_manager[self], self.file_manager.JOB_PARAMETER_FILE_NAME
+    @classmethod
+    def queue_order(cls):
+        """
+        :return: The order in which jobs are taken off a service's queue.
+            Jobs with a higher ``priority`` go first, and jobs with the same
+            priority are taken oldest first.
+        :rtype: tuple
+        """
+        return cls.priority.desc(), cls.date_submitted
+
+    @classmethod
+    def renew_lease(cls, session, job_id, attempt, seconds=None):
+        """
+        Extend the unexpired lease of a ``WORKING`` job, with one ``UPDATE``
+        and without loading the job. This does not change the job's
+        version.
+
+        The caller is responsible for committing the session.
+
+        :param Session session: The session in which the lease is renewed
+        :param UUID job_id: The id of the job
+        :param int attempt: The lease token given to the worker when it
+            claimed the job, which is the job's number of ``attempts``
+        :param int seconds: The number of seconds from now after which the
+            lease expires. By default, this is ``JOB_LEASE_SECONDS``.
+        :return: The new expiry time of the lease, or ``None`` if the job is
+            not ``WORKING``, its lease has expired, or it is leased to
+            another attempt
+        :rtype: datetime | None
+        :raises: :exc:`UnableToFindItemError` if the job does not exist
+        """
+        now = datetime.utcnow()
+        lease_expires_at = cls._new_lease_expiry(seconds)
+
+        renewal = session.execute(
+            database.jobs.update().where(and_(
+                database.jobs.c.job_id == job_id,
+                database.jobs.c.status == "WORKING",
+                database.jobs.c.attempts == attempt,
+                database.jobs.c.lease_expires_at > now
+            )).values(lease_expires_at=lease_expires_at)
         )
 
-        if not os.path.isfile(schema_path):
-            with open(schema_path, mode='w+') as file:
-                file.write(json.dumps({}))
+        if renewal.rowcount == 1:
+            return lease_expires_at
+
+        job_exists = session.query(cls.id).filter_by(
+            id=job_id
+        ).first() is not None
+
+        if not job_exists:
+            raise UnableToFindItemError(
+                'The job with id %s does not exist' % job_id
+            )
 
-        with open(schema_path, mode='r') as file:
-            data = ''.join([line for line in file])
+        return None
+
+    def holds_lease(self, attempt):
+        """
+        :param int attempt: The lease token sent by a worker, or ``None``
+        :return: ``True`` if the job may be changed by the worker with this
+            token. Jobs that are not ``WORKING``, and jobs that were set to
+            ``WORKING`` without being claimed, have no lease, and may be
+            changed by anyone.
+        :rtype: bool
+        """
+        return self.status != "WORKING" or self.lease_expires_at is None \
+            or attempt == self.attempts
+
+    @staticmethod
+    def _new_lease_expiry(seconds=None):
+        if seconds is None:
+            seconds = config.JOB_LEASE_SECONDS
+        return datetime.utcnow() + timedelta(seconds=seconds)
+
+    def next(self, session):
+        """
+        :param Session session: The session in which to look for the job
+        :return: The job of the same service that was submitted right after
+            this one, or ``None`` if this is the latest job
+        :rtype: :class:`Job` | None
+        """
+        return session.query(self.__class__).filter(
+            self.__class__.service_id == self.service_id,
+            self.__class__.date_submitted > self.date_submitted
+        ).order_by(self.__class__.date_submitted).first()
+
+    def update(self, new_dictionary, defer_writes=False):
+        """
+        Update job data with new data. Only the keys present in the
+        dictionary are updated. Changing the priority of a ``REGISTERED``
+        job moves it in its service's queue. Every field, and the result's
+        match with the service's result schema, are checked before
+        anything is changed.
+
+        :param dict new_dictionary: The new status, result, parameters and
+            priority of the job
+        :param bool defer_writes: If ``True``, and the job's storage keeps
+            the result and parameters outside of the job's row, they are
+            not written until :meth:`write_deferred` is called. Callers
+            should call it once the update is committed, so that a rolled
+            back update leaves nothing behind.
+        :raises: ValueError if a field has an invalid value
+        :raises: jsonschema.ValidationError if the result does not match
+            the service's result schema
+        """
+        changes = {
+            name: new_dictionary[name] for name in self.UPDATABLE_FIELDS
+            if name in new_dictionary
+        }
+
+        errors = self.DetailedJobSchema(partial=True).validate(changes)
+        if errors:
+            raise ValueError('The job update is invalid: %s' % errors)
+
+        writes = []
+        if 'result' in changes:
+            self.parent_service.job_result_validator.validate(
+                changes['result']
+            )
+            writes.append((self.storage.write_result, changes['result']))
+        if 'parameters' in changes:
+            writes.append(
+                (self.storage.write_parameters, changes['parameters'])
+            )
+
+        if defer_writes and not self.storage.transactional:
+            self._deferred_writes = writes
+        else:
+            for write, document in writes:
+                write(self, document)
+
+        if 'priority' in new_dictionary:
+            self.priority = new_dictionary['priority']
+        if 'status' in new_dictionary:
+            self.status = new_dictionary['status']
+            # Only claims give a lease, so that jobs set to WORKING by hand
+            # are neither taken back by the reaper nor tied to an attempt
+            if self.status != "WORKING":
+                self.lease_expires_at = None
+
+        if inspect(self).persistent:
+            # Incremented by the database, so that concurrent updates never
+            # give two different contents the same version
+            self.version = self.__class__.version + 1
+        else:
+            self.version = (self.version or 0) + 1
+
+    def write_deferred(self):
+        """
+        Write the result and parameters held back by
+        ``update(..., defer_writes=True)``
+        """
+        writes = getattr(self, '_deferred_writes', [])
+        self._deferred_writes = []
 
-        return json.loads(data)
+        for write, document in writes:
+            write(self, document)
+
+    @property
+    def etag(self):
+        """
+        :return: An entity tag that changes whenever the job is updated
+        :rtype: str
+        """
+        return '%s-%d' % (self.id.hex, self.version or 0)
+
+    @property
+    def parameters(self):
+        return self.storage.read_parameters(self)
 
     @parameters.setter
     def parameters(self, new_schema):
-        schema_path = os.path.join(
-            self.file_manager[self], self.file_manager.JOB_PARAMETER_FILE_NAME
-        )
-
         JSONSchema().validate(new_schema)
 
-        with open(schema_path, mode='w+') as schema_file:
-            schema_file.write(json.dumps(new_schema))
+        self.storage.write_parameters(self, new_schema)
 
     @property
     def result_schema(self):
@@ -498,50 +1172,59 @@ class Job(BASE):
 
     @property
     def result(self):
-        schema_path = os.path.join(
-            self.file_manager[self], 
-            self.file_manager.JOB_RESULT_FILE_NAME
-        )
-
-        if not os.path.isfile(schema_path):
-            return None
-
-        with open(schema_path) as result_file:
-            file_data = result_file.read()
-
-        return json.loads(file_data)
+        return self.storage.read_result(self)
 
     @result.setter
     def result(self, job_result):
-        path_to_write = os.path.join(
-            self.file_manager[self],
-            self.file_manager.JOB_RESULT_FILE_NAME
-        )
-
-        jsonschema.validate(job_result, self.parent_service.job_result_schema)
-        self.file_manager.write(
-            json.dumps(job_result), path_to_write
-        )
+        self.parent_service.job_result_validator.validate(job_result)
+        self.storage.write_result(self, job_result)
 
     class JobSchema(Schema):
         id = fields.Str()
         date_submitted = fields.DateTime()
         status = fields.Str(default="REGISTERED")
         parameters = fields.Dict(required=True)
+        priority = fields.Int(default=0)
+        attempts = fields.Int(dump_only=True)
 
-        _valid_statuses = re.compile('^((REGISTERED)|(WORKING)|(COMPLETED))$')
+        _valid_statuses = re.compile(
+            '^((REGISTERED)|(WORKING)|(COMPLETED)|(FAILED))$'
+        )
 
         @validates('status')
         def _validate_status(self, value):
             if self._valid_statuses.match(value) is None:
                 raise ValidationError(
-                    'The status %s is not REGISTERED, WORKING, or COMPLETED' % (
-                        value)
+                    'The status %s is not REGISTERED, WORKING, COMPLETED, '
+                    'or FAILED' % value
+                )
+
+        @validates_schema(pass_original=True)
+        def _validate_priority(self, data, original_data):
+            # fields.Int truncates floats, so 2.7 would be loaded as 2
+            if not isinstance(original_data, dict):
+                return
+
+            priority = original_data.get('priority')
+            if isinstance(priority, float) and not priority.is_integer():
+                raise ValidationError(
+                    'The priority %s is not an integer' % priority,
+                    'priority'
                 )
 
     class DetailedJobSchema(JobSchema):
         result = fields.Dict(required=False)
 
+    class JobUpdateSchema(DetailedJobSchema):
+        """
+        Describes one entry in a batch update of jobs. Only the id of the job
+        is required. Updates to ``WORKING`` jobs must also give the
+        ``attempt`` that holds the job's lease.
+        """
+        id = fields.Str(required=True)
+        parameters = fields.Dict(required=False)
+        attempt = fields.Int(load_only=True)
+
     def __repr__(self):
         return '%s(parent_service=%s, ' \
                'job_parameters=%s, attached_session=%s, file_manager=%s)' % (
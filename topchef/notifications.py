@@ -0,0 +1,268 @@
+"""
+Contains a notification bus that lets long-polling requests sleep until a
+service or job changes, instead of querying the database in a loop
+"""
+import logging
+import select
+import threading
+import time
+from sqlalchemy import text
+
+LOG = logging.getLogger(__name__)
+
+
+class NotificationBus(object):
+    """
+    Keeps a version for every key that has been published to. Keys are the
+    ids of services and jobs. Publishing a key moves its version on and
+    wakes up every thread waiting on that key.
+
+    Versions are taken from one counter shared by all keys, so that keys
+    nobody waits on can be forgotten. Once more than
+    :attr:`MAX_TRACKED_KEYS` keys are tracked, every key without a waiter
+    or subscriber is dropped, and dropped keys report the counter value at
+    that moment. The version of a key therefore never goes back, and no
+    notification is lost; a caller holding an old version of a dropped key
+    just wakes up once more than it needed to.
+
+    A waiting thread reads the version of its key *before* it checks the
+    database. If the key is published between the check and the call to
+    :meth:`wait`, the version has already moved on and the wait returns
+    immediately, so no notification is lost.
+
+    If the database is PostgreSQL, publishing also sends a ``NOTIFY`` on
+    :attr:`CHANNEL`. A listener thread runs ``LISTEN`` on that channel, and
+    feeds notifications sent by other server processes into this bus.
+
+    :var int LISTEN_POLL_SECONDS: The maximum time that the listener thread
+        blocks before checking its connection again
+    :var int MAX_TRACKED_KEYS: The number of keys above which keys without
+        a waiter or subscriber are forgotten
+    :var int MAX_PAYLOAD_BYTES: The largest ``NOTIFY`` payload to send.
+        PostgreSQL rejects payloads of 8000 bytes or more, so larger
+        batches of keys are split over several notifications.
+    """
+    CHANNEL = 'topchef'
+    LISTEN_POLL_SECONDS = 5
+    MAX_TRACKED_KEYS = 10000
+    MAX_PAYLOAD_BYTES = 7900
+
+    def __init__(self):
+        """
+        Instantiates an empty bus without a PostgreSQL listener
+        """
+        self._versions = {}
+        self._counter = 0
+        self._floor = 0
+        self._waiting = {}
+        self._subscribers = {}
+        self._condition = threading.Condition()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def version(self, key):
+        """
+        :param key: The id of the service or job
+        :return: The current version of the key. This changes every time
+            that the key is published.
+        :rtype: int
+        """
+        with self._condition:
+            return self._versions.get(str(key), self._floor)
+
+    def publish(self, key, engine=None):
+        """
+        Tell every waiting thread that the model with this key has changed.
+        This should be called after the change has been committed.
+
+        :param key: The id of the service or job that changed
+        :param engine: The engine to which the change was committed. If this
+            is a PostgreSQL engine, other server processes are notified as
+            well.
+        """
+        self.publish_many([key], engine=engine)
+
+    def publish_many(self, keys, engine=None):
+        """
+        Publish several keys at once. On PostgreSQL, the keys are sent to
+        other server processes in a single ``NOTIFY``, instead of one
+        round trip per key.
+
+        :param keys: The ids of the services and jobs that changed
+        :param engine: The engine to which the changes were committed, as
+            in :meth:`publish`
+        """
+        keys = [str(key) for key in keys]
+        if not keys:
+            return
+
+        self._notify(keys)
+
+        if engine is not None and engine.dialect.name == 'postgresql':
+            for payload in self._payloads(keys):
+                engine.execute(
+                    text(
+                        'SELECT pg_notify(:channel, :payload)'
+                    ).execution_options(autocommit=True),
+                    channel=self.CHANNEL, payload=payload
+                )
+
+    def wait(self, key, version, timeout, engine=None):
+        """
+        Block until the key has been published past the given version, or
+        until the timeout runs out
+
+        :param key: The id of the service or job to wait on
+        :param int version: The version of the key that the caller has seen
+        :param float timeout: The maximum number of seconds to wait
+        :param engine: The engine on which the caller will look for
+            changes. If this is a PostgreSQL engine, the listener thread is
+            started if it is not running yet.
+        :return: ``True`` if the key was published, otherwise ``False``
+        :rtype: bool
+        """
+        if engine is not None and engine.dialect.name == 'postgresql':
+            self._ensure_listener(engine)
+
+        key = str(key)
+        deadline = time.time() + timeout
+
+        with self._condition:
+            self._waiting[key] = self._waiting.get(key, 0) + 1
+            try:
+                while self._versions.get(key, self._floor) == version:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting[key] -= 1
+                if not self._waiting[key]:
+                    del self._waiting[key]
+
+        return True
+
+    def subscribe(self, key, callback, engine=None):
+        """
+        Call a function every time that a key is published, instead of
+        blocking a thread in :meth:`wait`. This lets an event loop wait on
+        many keys at once.
+
+        The function is called in the publishing thread, so it should only
+        hand the notification over to its event loop.
+
+        :param key: The id of the service or job to watch
+        :param callable callback: A function taking no arguments
+        :param engine: The engine on which the caller will look for
+            changes, as in :meth:`wait`
+        """
+        if engine is not None and engine.dialect.name == 'postgresql':
+            self._ensure_listener(engine)
+
+        with self._condition:
+            self._subscribers.setdefault(str(key), []).append(callback)
+
+    def unsubscribe(self, key, callback):
+        """
+        Stop calling a function that was passed to :meth:`subscribe`
+
+        :param key: The key that the function was subscribed to
+        :param callable callback: The subscribed function
+        """
+        key = str(key)
+
+        with self._condition:
+            callbacks = self._subscribers.get(key, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._subscribers.pop(key, None)
+
+    def _notify(self, keys):
+        with self._condition:
+            for key in keys:
+                self._counter += 1
+                self._versions[key] = self._counter
+            if len(self._versions) > self.MAX_TRACKED_KEYS:
+                self._prune()
+            self._condition.notify_all()
+            callbacks = [
+                callback for key in keys
+                for callback in self._subscribers.get(key, [])
+            ]
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as error:
+                LOG.error('Notification subscriber failed: %s', error)
+
+    def _prune(self):
+        """
+        Forget every key that nobody waits on or subscribes to. The caller
+        must hold :attr:`_condition`.
+        """
+        watched = set(self._waiting) | set(self._subscribers)
+        self._versions = {
+            key: self._versions.get(key, self._floor) for key in watched
+        }
+        self._floor = self._counter
+
+    def _payloads(self, keys):
+        """
+        :param list keys: The keys to send to other server processes
+        :return: Comma-separated lists of keys, each short enough for one
+            ``NOTIFY``
+        :rtype: list
+        """
+        payloads = []
+        payload = []
+        length = 0
+        for key in keys:
+            if payload and length + len(key) + 1 > self.MAX_PAYLOAD_BYTES:
+                payloads.append(','.join(payload))
+                payload = []
+                length = 0
+            payload.append(key)
+            length += len(key) + 1
+        payloads.append(','.join(payload))
+        return payloads
+
+    def _ensure_listener(self, engine):
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, args=(engine,),
+                    name='topchef-notification-listener'
+                )
+                self._listener.daemon = True
+                self._listener.start()
+
+    def _listen(self, engine):
+        """
+        Relay PostgreSQL notifications on :attr:`CHANNEL` into this bus
+        until the connection is lost
+        """
+        connection = engine.raw_connection()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.set_isolation_level(0)
+
+            cursor = dbapi_connection.cursor()
+            cursor.execute('LISTEN %s' % self.CHANNEL)
+
+            while True:
+                select.select(
+                    [dbapi_connection], [], [], self.LISTEN_POLL_SECONDS
+                )
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    self._notify(notification.payload.split(','))
+        except Exception as error:
+            LOG.error('Notification listener stopped: %s', error)
+        finally:
+            connection.invalidate()
+
+
+NOTIFICATIONS = NotificationBus()
@@ -0,0 +1,156 @@
+"""
+Contains helpers for paging through lists of jobs.
+
+Pages are ordered by ``(date_submitted, job_id)``, and are fetched with a
+keyset cursor instead of an offset. The cursor names the last job of the
+previous page, so the database can seek straight to the next page through
+an index on ``date_submitted``, however deep into the list the page is.
+"""
+import base64
+import binascii
+from collections import namedtuple
+from datetime import datetime
+from uuid import UUID
+from dateutil import parser as date_parser
+from dateutil import tz
+from sqlalchemy import and_, or_
+
+Page = namedtuple('Page', ['items', 'next_cursor', 'arguments'])
+
+_CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(job):
+    """
+    :param job: The last job on a page
+    :type job: :class:`topchef.models.Job`
+    :return: An opaque cursor pointing after this job
+    :rtype: str
+    """
+    position = '%s|%s' % (
+        job.date_submitted.strftime(_CURSOR_DATE_FORMAT), job.id.hex
+    )
+    return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    :param str cursor: A cursor made by :func:`encode_cursor`
+    :return: The submission date and id of the job that the cursor points
+        after
+    :rtype: tuple(datetime, UUID)
+    :raises: ValueError if the cursor is malformed
+    """
+    try:
+        position = base64.urlsafe_b64decode(
+            cursor.encode('ascii')
+        ).decode('ascii')
+        date_submitted, job_id = position.split('|')
+        return (
+            datetime.strptime(date_submitted, _CURSOR_DATE_FORMAT),
+            UUID(job_id)
+        )
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        raise ValueError('The cursor %s is not valid' % cursor)
+
+
+def parse_date(value):
+    """
+    :param str value: A date in ISO 8601 format
+    :return: The date as a naive datetime in UTC, which is how dates are
+        stored in the database
+    :rtype: datetime
+    :raises: ValueError if the date cannot be parsed
+    """
+    try:
+        date = date_parser.parse(value)
+    except (ValueError, OverflowError):
+        raise ValueError('The date %s is not in ISO 8601 format' % value)
+
+    if date.tzinfo is not None:
+        date = date.astimezone(tz.tzutc()).replace(tzinfo=None)
+
+    return date
+
+
+def paginate_jobs(query, job_class, arguments, default_limit, max_limit):
+    """
+    Filter a query for jobs using the query string of a request, and return
+    one page of it.
+
+    The recognized arguments are
+
+    * ``limit``: The number of jobs per page
+    * ``after``: The cursor returned with the previous page
+    * ``status``: Only return jobs with this status
+    * ``submitted_after``: Only return jobs submitted at or after this date
+    * ``submitted_before``: Only return jobs submitted before this date
+
+    :param Query query: The query for the jobs to page through
+    :param job_class: The mapped job class
+    :param arguments: The query string arguments of the request
+    :type arguments: werkzeug.datastructures.MultiDict
+    :param int default_limit: The page size if ``limit`` is not given
+    :param int max_limit: The largest allowed page size
+    :return: The jobs on the page, a cursor for the next page if there is
+        one, and the arguments needed to request the next page
+    :rtype: Page
+    :raises: ValueError if any argument is invalid
+    """
+    try:
+        limit = int(arguments.get('limit', default_limit))
+    except ValueError:
+        raise ValueError('The limit %s is not an integer' % (
+            arguments.get('limit')))
+
+    if not 1 <= limit <= max_limit:
+        raise ValueError(
+            'The limit must be between 1 and %d, got %d' % (max_limit, limit)
+        )
+
+    page_arguments = {'limit': limit}
+
+    if 'status' in arguments:
+        status = arguments['status']
+        valid_statuses = job_class.__table__.c.status.type.enums
+        if status not in valid_statuses:
+            raise ValueError('The status %s is not one of %s' % (
+                status, ', '.join(valid_statuses)))
+        query = query.filter(job_class.status == status)
+        page_arguments['status'] = status
+
+    if 'submitted_after' in arguments:
+        query = query.filter(
+            job_class.date_submitted >= parse_date(
+                arguments['submitted_after']
+            )
+        )
+        page_arguments['submitted_after'] = arguments['submitted_after']
+
+    if 'submitted_before' in arguments:
+        query = query.filter(
+            job_class.date_submitted < parse_date(
+                arguments['submitted_before']
+            )
+        )
+        page_arguments['submitted_before'] = arguments['submitted_before']
+
+    if 'after' in arguments:
+        date_submitted, job_id = decode_cursor(arguments['after'])
+        query = query.filter(or_(
+            job_class.date_submitted > date_submitted,
+            and_(
+                job_class.date_submitted == date_submitted,
+                job_class.id > job_id
+            )
+        ))
+
+    jobs = query.order_by(
+        job_class.date_submitted, job_class.id
+    ).limit(limit + 1).all()
+
+    if len(jobs) > limit:
+        return Page(jobs[:limit], encode_cursor(jobs[limit - 1]),
+                    page_arguments)
+    else:
+        return Page(jobs, None, page_arguments)
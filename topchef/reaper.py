@@ -0,0 +1,234 @@
+"""
+Contains the reaper, which periodically marks timed-out services as
+unavailable, and takes back jobs whose workers stopped renewing their lease.
+
+Both scans are done with ``UPDATE`` statements that filter on indexed
+columns, so that the cost of finding dead services and stuck jobs is not
+paid by loading and checking every row in Python.
+
+Every process that serves the API starts a reaper. On PostgreSQL, a reaper
+only scans if it holds the advisory lock :data:`REAPER_LOCK_KEY`, so that
+one scan runs at a time however many processes there are. SQLite databases
+are served by one process, as described in :mod:`topchef.serve`.
+"""
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import and_, case, cast, func, select
+from .config import config
+from .database import services, jobs
+from .heartbeats import HEARTBEATS
+from .notifications import NOTIFICATIONS
+from .scheduler import PeriodicTask
+
+LOG = logging.getLogger(__name__)
+
+#: The statuses to which jobs with an expired lease can be moved, keyed by
+#: the value of the ``JOB_LEASE_EXPIRED_ACTION`` configuration parameter
+LEASE_EXPIRED_STATUSES = {
+    'requeue': 'REGISTERED',
+    'fail': 'FAILED'
+}
+
+#: The key of the PostgreSQL advisory lock held while reaping
+REAPER_LOCK_KEY = 0x70636865
+
+
+def reap_services(engine, now=None, grace_period=0):
+    """
+    Mark every available service that has not checked in within its
+    heartbeat timeout as unavailable. The timeout is compared in SQL, once
+    for each distinct ``heartbeat_timeout_seconds`` in the table.
+
+    :param engine: The engine connected to the database to scan
+    :param datetime now: The current time. By default, this is now.
+    :param float grace_period: Extra seconds allowed to each service, to
+        cover heartbeats that other processes have not yet flushed
+    :return: The number of services that were marked unavailable
+    :rtype: int
+    """
+    if now is None:
+        now = datetime.utcnow()
+
+    services_reaped = 0
+
+    with engine.begin() as connection:
+        timeouts = [row[0] for row in connection.execute(
+            select([services.c.heartbeat_timeout_seconds]).where(
+                services.c.is_service_available == True
+            ).distinct()
+        )]
+
+        for timeout in timeouts:
+            deadline = now - timedelta(seconds=timeout + grace_period)
+            services_reaped += connection.execute(
+                services.update().where(and_(
+                    services.c.is_service_available == True,
+                    services.c.heartbeat_timeout_seconds == timeout,
+                    services.c.last_checked_in < deadline
+                )).values(
+                    is_service_available=False,
+                    version=services.c.version + 1
+                )
+            ).rowcount
+
+    if services_reaped:
+        LOG.info('Marked %d services as unavailable', services_reaped)
+
+    return services_reaped
+
+
+def reap_jobs(engine, now=None, action='requeue'):
+    """
+    Take back every ``WORKING`` job whose lease has expired, either by
+    putting it back on its service's queue or by marking it ``FAILED``.
+    Jobs that have already been claimed ``JOB_MAX_ATTEMPTS`` times are
+    always marked ``FAILED``.
+
+    This is one ``UPDATE ... WHERE lease_expires_at < now``. On PostgreSQL,
+    the jobs it changed are read with ``RETURNING``. On other databases,
+    they are read just before, after the write lock on the table is taken,
+    so that no lease can be renewed in between.
+
+    :param engine: The engine connected to the database to scan
+    :param datetime now: The current time. By default, this is now.
+    :param str action: ``requeue`` or ``fail``
+    :return: The ids of the jobs that were taken back
+    :rtype: list
+    :raises: ValueError if the action is not known
+    """
+    try:
+        new_status = LEASE_EXPIRED_STATUSES[action]
+    except KeyError:
+        raise ValueError(
+            'Unknown lease expiry action %s. Expected one of %s' % (
+                action, ', '.join(sorted(LEASE_EXPIRED_STATUSES))
+            )
+        )
+
+    if now is None:
+        now = datetime.utcnow()
+
+    lease_expired = and_(
+        jobs.c.status == 'WORKING', jobs.c.lease_expires_at < now
+    )
+    # Cast, since PostgreSQL reads the branches of a CASE as text
+    status_after_expiry = cast(case(
+        [(jobs.c.attempts >= config.JOB_MAX_ATTEMPTS, 'FAILED')],
+        else_=new_status
+    ), jobs.c.status.type)
+    take_back = jobs.update().where(lease_expired).values(
+        status=status_after_expiry,
+        lease_expires_at=None,
+        version=jobs.c.version + 1
+    )
+
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            expired_jobs = connection.execute(take_back.returning(
+                jobs.c.job_id, jobs.c.service_id, jobs.c.status
+            )).fetchall()
+        else:
+            expired_jobs = connection.execute(
+                _lock_jobs(connection, select([
+                    jobs.c.job_id, jobs.c.service_id,
+                    status_after_expiry.label('status')
+                ]).where(lease_expired))
+            ).fetchall()
+
+            if expired_jobs:
+                connection.execute(take_back)
+
+    if not expired_jobs:
+        return []
+
+    for status in {job.status for job in expired_jobs}:
+        LOG.info(
+            'Moved %d jobs with expired leases to %s',
+            len([job for job in expired_jobs if job.status == status]), status
+        )
+
+    NOTIFICATIONS.publish_many(
+        {job.service_id for job in expired_jobs} |
+        {job.job_id for job in expired_jobs},
+        engine=engine
+    )
+
+    return [job.job_id for job in expired_jobs]
+
+
+def _lock_jobs(connection, query):
+    """
+    Take the write lock on the jobs that a query reads, until the end of
+    the transaction. SQLite has no ``SELECT ... FOR UPDATE``, so a write
+    that changes nothing is made first to take the lock on the database.
+
+    :return: The query, locking the rows that it reads where the database
+        supports it
+    """
+    if connection.dialect.name == 'sqlite':
+        connection.execute(
+            jobs.update().where(jobs.c.job_id == None).values(
+                version=jobs.c.version
+            )
+        )
+        return query
+
+    return query.with_for_update()
+
+
+@contextmanager
+def _reaper_lock(engine):
+    """
+    Try to take the advisory lock :data:`REAPER_LOCK_KEY` on PostgreSQL,
+    without waiting for it. Other databases have no advisory locks, and are
+    always reaped.
+
+    :return: A context manager giving ``True`` if this process may reap
+    """
+    if engine.dialect.name != 'postgresql':
+        yield True
+        return
+
+    with engine.connect() as connection:
+        acquired = connection.execute(
+            select([func.pg_try_advisory_lock(REAPER_LOCK_KEY)])
+        ).scalar()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(
+                    select([func.pg_advisory_unlock(REAPER_LOCK_KEY)])
+                )
+
+
+def reap(engine):
+    """
+    Flush buffered heartbeats, then reap dead services and stuck jobs,
+    unless another process holds the reaper's lock
+
+    :param engine: The engine connected to the database to scan
+    """
+    HEARTBEATS.flush(engine)
+
+    with _reaper_lock(engine) as acquired:
+        if not acquired:
+            return
+        reap_services(engine, grace_period=config.HEARTBEAT_FLUSH_INTERVAL)
+        reap_jobs(engine, action=config.JOB_LEASE_EXPIRED_ACTION)
+
+
+REAPER = PeriodicTask(
+    'topchef-reaper', config.REAPER_INTERVAL,
+    lambda: reap(config.database_engine)
+)
+
+
+def start_reaper():
+    """
+    Start reaping in a background thread of this process, unless
+    ``REAPER_INTERVAL`` is 0
+    """
+    if config.REAPER_INTERVAL > 0:
+        REAPER.start()
@@ -0,0 +1,78 @@
+"""
+Contains a helper for running maintenance work in the background of the
+server process
+"""
+import logging
+import threading
+
+LOG = logging.getLogger(__name__)
+
+
+class PeriodicTask(object):
+    """
+    Calls a function every ``interval`` seconds in a daemon thread. Errors
+    raised by the function are logged, and do not stop the task.
+
+    :var str name: The name of the thread running the task
+    :var float interval: The number of seconds between calls
+    """
+    def __init__(self, name, interval, function):
+        """
+        Instantiates the variables listed in the class description
+
+        :param callable function: The function to call. It takes no
+            arguments.
+        """
+        self.name = name
+        self.interval = interval
+        self._function = function
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Start the task, if it is not already running
+        """
+        with self._lock:
+            if self.is_running:
+                return
+
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the task, and wait for the call in progress to finish
+
+        :param float timeout: The longest time in seconds to wait
+        """
+        self._stopped.set()
+
+        if self.is_running and \
+                self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def run_once(self):
+        """
+        Call the function in the current thread, logging any error
+        """
+        try:
+            self._function()
+        except Exception:
+            LOG.exception('Periodic task %s failed', self.name)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.run_once()
+
+    def __repr__(self):
+        return '%s(name=%s, interval=%s)' % (
+            self.__class__.__name__, self.name, self.interval
+        )
@@ -0,0 +1,135 @@
+"""
+Contains a cache for the JSON schemas that services keep in the schema
+directory, along with the validators compiled from these schemas
+"""
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from jsonschema.validators import validator_for
+
+CachedSchema = namedtuple('CachedSchema', ['signature', 'schema', 'validator'])
+
+
+class SchemaCache(object):
+    """
+    A bounded, thread-safe cache of parsed JSON schemas, evicting the least
+    recently used schema when full.
+
+    Each entry holds the parsed schema, and an instance of the
+    ``jsonschema`` validator class matching the schema's ``$schema``, on
+    which ``check_schema`` has already been run. Entries are keyed by the
+    caller, and are stamped with the modification time, device, inode and
+    size of the file that they were read from. If the file changes on disk,
+    the entry is reloaded on the next lookup.
+
+    Files that are hard links to the same deduplicated document have the
+    same stamp, so keys whose files have the same stamp share one entry,
+    and the schema is only parsed and compiled once. Lookups return the
+    shared entry without copying it, so callers must not change the schema.
+    Callers that hand the schema on to code that might change it should
+    pass on a copy.
+
+    :var int max_size: The largest number of schemas that this cache holds
+    """
+    def __init__(self, max_size):
+        """
+        Instantiates the variables listed in the class description
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, path, load):
+        """
+        Return the schema stored in a file, parsing it and compiling its
+        validator if the cache does not hold the current version of the file
+
+        :param key: A hashable key identifying the schema
+        :param str path: The path to the file in which the schema is stored
+        :param callable load: A function taking the path to the file, and
+            returning the schema stored in it
+        :return: The cached schema and validator, which must not be changed
+        :rtype: CachedSchema
+        :raises: jsonschema.SchemaError if the file is not a valid schema
+        """
+        file_status = os.stat(path)
+        signature = (
+            file_status.st_mtime, file_status.st_dev, file_status.st_ino,
+            file_status.st_size
+        )
+
+        with self._lock:
+            entry = self._remove(key)
+            if entry is None or entry.signature != signature:
+                entry = self._shared.get(signature, [None])[0]
+            if entry is not None:
+                self._add(key, entry)
+                return entry
+
+        schema = load(path)
+        validator_class = validator_for(schema)
+        validator_class.check_schema(schema)
+
+        entry = CachedSchema(signature, schema, validator_class(schema))
+
+        with self._lock:
+            self._remove(key)
+            self._add(key, entry)
+
+        return entry
+
+    def invalidate(self, key):
+        """
+        Remove a schema from the cache. This should be called whenever the
+        file in which the schema is stored is written to.
+
+        :param key: The key of the schema to remove
+        """
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """
+        Remove all schemas from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self._shared.clear()
+
+    def _add(self, key, entry):
+        """
+        Insert an entry as the most recently used, evicting the least
+        recently used entries if the cache is full. This must be called
+        with the lock held.
+        """
+        self._entries[key] = entry
+        self._shared.setdefault(entry.signature, [entry, 0])[1] += 1
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        """
+        Remove the entry of a key, forgetting its shared entry once no other
+        key uses it. This must be called with the lock held.
+
+        :return: The removed entry, or ``None`` if the key had no entry
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        shared = self._shared.get(entry.signature)
+        if shared is not None:
+            shared[1] -= 1
+            if shared[1] <= 0:
+                del self._shared[entry.signature]
+
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '%s(max_size=%d)' % (self.__class__.__name__, self.max_size)
@@ -0,0 +1,45 @@
+"""
+Contains the JSON schemas that describe the request bodies accepted by the
+API. These are generated from the marshmallow schemas of the models. As
+the marshmallow schemas never change while the server runs, each document
+is generated once, on first use, and then served from memory.
+"""
+import json
+import hashlib
+from collections import namedtuple
+from marshmallow_jsonschema import JSONSchema
+from .models import Service, Job
+
+SchemaDocument = namedtuple('SchemaDocument', ['document', 'body', 'etag'])
+
+GENERATED_SCHEMAS = {
+    'service': Service.DetailedServiceSchema,
+    'job': Job.JobSchema,
+    'job_details': Job.DetailedJobSchema,
+    'job_update': Job.JobUpdateSchema
+}
+
+_DOCUMENTS = {}
+
+
+def get_schema_document(name):
+    """
+    :param str name: The name of the generated schema, which is a key of
+        ``GENERATED_SCHEMAS``
+    :return: The schema, its serialized JSON body, and an ETag for the body
+    :rtype: SchemaDocument
+    :raises: KeyError if there is no generated schema with this name
+    """
+    try:
+        return _DOCUMENTS[name]
+    except KeyError:
+        pass
+
+    document = JSONSchema().dump(GENERATED_SCHEMAS[name]()).data
+    body = json.dumps(document, sort_keys=True, indent=2)
+
+    schema_document = SchemaDocument(
+        document, body, hashlib.sha1(body.encode('utf-8')).hexdigest()
+    )
+    _DOCUMENTS[name] = schema_document
+    return schema_document
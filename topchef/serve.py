@@ -0,0 +1,159 @@
+"""
+Contains the production server, which runs the API in several gunicorn
+worker processes::
+
+    python -m topchef serve --workers 4 --threads 8
+
+The application is imported, and the schema directory and tables are
+created, once in the master process before the workers are forked. Each
+worker then throws away the database connections that it inherited, so that
+no connection is shared between processes.
+
+Several workers are only run on PostgreSQL. Other databases are served by
+one worker, as notifications for long polls only reach the process that
+published them, and each worker would run its own heartbeat buffer and
+reaper.
+
+Sending ``SIGHUP`` to the master restarts the workers gracefully, letting
+requests in progress finish within ``GRACEFUL_TIMEOUT`` seconds. As the
+application is preloaded, new code is only picked up by starting a new
+master, with ``SIGUSR2`` followed by ``SIGTERM`` to the old one.
+"""
+import os
+import logging
+import multiprocessing
+from .config import config
+from .database import METADATA
+from .heartbeats import HEARTBEATS
+from .reaper import start_reaper
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = object
+
+LOG = logging.getLogger(__name__)
+
+
+def default_worker_count():
+    """
+    :return: The number of workers to run if ``WORKERS`` is 0, which is
+        twice the number of cores, plus one
+    :rtype: int
+    """
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def prepare_master():
+    """
+    Create the schema directory and the tables, then close all database
+    connections, so that no worker inherits an open connection
+    """
+    if not os.path.isdir(config.SCHEMA_DIRECTORY):
+        os.mkdir(config.SCHEMA_DIRECTORY)
+
+    METADATA.create_all(bind=config.database_engine)
+    config.database_engine.dispose()
+
+
+def post_fork(server, worker):
+    """
+    Give a freshly-forked worker its own connection pool, and start the
+    background tasks that do not survive a fork
+    """
+    config.database_engine.dispose()
+    start_reaper()
+
+
+def worker_exit(server, worker):
+    """
+    Write the heartbeats buffered by a worker before it exits
+    """
+    try:
+        HEARTBEATS.flush(config.database_engine)
+    except Exception:
+        LOG.exception('Unable to flush heartbeats of worker %s', worker.pid)
+
+
+class TopChefServer(BaseApplication):
+    """
+    A gunicorn application that serves a preloaded WSGI application
+
+    :var application: The WSGI application to serve
+    :var dict options: The gunicorn settings
+    """
+    def __init__(self, application, options):
+        """
+        Instantiates the variables listed in the class description
+        """
+        if BaseApplication is object:
+            raise RuntimeError(
+                'The production server requires gunicorn. Install it with '
+                'pip install gunicorn'
+            )
+
+        self.application = application
+        self.options = options
+        super(TopChefServer, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def server_options(workers=None, threads=None, hostname=None, port=None):
+    """
+    :param int workers: The number of worker processes. By default, this is
+        ``WORKERS``, or :func:`default_worker_count` if that is 0. Only one
+        worker is run if the database is not PostgreSQL.
+    :param int threads: The number of threads per worker. By default, this
+        is ``THREADS``
+    :param str hostname: The address to listen on. By default, this is
+        ``HOSTNAME``
+    :param int port: The port to listen on. By default, this is ``PORT``
+    :return: The gunicorn settings for the server
+    :rtype: dict
+    """
+    if workers is None:
+        workers = int(config.WORKERS) or default_worker_count()
+
+    database_name = config.database_engine.dialect.name
+    if workers > 1 and database_name != 'postgresql':
+        LOG.warning(
+            'Running 1 worker instead of %d, as workers can only share '
+            'notifications through PostgreSQL, not %s',
+            workers, database_name
+        )
+        workers = 1
+
+    return {
+        'bind': '%s:%d' % (
+            hostname or config.HOSTNAME, int(port or config.PORT)
+        ),
+        'workers': workers,
+        'threads': threads or int(config.THREADS),
+        'preload_app': True,
+        'graceful_timeout': int(config.GRACEFUL_TIMEOUT),
+        'post_fork': post_fork,
+        'worker_exit': worker_exit
+    }
+
+
+def serve(**kwargs):
+    """
+    Run the production server until it is stopped. The keyword arguments
+    are those of :func:`server_options`.
+    """
+    from .api_server import app
+
+    options = server_options(**kwargs)
+    server = TopChefServer(app, options)
+
+    prepare_master()
+    LOG.info('Serving on %s with %d workers of %d threads',
+             options['bind'], options['workers'], options['threads'])
+    server.run()
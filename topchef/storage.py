@@ -0,0 +1,273 @@
+"""
+Contains the backends in which jobs keep their parameters and results.
+
+The backend is picked with the ``JOB_STORAGE`` configuration parameter.
+``filesystem`` stores them as JSON files in each job's directory in the
+schema directory. ``database`` stores them in the ``parameters`` and
+``result`` columns of the ``jobs`` table, so that no directory is made for
+each job.
+
+Results written to the file system that are longer than
+``RESULT_COMPRESSION_THRESHOLD`` bytes of JSON are stored gzipped, under the
+same file name. They are decompressed when they are read, and may be served
+as they are to clients that accept gzip, by :meth:`JobStorage.open_result`.
+"""
+import os
+import io
+import abc
+import json
+import gzip
+import zlib
+import errno
+import logging
+import six
+from .blobs import canonical_json
+from .config import config
+
+LOG = logging.getLogger(__name__)
+
+
+class JobStorage(six.with_metaclass(abc.ABCMeta, object)):
+    """
+    Base class for a place where jobs keep their parameters and results.
+    Backends must implement the reading and writing of both, or they cannot
+    be instantiated.
+
+    :var bool transactional: ``True`` if the backend writes to the job's
+        row, so that its writes are rolled back with the row
+    """
+    transactional = False
+
+    def register(self, job):
+        """
+        Prepare the storage for a newly-created job
+
+        :param job: The job that was created
+        :type job: :class:`topchef.models.Job`
+        """
+        pass
+
+    def unregister(self, job):
+        """
+        Throw away whatever was stored for a job whose row was rolled back
+
+        :param job: The job that was discarded
+        :type job: :class:`topchef.models.Job`
+        """
+        pass
+
+    @abc.abstractmethod
+    def read_parameters(self, job):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def write_parameters(self, job, parameters):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def read_result(self, job):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def write_result(self, job, result):
+        raise NotImplementedError()
+
+    def open_result(self, job):
+        """
+        Open the result of a job as it is stored, so that it can be sent to
+        a client without being parsed
+
+        :param job: The job whose result is to be opened
+        :type job: :class:`topchef.models.Job`
+        :return: A binary file holding the result as JSON, and its content
+            encoding, which is ``gzip`` or ``None``. If the job has no
+            result, ``None`` is returned.
+        :rtype: tuple | None
+        """
+        result = self.read_result(job)
+        if result is None:
+            return None
+        return io.BytesIO(json.dumps(result).encode('utf-8')), None
+
+    def __repr__(self):
+        return '%s()' % self.__class__.__name__
+
+
+class FileSystemStorage(JobStorage):
+    """
+    Keeps the parameters and result of a job as JSON files in the directory
+    given to the job by its ``file_manager``. Parameters are written with
+    :meth:`topchef.models.SchemaDirectoryOrganizer.write_deduplicated`, so
+    jobs submitted with the same parameters share one file.
+    """
+    def register(self, job):
+        job.file_manager.register(job)
+
+    def unregister(self, job):
+        job.file_manager.unregister(job)
+
+    def read_parameters(self, job):
+        parameters = self._read(
+            job, job.file_manager.JOB_PARAMETER_FILE_NAME
+        )
+        return {} if parameters is None else parameters
+
+    def write_parameters(self, job, parameters):
+        job.file_manager.write_deduplicated(
+            canonical_json(parameters), os.path.join(
+                job.file_manager[job], job.file_manager.JOB_PARAMETER_FILE_NAME
+            )
+        )
+
+    def read_result(self, job):
+        return self._read(job, job.file_manager.JOB_RESULT_FILE_NAME)
+
+    def write_result(self, job, result):
+        data = json.dumps(result)
+
+        threshold = config.RESULT_COMPRESSION_THRESHOLD
+        if threshold and len(data) > threshold:
+            data = compress(data)
+
+        job.file_manager.write(data, os.path.join(
+            job.file_manager[job], job.file_manager.JOB_RESULT_FILE_NAME
+        ))
+
+    def open_result(self, job):
+        path = os.path.join(
+            job.file_manager[job], job.file_manager.JOB_RESULT_FILE_NAME
+        )
+
+        try:
+            result_file = open(path, mode='rb')
+        except IOError as error:
+            if error.errno == errno.ENOENT:
+                return None
+            raise
+
+        is_compressed = result_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+        result_file.seek(0)
+        return result_file, 'gzip' if is_compressed else None
+
+    @staticmethod
+    def _read(job, file_name):
+        path = os.path.join(job.file_manager[job], file_name)
+
+        try:
+            with open(path, mode='rb') as json_file:
+                data = json_file.read()
+        except IOError as error:
+            if error.errno == errno.ENOENT:
+                return None
+            raise
+
+        if data[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+        return json.loads(data.decode('utf-8'))
+
+
+class DatabaseStorage(JobStorage):
+    """
+    Keeps the parameters and result of a job in the ``parameters`` and
+    ``result`` columns of its row in the ``jobs`` table. These are loaded
+    with the row, so reading them costs no extra queries or file access.
+    """
+    transactional = True
+
+    def read_parameters(self, job):
+        return {} if job._parameters is None else job._parameters
+
+    def write_parameters(self, job, parameters):
+        job._parameters = parameters
+
+    def read_result(self, job):
+        return job._result
+
+    def write_result(self, job, result):
+        job._result = result
+
+
+#: The first bytes of a gzip stream. JSON text never starts with these.
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def compress(data):
+    """
+    :param str data: The JSON text to compress
+    :return: The text, encoded as UTF-8 and gzipped with
+        ``RESULT_COMPRESSION_LEVEL``. The timestamp in the gzip header is
+        left out, so that equal texts compress to equal bytes.
+    :rtype: bytes
+    """
+    buffer = io.BytesIO()
+
+    with gzip.GzipFile(
+            fileobj=buffer, mode='wb', mtime=0,
+            compresslevel=int(config.RESULT_COMPRESSION_LEVEL)
+    ) as compressed_file:
+        compressed_file.write(data.encode('utf-8'))
+
+    return buffer.getvalue()
+
+
+STORAGE_BACKENDS = {
+    'filesystem': FileSystemStorage,
+    'database': DatabaseStorage
+}
+
+
+def storage_from_name(name):
+    """
+    :param str name: The name of the storage backend, as given in the
+        ``JOB_STORAGE`` configuration parameter
+    :return: The storage backend with this name
+    :rtype: JobStorage
+    :raises: ValueError if there is no backend with this name
+    """
+    try:
+        return STORAGE_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(
+            'Unknown job storage %s. Expected one of %s' % (
+                name, ', '.join(sorted(STORAGE_BACKENDS))
+            )
+        )
+
+
+def migrate_to_database(session, file_manager, batch_size=500):
+    """
+    Copy the parameters and results of all jobs that are stored in the
+    schema directory into the ``jobs`` table. Jobs that already have their
+    parameters in the database are skipped, so an interrupted migration can
+    be restarted. The files are left in place.
+
+    :param Session session: The session with which jobs are loaded and saved
+    :param SchemaDirectoryOrganizer file_manager: The manager of the schema
+        directory from which parameters and results are read
+    :param int batch_size: The number of jobs to copy per commit
+    :return: The number of jobs that were copied
+    :rtype: int
+    """
+    from .models import Job
+
+    source = FileSystemStorage()
+    target = DatabaseStorage()
+    jobs_copied = 0
+
+    while True:
+        batch = session.query(Job).filter(
+            Job._parameters.is_(None)
+        ).order_by(Job.id).limit(batch_size).all()
+
+        if not batch:
+            return jobs_copied
+
+        for job in batch:
+            job.file_manager = file_manager
+            target.write_parameters(job, source.read_parameters(job))
+            target.write_result(job, source.read_result(job))
+
+        session.commit()
+        jobs_copied += len(batch)
+        LOG.info('Copied %d jobs into the database', jobs_copied)